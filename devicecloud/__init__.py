@@ -4,13 +4,16 @@
 #
 # Copyright (c) 2014 Etherios, Inc. All rights reserved.
 # Etherios, Inc. is a Division of Digi International.
+from devicecloud.jsonstream import iter_page_items
 from devicecloud.util import validate_type
 
 from requests.auth import HTTPBasicAuth
 import logging
 import requests
+import threading
 import time
 import json
+import zlib
 
 from devicecloud.version import __version__
 import six
@@ -28,6 +31,14 @@ SUCCESSFUL_STATUS_CODES = [
     204,  # No Content (success for DELETE operation)
 ]
 
+# Compression settings for request bodies (see DeviceCloudConnection.enable_compression)
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_COMPRESSION_THRESHOLD = 1024  # bytes; smaller bodies are not worth compressing
+ACCEPTED_CONTENT_ENCODINGS = "gzip, deflate"
+
+# Size of the chunks in which response bodies are read when streaming JSON parsing is enabled
+STREAMING_JSON_CHUNK_SIZE = 64 * 1024
+
 logger = logging.getLogger("devicecloud")
 
 
@@ -58,16 +69,72 @@ class DeviceCloudConnection(object):
     def __init__(self, auth, base_url):
         self._auth = auth
         self._base_url = base_url
+        self._compression_level = None  # None when request compression is disabled
+        self._compression_threshold = DEFAULT_COMPRESSION_THRESHOLD
+        self._stats_lock = threading.Lock()
+        self._stats = None
+        self._streaming_json = False
+        self.reset_transfer_stats()
 
     def _make_url(self, path):
         if not path.startswith("/"):
             path = "/" + path
         return "%s%s" % (self._base_url, path)
 
+    def _prepare_body(self, data, compress, kwargs):
+        """Return the body to send, gzip compressing it if configured to do so"""
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        if not isinstance(data, six.binary_type):
+            return data, None  # e.g. a generator or file object; sent as-is
+
+        if compress is None:
+            compress = (self._compression_level is not None and
+                        len(data) >= self._compression_threshold)
+        if not compress:
+            return data, len(data)
+
+        level = self._compression_level
+        if level is None:
+            level = DEFAULT_COMPRESSION_LEVEL
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+        compressed = compressor.compress(data) + compressor.flush()
+        headers = kwargs.setdefault('headers', {})
+        headers['Content-Encoding'] = 'gzip'
+        return compressed, len(data)
+
+    def _record_transfer(self, request_body, uncompressed_size, response, streamed):
+        """Update the transfer statistics for a single request/response exchange"""
+        if isinstance(request_body, six.binary_type):
+            sent = len(request_body)
+        else:
+            sent = getattr(request_body, "len", 0)  # length of a file-like body, if known
+        content_length = response.headers.get('Content-Length')
+        if streamed:
+            received_decoded = 0  # counted by _iter_content as the caller consumes the body
+        else:
+            received_decoded = len(response.content)
+        received = int(content_length) if content_length is not None else received_decoded
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            self._stats["bytes_sent"] += sent
+            self._stats["bytes_sent_uncompressed"] += uncompressed_size or sent
+            self._stats["bytes_received"] += received
+            self._stats["bytes_received_decoded"] += received_decoded
+
+    def _iter_content(self, response, chunk_size):
+        """Iterate over the body of a streamed response, counting it in the transfer statistics"""
+        for chunk in response.iter_content(chunk_size):
+            with self._stats_lock:
+                self._stats["bytes_received_decoded"] += len(chunk)
+            yield chunk
+
     def _make_request(self, retries, method, url, **kwargs):
+        uncompressed_size = kwargs.pop('_uncompressed_size', None)
         remaining_attempts = retries + 1
         while remaining_attempts > 0:
             response = requests.request(method, url, auth=self._auth, **kwargs)
+            self._record_transfer(kwargs.get('data'), uncompressed_size, response, kwargs.get('stream', False))
             if response.status_code in SUCCESSFUL_STATUS_CODES:
                 return response
             remaining_attempts -= 1
@@ -100,11 +167,115 @@ class DeviceCloudConnection(object):
         while remaining_size > 0:
             reqparams = {"start": offset, "size": page_size}
             reqparams.update(params)
-            response = self.get_json(path, params=reqparams)
-            offset += page_size
-            remaining_size = int(response.get("remainingSize", "0"))
-            for item_json in response.get("items", []):
+            page, items = self.get_json_page(path, params=reqparams)
+            for item_json in items:
                 yield item_json
+            offset += page_size
+            remaining_size = int(page.get("remainingSize", "0"))
+
+    def get_json_page(self, path, retries=0, **kwargs):
+        """GET a page of a paged JSON resource, returning ``(page, items)``
+
+        ``items`` is an iterable over the elements of the ``items`` list in the response
+        and ``page`` is a dictionary with the remaining top-level keys of the response
+        (e.g. ``remainingSize`` or ``pageCursor``).
+
+        If streaming JSON parsing has been enabled with :meth:`enable_streaming_json`,
+        ``items`` is a generator which decodes each item as the response body is read,
+        and ``page`` is only guaranteed to be complete once ``items`` has been exhausted.
+        Otherwise, the whole response has been parsed before this method returns.
+
+        This method takes the same arguments as :meth:`get_json`.
+
+        """
+        if not self._streaming_json:
+            page = self.get_json(path, retries, **kwargs)
+            return page, page.pop("items", [])
+
+        url = self._make_url(path)
+        headers = kwargs.setdefault('headers', {})
+        headers.update({'Accept': 'application/json', 'Accept-Encoding': ACCEPTED_CONTENT_ENCODINGS})
+        kwargs['stream'] = True
+        response = self._make_request(retries, "GET", url, **kwargs)
+        page = {}
+
+        def iter_items():
+            try:
+                for item in iter_page_items(self._iter_content(response, STREAMING_JSON_CHUNK_SIZE), page):
+                    yield item
+            finally:
+                response.close()
+        return page, iter_items()
+
+    def enable_streaming_json(self):
+        """Parse paged JSON responses incrementally as they are received
+
+        By default, each page of a paged resource (as iterated by :meth:`iter_json_pages`
+        and :meth:`.DataStream.read`) is downloaded in full and parsed with ``json.loads``
+        before any items are returned.  With streaming enabled, the response body is read in
+        chunks and each item is returned as soon as it has been decoded, which reduces the
+        memory required for large pages and returns the first item sooner.  The optional
+        ``ijson`` package is used for parsing if it is installed.
+
+        """
+        self._streaming_json = True
+
+    def disable_streaming_json(self):
+        """Parse paged JSON responses in full once received (the default)"""
+        self._streaming_json = False
+
+    def enable_compression(self, level=DEFAULT_COMPRESSION_LEVEL, threshold=DEFAULT_COMPRESSION_THRESHOLD):
+        """Compress the bodies of POST and PUT requests using gzip
+
+        Bulk requests such as those made by :meth:`.StreamsAPI.bulk_write_datapoints` consist
+        of highly repetitive XML which typically compresses by an order of magnitude.  When
+        enabled, bodies of at least ``threshold`` bytes will be compressed and sent with
+        a ``Content-Encoding: gzip`` header.  Compression may also be requested or suppressed
+        on a per-request basis using the ``compress`` argument to :meth:`post` and :meth:`put`.
+
+        :param int level: The zlib compression level to use (1-9).  Higher levels trade CPU
+            time for smaller requests.
+        :param int threshold: The minimum size (in bytes) of a body before it will be compressed.
+
+        """
+        level = validate_type(level, *six.integer_types)
+        if not 1 <= level <= 9:
+            raise ValueError("Compression level must be between 1 and 9")
+        self._compression_level = level
+        self._compression_threshold = validate_type(threshold, *six.integer_types)
+
+    def disable_compression(self):
+        """Stop compressing request bodies (the default)"""
+        self._compression_level = None
+        self._compression_threshold = DEFAULT_COMPRESSION_THRESHOLD
+
+    def get_transfer_stats(self):
+        """Get a dictionary with counters for the data transferred over this connection
+
+        The following keys are included:
+
+        * ``requests`` - the number of HTTP requests made
+        * ``bytes_sent`` - request body bytes as sent over the wire
+        * ``bytes_sent_uncompressed`` - request body bytes prior to any compression
+        * ``bytes_received`` - response body bytes as received over the wire (when the
+          server provides a ``Content-Length``)
+        * ``bytes_received_decoded`` - response body bytes after decompression (streamed
+          response bodies are counted as they are read)
+
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def reset_transfer_stats(self):
+        """Reset all counters returned by :meth:`get_transfer_stats` to zero"""
+        with self._stats_lock:
+            self._stats = {
+                "requests": 0,
+                "bytes_sent": 0,
+                "bytes_sent_uncompressed": 0,
+                "bytes_received": 0,
+                "bytes_received_decoded": 0,
+            }
 
     def ping(self):
         """Ping the Device Cloud using the authorization provided
@@ -159,11 +330,11 @@ class DeviceCloudConnection(object):
 
         url = self._make_url(path)
         headers = kwargs.setdefault('headers', {})
-        headers.update({'Accept': 'application/json'})
+        headers.update({'Accept': 'application/json', 'Accept-Encoding': ACCEPTED_CONTENT_ENCODINGS})
         response = self._make_request(retries, "GET", url, **kwargs)
         return json.loads(response.text)
 
-    def post(self, path, data, retries=0, **kwargs):
+    def post(self, path, data, retries=0, compress=None, **kwargs):
         """Perform an HTTP POST request of the specified path in the device cloud
 
         Make an HTTP POST request against the device cloud with this accounts
@@ -177,15 +348,20 @@ class DeviceCloudConnection(object):
             unsuccessful response is received.  Most likely, you should leave this at 0.
         :param data: The data to be posted in the body of the POST request (see docs for
             ``requests.post``
+        :param compress: If True or False, force gzip compression of the request body on
+            or off (regardless of size).  If None, the settings from :meth:`enable_compression`
+            are used.
         :raises DeviceCloudHttpException: if a non-success response to the request is received
             from the device cloud
         :returns: A requests ``Response`` object
 
         """
         url = self._make_url(path)
-        return self._make_request(retries, "POST", url, data=data, **kwargs)
+        data, uncompressed_size = self._prepare_body(data, compress, kwargs)
+        return self._make_request(retries, "POST", url, data=data,
+                                  _uncompressed_size=uncompressed_size, **kwargs)
 
-    def put(self, path, data, retries=0, **kwargs):
+    def put(self, path, data, retries=0, compress=None, **kwargs):
         """Perform an HTTP PUT request of the specified path in the device cloud
 
         Make an HTTP PUT request against the device cloud with this accounts
@@ -199,6 +375,9 @@ class DeviceCloudConnection(object):
             unsuccessful response is received.  Most likely, you should leave this at 0.
         :param data: The data to be posted in the body of the POST request (see docs for
             ``requests.post``
+        :param compress: If True or False, force gzip compression of the request body on
+            or off (regardless of size).  If None, the settings from :meth:`enable_compression`
+            are used.
         :raises DeviceCloudHttpException: if a non-success response to the request is received
             from the device cloud
         :returns: A requests ``Response`` object
@@ -206,7 +385,9 @@ class DeviceCloudConnection(object):
         """
 
         url = self._make_url(path)
-        return self._make_request(retries, "PUT", url, data=data, **kwargs)
+        data, uncompressed_size = self._prepare_body(data, compress, kwargs)
+        return self._make_request(retries, "PUT", url, data=data,
+                                  _uncompressed_size=uncompressed_size, **kwargs)
 
     def delete(self, path, retries=0, **kwargs):
         """Perform an HTTP DELETE request of the specified path in the device cloud
@@ -226,7 +407,7 @@ class DeviceCloudConnection(object):
 
         """
         url = self._make_url(path)
-        return self._make_request(retries, "DELETE", url)
+        return self._make_request(retries, "DELETE", url, **kwargs)
 
 
 class DeviceCloud(object):
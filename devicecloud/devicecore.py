@@ -4,11 +4,19 @@
 #
 # Copyright (c) 2014 Etherios, Inc. All rights reserved.
 # Etherios, Inc. is a Division of Digi International.
+import datetime
+import json
+import logging
+import os
+import re
 import sys
+import time
+from xml.sax.saxutils import escape
 
 from devicecloud.apibase import APIBase
-from devicecloud.conditions import Attribute, Expression
-from devicecloud.util import iso8601_to_dt, validate_type
+from devicecloud.conditions import Attribute, Expression, Combination, Comparison
+from devicecloud.util import iso8601_to_dt, validate_type, isoformat, to_none_or_dt, iter_concurrently, \
+    RateLimiter
 import six
 
 
@@ -16,8 +24,18 @@ dev_mac = Attribute('devMac')
 group_id = Attribute('grpId')
 group_path = Attribute('grpPath')
 dev_connectware_id = Attribute('devConnectwareId')
+dev_vendor_id = Attribute('dvVendorId')
+dev_record_start_date = Attribute('devRecordStartDate')
 # TODO: Can we support location based device lookups? (e.g. lat/long?)
 
+# Many proxies and servers reject request lines longer than this
+DEFAULT_MAX_URL_LENGTH = 2000
+
+# Number of seconds a GroupTree returned by get_group_tree is reused for
+DEFAULT_GROUP_TREE_TTL = 300
+
+logger = logging.getLogger("devicecloud.devicecore")
+
 
 ADD_GROUP_TEMPLATE = \
 """
@@ -34,8 +52,9 @@ class DeviceCoreAPI(APIBase):
     def __init__(self, conn, sci):
         APIBase.__init__(self, conn)
         self._sci = sci
+        self._group_tree = None
 
-    def get_devices(self, condition=None, page_size=1000):
+    def get_devices(self, condition=None, page_size=1000, fields=None):
         """Iterates over each :class:`Device` for this device cloud account
 
         Examples::
@@ -58,25 +77,421 @@ class DeviceCoreAPI(APIBase):
             an iterator over all devices will be returned.
         :param int page_size: The number of results to fetch in a
             single page.  In general, the default will suffice.
+        :param fields: If not None, a list of the attribute names (or :class:`.Attribute`
+            objects) which should be kept for each device, e.g. ``["devMac"]``.  The
+            device id and connectware id are always kept.  The DeviceCore web service
+            does not support selecting fields, so this reduces the memory held by
+            large listings rather than the amount transferred.  Accessing any other
+            attribute of a returned device loads its full metadata on demand.
         :returns: Iterator over each :class:`~Device` in this device cloud
             account in the form of a generator object.
         """
 
         condition = validate_type(condition, type(None), Expression, *six.string_types)
         page_size = validate_type(page_size, *six.integer_types)
+        fields = _validate_fields(fields, ("id", "devConnectwareId"))
 
         params = {"embed": "true"}
         if condition is not None:
-            params["condition"] = condition.compile()
+            params["condition"] = condition.compile() if isinstance(condition, Expression) else condition
 
         for device_json in self._conn.iter_json_pages("/ws/DeviceCore", page_size=page_size, **params):
-            yield Device(self._conn, self._sci, device_json)
+            if fields is not None:
+                device_json = _project(device_json, fields)
+            yield Device(self._conn, self._sci, device_json, partial=fields is not None)
+
+    def map(self, fn, condition=None, max_workers=8, rate=None, progress=None, page_size=1000):
+        """Call ``fn`` on each device matching ``condition`` using a pool of threads
+
+        Devices are streamed from the paged device listing into a bounded pool of
+        ``max_workers`` threads, so operations that make requests for each device
+        (refreshing metadata, changing groups, sending SCI requests, ...) scale with
+        the concurrency available rather than with the number of devices.  Errors
+        raised by ``fn`` are collected rather than stopping the other calls.
+
+        Example::
+
+            def firmware(device):
+                return device.get_device_json(use_cached=False).get("dpFirmwareLevelDesc")
+
+            def report(completed, total):
+                print "%d devices done" % completed
+
+            for device, result, exception in dc.devicecore.map(firmware, rate=20, progress=report):
+                if exception is not None:
+                    print "%s failed: %s" % (device.get_mac(), exception)
+
+        :param fn: Callable taking a :class:`Device`
+        :param condition: An optional :class:`.Expression` limiting the devices
+        :param int max_workers: The maximum number of calls to ``fn`` running at once
+        :param rate: If not None, the maximum number of calls to ``fn`` started per second
+        :param progress: If not None, a callable called as ``progress(num_completed, None)``
+            each time a call completes (the total is not known while devices are being paged)
+        :param int page_size: The number of devices to fetch in a single page
+        :return: A list of ``(device, result, exception)`` tuples, one per device, in
+            order of completion.  ``exception`` is None if ``fn`` returned normally.
+
+        """
+        rate = validate_type(rate, type(None), float, *six.integer_types)
+        if rate is not None:
+            limiter = RateLimiter(rate)
+
+            def call(device):
+                limiter.acquire()
+                return fn(device)
+        else:
+            call = fn
+
+        devices = self.get_devices(condition, page_size=page_size)
+        return list(iter_concurrently(call, devices, max_workers=max_workers, progress=progress))
+
+    def get_device_index(self, condition=None, page_size=1000, compact=False):
+        """Load devices into a :class:`DeviceIndex` for fast local lookups
+
+        This fetches every device matching ``condition`` (all devices by default)
+        using paged requests and returns an index which can answer lookups by
+        connectware id, MAC address, device id, group path, tag, and vendor id (as
+        well as many :class:`.Expression` conditions) without further requests.
+
+        Example::
+
+            index = dc.devicecore.get_device_index()
+            device = index.get_by_mac("00:40:9D:58:17:5B")
+            for device in index.find(group_path == "/7603_Etherios/Demo/"):
+                print device.get_connectware_id()
+
+        :param condition: An optional :class:`.Expression` limiting the devices loaded
+        :param int page_size: The number of results to fetch in a single page
+        :param bool compact: If True, device records are stored as compact serialized
+            JSON rather than python dictionaries.  This reduces memory use considerably
+            at the cost of decoding a record each time a device is returned.
+        :return: A loaded :class:`DeviceIndex`
+
+        """
+        index = DeviceIndex(self, condition=condition, page_size=page_size, compact=compact)
+        index.refresh()
+        return index
+
+    def sync(self, snapshot_path, condition=None, timestamp_attribute=dev_record_start_date,
+             detect_deletions=True, page_size=1000):
+        """Incrementally synchronize a local snapshot of DeviceCore with the device cloud
+
+        The first sync against a snapshot path downloads every device (matching
+        ``condition``, if provided).  Subsequent syncs only request the devices whose
+        ``timestamp_attribute`` is at or after the watermark recorded by the previous
+        sync and merge them into the snapshot, so the cost of a sync is proportional
+        to the number of changed devices rather than to the size of the fleet.
+
+        Because DeviceCore records are versioned, a new record (with a new
+        ``devRecordStartDate``) is created each time a device is modified; this is
+        used as the update timestamp by default.  The watermark is the largest
+        timestamp seen in results from the device cloud, so clock differences between
+        this machine and the device cloud do not cause changes to be missed.
+
+        Devices which have been removed from the account never show up as changes.
+        If ``detect_deletions`` is True, a listing of device ids only (without the
+        embedded device records) is requested and devices missing from it are
+        removed from the snapshot.
+
+        Conditions are compiled without parentheses, so a ``condition`` containing an
+        ``or`` cannot be safely combined with the watermark.  Such syncs fall back to
+        downloading every matching device each time (with a warning logged); devices
+        missing from that listing are treated as deleted.
+
+        The snapshot and watermark are persisted as JSON at ``snapshot_path``.  It is
+        written to a temporary file which replaces the snapshot once complete.
+
+        Example::
+
+            result = dc.devicecore.sync("/var/lib/myapp/devices.json")
+            for device in result.get_devices():
+                print device.get_mac()
+            print "%d changed, %d removed" % (len(result.get_updated()), len(result.get_deleted()))
+
+        :param str snapshot_path: Path of the local snapshot file (created if it does not exist)
+        :param condition: An optional :class:`.Expression` limiting the devices synchronized
+        :param timestamp_attribute: The :class:`.Attribute` (or attribute name) that is
+            updated on the device cloud when a device changes
+        :param bool detect_deletions: If True, remove devices from the snapshot which no
+            longer exist on the device cloud
+        :param int page_size: The number of results to fetch in a single page
+        :return: A :class:`DeviceCoreSyncResult` describing the snapshot and the changes
+        :raises ValueError: If the existing snapshot was created with a different condition
+
+        """
+        snapshot_path = validate_type(snapshot_path, *six.string_types)
+        condition = validate_type(condition, type(None), Expression)
+        timestamp_attribute = validate_type(timestamp_attribute, Attribute, *six.string_types)
+        detect_deletions = validate_type(detect_deletions, bool)
+        page_size = validate_type(page_size, *six.integer_types)
+
+        if not isinstance(timestamp_attribute, Attribute):
+            timestamp_attribute = Attribute(timestamp_attribute)
+        timestamp_name = str(timestamp_attribute)
+        condition_str = condition.compile() if condition is not None else None
+
+        snapshot = {"condition": condition_str, "watermark": None, "devices": {}}
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "r") as f:
+                snapshot = json.load(f)
+            if snapshot.get("condition") != condition_str:
+                raise ValueError("Snapshot %r was created with condition %r, not %r" %
+                                 (snapshot_path, snapshot.get("condition"), condition_str))
+        devices = snapshot["devices"]
+        watermark = snapshot["watermark"]
+
+        full_sync = watermark is None or _contains_or(condition)
+        if watermark is not None and full_sync:
+            logger.warning("Sync condition %r contains 'or' and cannot be combined with the "
+                           "watermark; downloading all matching devices", condition_str)
+
+        query = condition
+        if not full_sync:
+            # ties on the watermark are refetched rather than risking missed updates.
+            # Conditions are compiled without parentheses, so the user condition is
+            # distributed over the "or" rather than and'ed with it.
+            newer = timestamp_attribute > watermark
+            tied = timestamp_attribute == watermark
+            if condition is None:
+                query = newer | tied
+            else:
+                query = (condition & newer) | (condition & tied)
+
+        added, updated = [], []
+        seen = set()
+        params = {"embed": "true"}
+        if query is not None:
+            params["condition"] = query.compile()
+        for device_json in self._conn.iter_json_pages("/ws/DeviceCore", page_size=page_size, **params):
+            device_id = device_json["id"]["devId"]
+            seen.add(device_id)
+            if device_id not in devices:
+                added.append(device_id)
+            elif devices[device_id] != device_json:
+                updated.append(device_id)
+            devices[device_id] = device_json
+            timestamp = device_json.get(timestamp_name)
+            if timestamp and (watermark is None or timestamp > watermark):
+                watermark = timestamp
+
+        deleted = []
+        if detect_deletions and snapshot["watermark"] is not None:
+            if full_sync:
+                existing = seen
+            else:
+                params = {}
+                if condition is not None:
+                    params["condition"] = condition_str
+                existing = set(item["id"]["devId"] for item in
+                               self._conn.iter_json_pages("/ws/DeviceCore", page_size=page_size, **params))
+            deleted = sorted(device_id for device_id in devices if device_id not in existing)
+            for device_id in deleted:
+                del devices[device_id]
+
+        snapshot["watermark"] = watermark
+        temp_path = snapshot_path + ".tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+        os.rename(temp_path, snapshot_path)
+
+        return DeviceCoreSyncResult(
+            [Device(self._conn, self._sci, device_json) for device_json in devices.values()],
+            added, updated, deleted, watermark)
+
+    def refresh(self, devices, max_workers=4, max_url_length=DEFAULT_MAX_URL_LENGTH):
+        """Update the cached metadata of many devices using a small number of requests
+
+        Calling ``device.get_device_json(use_cached=False)`` on each device makes one
+        request per device.  This method instead combines many connectware ids into
+        ``devConnectwareId='...' or devConnectwareId='...'`` conditions, each sized so
+        that the resulting request URL stays under ``max_url_length``, and performs
+        those queries concurrently.  The cached JSON of each :class:`Device` is updated
+        in place.
+
+        Example::
+
+            devices = list(dc.devicecore.get_devices())
+            ...
+            dc.devicecore.refresh(devices)
+            connected = [d for d in devices if d.is_connected()]
+
+        :param devices: An iterable of :class:`Device` objects to refresh
+        :param int max_workers: The maximum number of queries to perform concurrently
+        :param int max_url_length: The maximum length of the URL for each query
+        :return: A list of the devices which were not found on the device cloud (for
+            instance, because they have been removed from the account).  The cached
+            data for these devices is left unchanged.
+        :raises ValueError: If a device has no cached metadata to identify it by
+        :raises DeviceCloudHttpException: If any query failed.  The devices covered by
+            the other queries will still have been refreshed.
+
+        """
+        devices = list(devices)
+        max_workers = validate_type(max_workers, *six.integer_types)
+        max_url_length = validate_type(max_url_length, *six.integer_types)
+
+        devices_by_connectware_id = {}
+        for device in devices:
+            validate_type(device, Device)
+            if device._device_json is None:
+                raise ValueError("Device has no cached metadata to refresh")
+            devices_by_connectware_id.setdefault(device.get_connectware_id(), []).append(device)
+
+        def query(condition):
+            params = {"embed": "true", "condition": condition.compile()}
+            return list(self._conn.iter_json_pages("/ws/DeviceCore", **params))
+
+        found = set()
+        first_exception = None
+        batches = self._get_connectware_id_conditions(sorted(devices_by_connectware_id), max_url_length)
+        for _, items, exception in iter_concurrently(query, batches, max_workers=max_workers):
+            if exception is not None:
+                first_exception = first_exception or exception
+                continue
+            for device_json in items:
+                connectware_id = device_json.get("devConnectwareId")
+                for device in devices_by_connectware_id.get(connectware_id, []):
+                    device._device_json = device_json
+                    device._partial = False
+                found.add(connectware_id)
+
+        if first_exception is not None:
+            raise first_exception
+        return [device for device in devices if device.get_connectware_id() not in found]
+
+    def _get_connectware_id_conditions(self, connectware_ids, max_url_length):
+        """Return a list of or'ed connectware id conditions, each fitting in a URL"""
+        # start/size may be up to 10 characters each
+        base_length = len(self._conn._make_url("/ws/DeviceCore")) + len(six.moves.urllib.parse.urlencode(
+            {"start": "0" * 10, "size": "0" * 10, "embed": "true", "condition": ""})) + 1
+        batches = []
+        terms, length = [], base_length
+        for connectware_id in connectware_ids:
+            term = dev_connectware_id == connectware_id
+            term_length = len(six.moves.urllib.parse.quote_plus(" or " + term.compile()))
+            if terms and length + term_length > max_url_length:
+                batches.append(terms)
+                terms, length = [], base_length
+            terms.append(term)
+            length += term_length
+        if terms:
+            batches.append(terms)
+        return [_combine_balanced(terms, " or ") for terms in batches]
+
+    def set_groups(self, assignments, batch_size=100, max_workers=4):
+        """Move many devices into groups using batched requests
+
+        Each call to :meth:`Device.add_to_group` sends a separate request.  This method
+        packs the ``<DeviceCore>`` elements for many devices into a single ``<list>``
+        request body, ``batch_size`` devices at a time, and sends the batches
+        concurrently.  Groups which do not exist are created.
+
+        Example::
+
+            devices = dc.devicecore.get_devices(group_path == "/staging/")
+            outcomes = dc.devicecore.set_groups(dict((d, "/production/") for d in devices))
+            failed = [d for d, exception in outcomes.items() if exception is not None]
+
+        :param dict assignments: Mapping of :class:`Device` (or connectware id) to the
+            path of the group it should be moved to.  A path of ``''`` places the device
+            in the root group.
+        :param int batch_size: The maximum number of devices updated in each request
+        :param int max_workers: The maximum number of requests to perform concurrently
+        :return: Mapping of each key of ``assignments`` to None if its group was set
+            successfully or to the exception raised by the request covering it.  The
+            cached group path of each successfully moved :class:`Device` is updated.
+
+        """
+        assignments = validate_type(assignments, dict)
+        batch_size = validate_type(batch_size, *six.integer_types)
+        max_workers = validate_type(max_workers, *six.integer_types)
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        outcomes = {}
+        pending = []
+        for target, group_path in assignments.items():
+            validate_type(target, Device, *six.string_types)
+            validate_type(group_path, *six.string_types)
+            if isinstance(target, Device):
+                if target._device_json is not None and target.get_group_path() == group_path:
+                    outcomes[target] = None  # already in the group, nothing to send
+                    continue
+                connectware_id = target.get_connectware_id()
+            else:
+                connectware_id = target
+            pending.append((target, connectware_id, group_path))
+
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+        def put_batch(batch):
+            body = "<list>{}</list>".format("".join(
+                ADD_GROUP_TEMPLATE.format(connectware_id=escape(connectware_id), group_path=escape(group_path))
+                for _, connectware_id, group_path in batch))
+            self._conn.put("/ws/DeviceCore", body)
+
+        for batch, _, exception in iter_concurrently(put_batch, batches, max_workers=max_workers):
+            for target, _, group_path in batch:
+                outcomes[target] = exception
+                if exception is None and isinstance(target, Device) and target._device_json is not None:
+                    target._device_json["grpPath"] = group_path
+        return outcomes
+
+    def export_snapshot(self, path, condition=None, page_size=1000):
+        """Write the metadata of all devices to a compact snapshot file
+
+        Devices are streamed from the paged device listing directly to disk, so the
+        inventory is never held in memory.  The snapshot can be opened again with
+        :meth:`load_snapshot`.  See :mod:`devicecloud.snapshot` for the file format.
+
+        Example::
+
+            dc.devicecore.export_snapshot("/var/lib/inventory/devices.snap")
+
+        :param str path: The path of the snapshot file to write (replaced if it exists)
+        :param condition: An optional :class:`.Expression` limiting the devices exported
+        :param int page_size: The number of results to fetch in a single page
+        :return: The number of devices written to the snapshot
+
+        """
+        from devicecloud.snapshot import write_snapshot  # prevent circular imports
+
+        return write_snapshot(path, self.get_devices(condition, page_size=page_size))
+
+    def load_snapshot(self, path):
+        """Open a snapshot written by :meth:`export_snapshot`
+
+        The file is memory-mapped and only its trailer is read when opening, so this
+        is fast regardless of the number of devices.  Devices are decoded on demand.
+
+        Example::
+
+            with dc.devicecore.load_snapshot("/var/lib/inventory/devices.snap") as snapshot:
+                device = snapshot.get("00000000-00000000-00409DFF-FF58175B")
+
+        :param str path: The path of the snapshot file
+        :return: A :class:`~devicecloud.snapshot.DeviceSnapshot`
+        :raises SnapshotFormatException: If the file is not a valid snapshot
+
+        """
+        from devicecloud.snapshot import DeviceSnapshot  # prevent circular imports
+
+        return DeviceSnapshot(self._conn, self._sci, validate_type(path, *six.string_types))
 
     def get_group_tree_root(self, page_size=1000):
         r"""Return the root group for this accounts' group tree
 
         This will return the root group for this tree but with all links
-        between nodes (i.e. children starting from root) populated.
+        between nodes (i.e. children starting from root) populated.  The
+        tree is always fetched from the device cloud; see :meth:`get_group_tree`
+        for a cached tree with lookups by path and id.
 
         Examples::
 
@@ -84,21 +499,9 @@ class DeviceCoreAPI(APIBase):
             dc.devicecore.get_group_tree_root().print_subtree()
 
             # gather statistics about devices in each group including
-            # the count from its subgroups (recursively)
-            #
-            # This also shows how you can go from a group reference to devices
-            # for that particular group.
-            stats = {}  # group -> devices count including children
-            def count_nodes(group):
-                count_for_this_node = \
-                    len(list(dc.devicecore.get_devices(group_path == group.get_path())))
-                subnode_count = 0
-                for child in group.get_children():
-                    subnode_count += count_nodes(child)
-                total = count_for_this_node + subnode_count
-                stats[group] = total
-                return total
-            count_nodes(dc.devicecore.get_group_tree_root())
+            # the count from its subgroups (recursively).  This makes
+            # one paged scan of all devices rather than a query per group.
+            stats = dc.devicecore.get_group_tree().device_counts()
 
         :param int page_size: The number of results to fetch in a
             single page.  In general, the default will suffice.
@@ -106,22 +509,34 @@ class DeviceCoreAPI(APIBase):
             hierarchy.
 
         """
+        return self.get_group_tree(ttl=0, page_size=page_size).get_root()
 
-        # first pass, build mapping
-        group_map = {}  # map id -> group
-        page_size = validate_type(page_size, *six.integer_types)
-        for group in self.get_groups(page_size=page_size):
-            group_map[group.get_id()] = group
+    def get_group_tree(self, ttl=DEFAULT_GROUP_TREE_TTL, page_size=1000):
+        """Return a cached :class:`GroupTree` for this account
 
-        # second pass, find root and populate list of children for each node
-        root = None
-        for group_id, group in group_map.items():
-            if group.is_root():
-                root = group
-            else:
-                parent = group_map[group.get_parent_id()]
-                parent.add_child(group)
-        return root
+        The group tree is fetched from the device cloud the first time this is
+        called and reused for up to ``ttl`` seconds afterwards.  A ``ttl`` of 0
+        forces the tree to be fetched again.
+
+        Example::
+
+            tree = dc.devicecore.get_group_tree()
+            demo = tree.get_by_path("/7603_Etherios/Demo/")
+            for group in tree.iter_descendants(demo):
+                print group.get_path()
+
+        :param ttl: The maximum age in seconds of a cached tree which may be returned
+        :param int page_size: The number of results to fetch in a single page
+        :return: A :class:`GroupTree`
+
+        """
+        ttl = validate_type(ttl, float, *six.integer_types)
+        page_size = validate_type(page_size, *six.integer_types)
+        tree = self._group_tree
+        if tree is None or tree.get_age() >= ttl:
+            tree = GroupTree(self, list(self.get_groups(page_size=page_size)), page_size=page_size)
+            self._group_tree = tree
+        return tree
 
     def get_groups(self, condition=None, page_size=1000):
         """Return an iterator over all groups in this device cloud account
@@ -157,6 +572,396 @@ class DeviceCoreAPI(APIBase):
             yield Group.from_json(group_data)
 
 
+class GroupTree(object):
+    """A snapshot of the group hierarchy of an account with fast lookups
+
+    Group trees are returned by :meth:`DeviceCoreAPI.get_group_tree`.  Groups may be
+    looked up by path or by id in constant time, and the ancestors and descendants
+    of any group may be iterated without making further requests.
+
+    """
+
+    def __init__(self, devicecore_api, groups, page_size=1000):
+        self._devicecore_api = devicecore_api
+        self._page_size = page_size
+        self._created = time.time()
+        self._root = None
+        self._by_id = {}
+        self._by_path = {}
+        for group in groups:
+            self._by_id[group.get_id()] = group
+            self._by_path[group.get_path()] = group
+        for group in self._by_id.values():
+            if group.is_root():
+                self._root = group
+            else:
+                self._by_id[group.get_parent_id()].add_child(group)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def get_age(self):
+        """Get the number of seconds since this tree was fetched"""
+        return time.time() - self._created
+
+    def get_root(self):
+        """Get the root :class:`Group` of the tree"""
+        return self._root
+
+    def get_groups(self):
+        """Get a list of every :class:`Group` in the tree"""
+        return list(self._by_id.values())
+
+    def get_by_path(self, path):
+        """Get the :class:`Group` with the provided path or None"""
+        return self._by_path.get(path)
+
+    def get_by_id(self, group_id):
+        """Get the :class:`Group` with the provided id or None"""
+        return self._by_id.get(group_id)
+
+    def iter_ancestors(self, group):
+        """Iterate over the parent of ``group``, its parent, and so on up to the root"""
+        while not group.is_root():
+            group = self._by_id[group.get_parent_id()]
+            yield group
+
+    def iter_descendants(self, group):
+        """Iterate over every group below ``group`` in the tree (depth first, pre-order)"""
+        stack = list(reversed(group.get_children()))
+        while stack:
+            child = stack.pop()
+            yield child
+            stack.extend(reversed(child.get_children()))
+
+    def device_counts(self, device_index=None):
+        """Count the devices in each group, including those in its subgroups
+
+        Counting devices by issuing a query per group takes one request for each group
+        in the account.  This method instead makes a single paged scan over all devices
+        (or uses an existing :class:`DeviceIndex`, making no requests at all) and
+        aggregates the counts up the tree in linear time.
+
+        Devices in the root group have a group path of ``''`` and are counted there.
+        Devices in groups created since this tree was fetched are not counted.
+
+        :param device_index: An optional :class:`DeviceIndex` to count devices from
+        :return: Mapping of each :class:`Group` in the tree to the number of devices in
+            that group or any of its descendants
+
+        """
+        device_index = validate_type(device_index, type(None), DeviceIndex)
+        if device_index is not None:
+            devices = device_index
+        else:
+            devices = self._devicecore_api.get_devices(page_size=self._page_size)
+
+        direct_counts = {}
+        for device in devices:
+            path = device.get_group_path()
+            direct_counts[path] = direct_counts.get(path, 0) + 1
+
+        counts = {}
+        if self._root is None:
+            return counts
+        # children are always visited after their parents in pre-order, so walking
+        # that order backwards totals every subtree before it is needed
+        order = [self._root] + list(self.iter_descendants(self._root))
+        for group in reversed(order):
+            total = direct_counts.get(group.get_path(), 0)
+            if group is self._root:
+                total += direct_counts.get("", 0)
+            for child in group.get_children():
+                total += counts[child]
+            counts[group] = total
+        return counts
+
+
+class DeviceCoreSyncResult(object):
+    """The result of a call to :meth:`DeviceCoreAPI.sync`"""
+
+    def __init__(self, devices, added, updated, deleted, watermark):
+        self._devices = devices
+        self._added = added
+        self._updated = updated
+        self._deleted = deleted
+        self._watermark = watermark
+
+    def __repr__(self):
+        return "DeviceCoreSyncResult(devices=%d, added=%d, updated=%d, deleted=%d)" % (
+            len(self._devices), len(self._added), len(self._updated), len(self._deleted))
+
+    def get_devices(self):
+        """Get a list of every :class:`Device` in the synchronized snapshot"""
+        return self._devices
+
+    def get_added(self):
+        """Get the list of device ids added to the snapshot by this sync"""
+        return self._added
+
+    def get_updated(self):
+        """Get the list of device ids whose records changed in this sync"""
+        return self._updated
+
+    def get_deleted(self):
+        """Get the list of device ids removed from the snapshot by this sync"""
+        return self._deleted
+
+    def get_watermark(self):
+        """Get the update timestamp the next sync will request changes from"""
+        return self._watermark
+
+
+def _contains_or(condition):
+    """Return True if the provided condition combines expressions with ``or``"""
+    if isinstance(condition, Combination):
+        return (condition.sep.strip() == "or" or
+                _contains_or(condition.lhs) or _contains_or(condition.rhs))
+    return False
+
+
+class _NotLocallyEvaluable(Exception):
+    """Raised internally when a condition cannot be answered from a DeviceIndex"""
+
+
+def _intern(value):
+    """Intern native strings so repeated values share storage; return others as-is"""
+    if isinstance(value, str):
+        return six.moves.intern(value)
+    return value
+
+
+def _validate_fields(fields, required):
+    """Validate a ``fields`` projection, returning a set of names (including required) or None"""
+    fields = validate_type(fields, type(None), list, tuple, set, frozenset)
+    if fields is None:
+        return None
+    names = set(required)
+    for field in fields:
+        names.add(str(validate_type(field, Attribute, *six.string_types)))
+    return names
+
+
+def _project(json_data, fields):
+    """Return a copy of json_data containing only the keys in fields"""
+    return dict((key, value) for key, value in json_data.items() if key in fields)
+
+
+def _combine_balanced(expressions, sep):
+    """Combine expressions with sep, nesting as a balanced tree to limit compile() recursion
+
+    Combinations compile without parentheses, so the result is the same as chaining.
+
+    """
+    while len(expressions) > 1:
+        expressions = [Combination(expressions[i], sep, expressions[i + 1])
+                       if i + 1 < len(expressions) else expressions[i]
+                       for i in range(0, len(expressions), 2)]
+    return expressions[0]
+
+
+def _device_json_value(device_json, name):
+    """Get the value of a DeviceCore attribute from device json (id fields are nested)"""
+    if name in ("devId", "devVersion"):
+        return device_json.get("id", {}).get(name)
+    return device_json.get(name)
+
+
+def _local_condition_value(value):
+    """Convert a condition value to the string form the device cloud would compare"""
+    if isinstance(value, datetime.datetime):
+        return isoformat(to_none_or_dt(value))
+    return six.text_type(value)
+
+
+def _like_to_regex(pattern):
+    """Convert a SQL-style like pattern (% and _ wildcards) to a compiled regex"""
+    parts = []
+    for char in pattern:
+        if char == "%":
+            parts.append(".*")
+        elif char == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(char))
+    return re.compile("^{}$".format("".join(parts)), re.DOTALL | re.IGNORECASE)
+
+
+def _compare(lhs, sep, rhs):
+    """Evaluate lhs <sep> rhs locally, numerically if both sides are numbers"""
+    if lhs is None:
+        return False
+    lhs = six.text_type(lhs)
+    if sep == "=":
+        return lhs.lower() == rhs.lower()
+    if sep == " like ":
+        return _like_to_regex(rhs).match(lhs) is not None
+    try:
+        lhs, rhs = float(lhs), float(rhs)
+    except ValueError:
+        pass
+    if sep == "<":
+        return lhs < rhs
+    if sep == ">":
+        return lhs > rhs
+    raise _NotLocallyEvaluable(sep)
+
+
+class DeviceIndex(object):
+    """In-memory index of DeviceCore records supporting fast lookups
+
+    A device index is loaded once (via :meth:`.DeviceCoreAPI.get_device_index` or
+    :meth:`refresh`) and maintains hash indexes on connectware id, MAC address,
+    device id, group path, tag, and vendor id.  Lookups against the index do not
+    make any requests to the device cloud; the data will be as fresh as the last
+    call to :meth:`refresh`.
+
+    Conditions passed to :meth:`find` are answered locally where possible: equality
+    comparisons on indexed attributes use the indexes, other comparisons (including
+    ``like``) are evaluated by scanning the loaded records, and ``and``/``or``
+    combinations are evaluated as set operations.  Conditions provided as raw strings
+    cannot be evaluated locally and are sent to the device cloud instead.
+
+    """
+
+    # DeviceCore attribute -> index name
+    INDEXED_ATTRIBUTES = {
+        "devConnectwareId": "connectware_id",
+        "devMac": "mac",
+        "devId": "device_id",
+        "grpPath": "group_path",
+        "dpTags": "tag",
+        "dvVendorId": "vendor_id",
+    }
+
+    def __init__(self, devicecore_api, condition=None, page_size=1000, compact=False):
+        self._devicecore_api = devicecore_api
+        self._condition = validate_type(condition, type(None), Expression, *six.string_types)
+        self._page_size = validate_type(page_size, *six.integer_types)
+        self._compact = validate_type(compact, bool)
+        self._records = []
+        self._indexes = {}
+        self._clear()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        for position in range(len(self._records)):
+            yield self._make_device(position)
+
+    def _clear(self):
+        self._records = []
+        self._indexes = dict((name, {}) for name in self.INDEXED_ATTRIBUTES.values())
+
+    def _index_keys(self, device_json):
+        """Yield (index name, key) pairs for the device json"""
+        for attribute, index_name in self.INDEXED_ATTRIBUTES.items():
+            value = _device_json_value(device_json, attribute)
+            if not value:
+                continue
+            if attribute == "dpTags":
+                for tag in value.split(","):
+                    yield index_name, tag.lower()
+            else:
+                yield index_name, value.lower()
+
+    def _add(self, device_json):
+        position = len(self._records)
+        if self._compact:
+            self._records.append(json.dumps(device_json, separators=(',', ':')).encode('utf-8'))
+        else:
+            # many values (group paths, device types, firmware) repeat across devices
+            self._records.append(dict((_intern(k), _intern(v)) for k, v in device_json.items()))
+        for index_name, key in self._index_keys(device_json):
+            self._indexes[index_name].setdefault(_intern(key), []).append(position)
+
+    def _get_json(self, position):
+        record = self._records[position]
+        if self._compact:
+            return json.loads(record.decode('utf-8'))
+        return record
+
+    def _make_device(self, position):
+        api = self._devicecore_api
+        return Device(api._conn, api._sci, self._get_json(position))
+
+    def _lookup(self, index_name, key):
+        return self._indexes[index_name].get(six.text_type(key).lower(), [])
+
+    def refresh(self):
+        """Reload all devices from the device cloud and rebuild the indexes"""
+        self._clear()
+        for device in self._devicecore_api.get_devices(self._condition, page_size=self._page_size):
+            self._add(device.get_device_json())
+
+    def get_by_connectware_id(self, connectware_id):
+        """Return the :class:`Device` with the provided connectware id or None"""
+        positions = self._lookup("connectware_id", connectware_id)
+        return self._make_device(positions[0]) if positions else None
+
+    def get_by_mac(self, mac):
+        """Return the :class:`Device` with the provided MAC address (any case) or None"""
+        positions = self._lookup("mac", mac)
+        return self._make_device(positions[0]) if positions else None
+
+    def get_by_device_id(self, device_id):
+        """Return the :class:`Device` with the provided device id or None"""
+        positions = self._lookup("device_id", device_id)
+        return self._make_device(positions[0]) if positions else None
+
+    def get_by_group_path(self, group_path):
+        """Return a list of the devices in the group with the provided path"""
+        return [self._make_device(p) for p in self._lookup("group_path", group_path)]
+
+    def get_by_tag(self, tag):
+        """Return a list of the devices having the provided tag"""
+        return [self._make_device(p) for p in self._lookup("tag", tag)]
+
+    def get_by_vendor_id(self, vendor_id):
+        """Return a list of the devices with the provided vendor id"""
+        return [self._make_device(p) for p in self._lookup("vendor_id", vendor_id)]
+
+    def find(self, condition, allow_remote=True):
+        """Return a list of devices matching the provided condition
+
+        :param condition: An :class:`.Expression` (or raw condition string)
+        :param bool allow_remote: If True, conditions which cannot be evaluated locally
+            are sent to the device cloud using :meth:`.DeviceCoreAPI.get_devices`.  If
+            False, a ``ValueError`` is raised for such conditions instead.
+        :return: List of :class:`Device` objects matching the condition
+
+        """
+        condition = validate_type(condition, Expression, *six.string_types)
+        try:
+            positions = self._evaluate(condition)
+        except _NotLocallyEvaluable:
+            if not allow_remote:
+                raise ValueError("Condition %r cannot be evaluated locally" % (condition, ))
+            return list(self._devicecore_api.get_devices(condition, page_size=self._page_size))
+        return [self._make_device(p) for p in sorted(positions)]
+
+    def _evaluate(self, condition):
+        """Return the set of record positions matching the condition"""
+        if isinstance(condition, Combination):
+            lhs = self._evaluate(condition.lhs)
+            rhs = self._evaluate(condition.rhs)
+            if condition.sep.strip() == "and":
+                return lhs & rhs
+            elif condition.sep.strip() == "or":
+                return lhs | rhs
+            raise _NotLocallyEvaluable(condition.sep)
+        elif isinstance(condition, Comparison):
+            name = str(condition.attribute)
+            value = _local_condition_value(condition.value)
+            if condition.sep == "=" and name in self.INDEXED_ATTRIBUTES and name != "dpTags":
+                return set(self._lookup(self.INDEXED_ATTRIBUTES[name], value))
+            return set(position for position in range(len(self._records))
+                       if _compare(_device_json_value(self._get_json(position), name),
+                                   condition.sep, value))
+        raise _NotLocallyEvaluable(condition)
+
+
 class Group(object):
     """Provides access to information about a group in the device cloud
 
@@ -241,10 +1046,11 @@ class Device(object):
     # TODO: add/remove tags
     # TODO: provision a new device (probably add top-level method for this)
 
-    def __init__(self, conn, sci, device_json):
+    def __init__(self, conn, sci, device_json, partial=False):
         self._conn = conn
         self._sci = sci
         self._device_json = device_json
+        self._partial = partial  # True if device_json only holds some attributes
 
     def __repr__(self):
         return "Device(%r, %r)" % (self.get_connectware_id(), self.get_mac())
@@ -256,17 +1062,27 @@ class Device(object):
         synchronously in order to get the latest device metatdata.  This will
         update the cached data for this device.
 
+        If this device was retrieved with a ``fields`` projection, the cached
+        data only contains those fields until the full metadata is loaded.
+
         """
         if not use_cached:
             devicecore_data = self._conn.get_json(
                 "/ws/DeviceCore/{}".format(self.get_device_id()))
             self._device_json = devicecore_data["items"][0]  # should only be 1
+            self._partial = False
         return self._device_json
 
+    def _get_attribute(self, name, use_cached=True):
+        """Get an attribute from the device json, loading the full record if it was projected out"""
+        device_json = self.get_device_json(use_cached)
+        if self._partial and name not in device_json:
+            device_json = self.get_device_json(use_cached=False)
+        return device_json.get(name)
+
     def get_tags(self, use_cached=True):
         """Get the list of tags for this device"""
-        device_json = self.get_device_json(use_cached)
-        potential_tags = device_json.get("dpTags")
+        potential_tags = self._get_attribute("dpTags", use_cached)
         if potential_tags:
             return potential_tags.split(",")
         else:
@@ -274,13 +1090,11 @@ class Device(object):
 
     def is_connected(self, use_cached=True):
         """Return True if the device is currrently connect and False if not"""
-        device_json = self.get_device_json(use_cached)
-        return int(device_json.get("dpConnectionStatus")) > 0
+        return int(self._get_attribute("dpConnectionStatus", use_cached)) > 0
 
     def get_connectware_id(self, use_cached=True):
         """Get the connectware id of this device (primary key)"""
-        device_json = self.get_device_json(use_cached)
-        return device_json.get("devConnectwareId")
+        return self._get_attribute("devConnectwareId", use_cached)
 
     def get_device_id(self, use_cached=True):
         """Get this device's device id"""
@@ -289,13 +1103,11 @@ class Device(object):
 
     def get_ip(self, use_cached=True):
         """Get the last known IP of this device"""
-        device_json = self.get_device_json(use_cached)
-        return device_json.get("dpLastKnownIp")
+        return self._get_attribute("dpLastKnownIp", use_cached)
 
     def get_mac(self, use_cached=True):
         """Get the MAC address of this device"""
-        device_json = self.get_device_json(use_cached)
-        return device_json.get("devMac")
+        return self._get_attribute("devMac", use_cached)
 
     def get_mac_last4(self, use_cached=True):
         """Get the last 4 characters in the device mac address hex (e.g. 00:40:9D:58:17:5B -> 175B)
@@ -310,8 +1122,7 @@ class Device(object):
 
     def get_registration_dt(self, use_cached=True):
         """Get the datetime of when this device was added to the device cloud"""
-        device_json = self.get_device_json(use_cached)
-        start_date_iso8601 = device_json.get("devRecordStartDate")
+        start_date_iso8601 = self._get_attribute("devRecordStartDate", use_cached)
         if start_date_iso8601:
             return iso8601_to_dt(start_date_iso8601)
         else:
@@ -319,35 +1130,35 @@ class Device(object):
 
     def get_meid(self, use_cached=True):
         """Return the meid as a string of this device if it has one or None"""
-        return self.get_device_json(use_cached).get("devCellularModemId")
+        return self._get_attribute("devCellularModemId", use_cached)
 
     def get_customer_id(self, use_cached=True):
         """Get the automatically generated customer id for this device"""
-        return self.get_device_json(use_cached).get("cstId")
+        return self._get_attribute("cstId", use_cached)
 
     def get_group_id(self, use_cached=True):
         """Get the id of the group with which this device is associated"""
-        return self.get_device_json(use_cached).get("grpId")
+        return self._get_attribute("grpId", use_cached)
 
     def get_group_path(self, use_cached=True):
         """Get the path of the group with which this device is associated"""
-        return self.get_device_json(use_cached).get("grpPath")
+        return self._get_attribute("grpPath", use_cached)
 
     def get_vendor_id(self, use_cached=True):
         """Get the vendor id associated with this device if any"""
-        return self.get_device_json(use_cached).get("dvVendorId")
+        return self._get_attribute("dvVendorId", use_cached)
 
     def get_device_type(self, use_cached=True):
         """Get the device type of this device if present"""
-        return self.get_device_json(use_cached).get("dpDeviceType")
+        return self._get_attribute("dpDeviceType", use_cached)
 
     def get_firmware_level(self, use_cached=True):
         """Get the firmware level of this device if present"""
-        return self.get_device_json(use_cached).get("dpFirmwareLevel")
+        return self._get_attribute("dpFirmwareLevel", use_cached)
 
     def get_firmware_level_description(self, use_cached=True):
         """Get the firmware level as a string (rather than a number)"""
-        return self.get_device_json(use_cached).get("dpFirmwareLevelDesc")
+        return self._get_attribute("dpFirmwareLevelDesc", use_cached)
 
     # TODO: restricted status can also be set via PUT
     def get_restricted_status(self, use_cached=True):
@@ -360,65 +1171,64 @@ class Device(object):
         3. 3 - untrusted
 
         """
-        return self.get_device_json(use_cached).get("dpRestrictedStatus")
+        return self._get_attribute("dpRestrictedStatus", use_cached)
 
     def get_last_known_ip(self, use_cached=True):
         """Get the last known IP address of this device"""
-        return self.get_device_json(use_cached).get("dpLastKnownIp")
+        return self._get_attribute("dpLastKnownIp", use_cached)
 
     def get_global_ip(self, use_cached=True):
         """Get the last known global IP from which a device connected (out of NAT)"""
-        return self.get_device_json(use_cached).get("dpGlobalIp")
+        return self._get_attribute("dpGlobalIp", use_cached)
 
     def get_last_connected_dt(self, use_cached=True):
         """Get the datetime that the device last connected to the device cloud"""
-        return iso8601_to_dt(self.get_device_json(use_cached).get("dpLastConnectTime"))
+        return iso8601_to_dt(self._get_attribute("dpLastConnectTime", use_cached))
 
     def get_contact(self, use_cached=True):
         """Get the contact (if any) associated with this device"""
-        return self.get_device_json(use_cached).get("dpContact")
+        return self._get_attribute("dpContact", use_cached)
 
     def get_description(self, use_cached=True):
         """Get the description associated with this device"""
-        return self.get_device_json(use_cached).get("dpDescription")
+        return self._get_attribute("dpDescription", use_cached)
 
     def get_location(self, use_cached=True):
         """Get the location (string) associated with this device"""
-        return self.get_device_json(use_cached).get("dpLocation")
+        return self._get_attribute("dpLocation", use_cached)
 
     def get_latlon(self, use_cached=True):
         """Get a tuple with device latitude and longitude... these may be None"""
-        device_json = self.get_device_json(use_cached)
-        lat = device_json.get("dpMapLat")
-        lon = device_json.get("dpMapLong")
+        lat = self._get_attribute("dpMapLat", use_cached)
+        lon = self._get_attribute("dpMapLong", use_cached)
         return (float(lat) if lat else None,
                 float(lon) if lon else None, )
 
     def get_user_metadata(self, use_cached=True):
         """Get the user metadata for this device (string) if present"""
-        return self.get_device_json(use_cached).get("dpUserMetaData")
+        return self._get_attribute("dpUserMetaData", use_cached)
 
     def get_zb_pan_id(self, use_cached=True):
         """Get the Zigbee PAN ID from the device if present"""
-        return self.get_device_json(use_cached).get("dpPanId")
+        return self._get_attribute("dpPanId", use_cached)
 
     def get_zb_extended_address(self, use_cached=True):
         """Get the Zigbee extended address of this device if present"""
-        return self.get_device_json(use_cached).get("xpExtAddr")
+        return self._get_attribute("xpExtAddr", use_cached)
 
     def get_server_id(self, use_cached=True):
         """Get the ID of the server this device is currently connected to"""
-        return self.get_device_json(use_cached).get("dpServerId")
+        return self._get_attribute("dpServerId", use_cached)
 
     def get_provision_id(self, use_cached=True):
         """Get the provisioning ID of this device if used"""
-        return self.get_device_json(use_cached).get("provisionId")
+        return self._get_attribute("provisionId", use_cached)
 
     # TODO: need to research to see if this can actually be retried
     # TODO: should add support for setting this password via the API
     def get_current_connect_pw(self, use_cached=True):
         """Get the current connection password for this device"""
-        return self.get_device_json(use_cached).get("dpCurrentConnectPw")
+        return self._get_attribute("dpCurrentConnectPw", use_cached)
 
     def add_to_group(self, group_path):
         """Add a device to a group, if the group doesn't exist it is created
@@ -7,7 +7,7 @@
 from getpass import getpass
 
 from devicecloud import DeviceCloud
-from devicecloud.devicecore import dev_mac, group_path
+from devicecloud.devicecore import dev_mac
 
 
 def get_authenticated_dc():
@@ -24,19 +24,10 @@ def get_authenticated_dc():
 
 
 def show_group_tree(dc):
-    stats = {}  # group -> devices count including children
-    def count_nodes(group):
-        count_for_this_node = \
-            len(list(dc.devicecore.get_devices(group_path == group.get_path())))
-        subnode_count = 0
-        for child in group.get_children():
-            subnode_count += count_nodes(child)
-        total = count_for_this_node + subnode_count
-        stats[group] = total
-        return total
-    count_nodes(dc.devicecore.get_group_tree_root())
+    tree = dc.devicecore.get_group_tree()
+    stats = tree.device_counts()  # group -> devices count including children
     print(stats)
-    dc.devicecore.get_group_tree_root().print_subtree()
+    tree.get_root().print_subtree()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,37 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2014 Etherios, Inc. All rights reserved.
+# Etherios, Inc. is a Division of Digi International.
+"""Compare refreshing device metadata one device at a time against a batched refresh"""
+import time
+
+from devicecloud.examples.devicecore_playground import get_authenticated_dc
+
+
+def benchmark_per_device(dc, devices):
+    start = time.time()
+    for device in devices:
+        device.get_device_json(use_cached=False)
+    return time.time() - start
+
+
+def benchmark_batched(dc, devices):
+    start = time.time()
+    dc.devicecore.refresh(devices)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    dc = get_authenticated_dc()
+    devices = list(dc.devicecore.get_devices())
+    print("Refreshing %d devices" % len(devices))
+
+    dc.get_connection().reset_transfer_stats()
+    elapsed = benchmark_per_device(dc, devices)
+    print("Per-device: %.2fs, %d requests" % (elapsed, dc.get_connection().get_transfer_stats()["requests"]))
+
+    dc.get_connection().reset_transfer_stats()
+    elapsed = benchmark_batched(dc, devices)
+    print("Batched:    %.2fs, %d requests" % (elapsed, dc.get_connection().get_transfer_stats()["requests"]))
@@ -8,10 +8,22 @@
 """Provide access to the device cloud filedata API"""
 
 import base64
+import collections
+import fnmatch
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+import zipfile
 
+from devicecloud import DeviceCloudHttpException
 from devicecloud.apibase import APIBase
 from devicecloud.conditions import Attribute, Expression
-from devicecloud.util import iso8601_to_dt, validate_type
+from devicecloud.util import iso8601_to_dt, validate_type, iter_concurrently
 import six
 
 
@@ -24,11 +36,72 @@ fd_last_modified_date = Attribute("fdLastModifiedDate")
 fd_content_type = Attribute("fdContentType")
 fd_size = Attribute("fdSize")
 
+# Defaults for the directory listing cache (see FileDataAPI.enable_listing_cache)
+DEFAULT_LISTING_CACHE_TTL = 30
+DEFAULT_LISTING_CACHE_ENTRIES = 1000
+
+# Size of the chunks in which file contents are read from the device cloud
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Name of the manifest written by sync_down/sync_up (in the local directory, by default)
+SYNC_MANIFEST_NAME = ".filedata-sync.json"
+
+# Files of at most this size are packed into zip archives by upload_tree, with at most
+# MAX_ARCHIVE_SIZE bytes of files per archive.  Archives are built in memory until they
+# exceed ARCHIVE_SPOOL_SIZE, after which they are spooled to a temporary file.
+SMALL_FILE_SIZE = 256 * 1024
+MAX_ARCHIVE_SIZE = 16 * 1024 * 1024
+ARCHIVE_SPOOL_SIZE = 1024 * 1024
+
+# Size of the chunks in which file contents are read and base64 encoded for upload
+# (a multiple of 3 so that each chunk encodes without padding)
+UPLOAD_CHUNK_SIZE = 48 * 1024
+
 
 class FileDataAPI(APIBase):
     """Encapsulate data and logic required to interact with the device cloud file data store"""
 
-    def get_filedata(self, condition=None, page_size=1000):
+    def __init__(self, conn):
+        APIBase.__init__(self, conn)
+        self._listing_cache = None
+
+    def enable_listing_cache(self, ttl=DEFAULT_LISTING_CACHE_TTL, max_entries=DEFAULT_LISTING_CACHE_ENTRIES,
+                             revalidate=True):
+        """Cache the directory listings made by :meth:`walk`, :meth:`walk_concurrently` and syncs
+
+        Listings are cached by ``fdPath`` and reused for up to ``ttl`` seconds, with at most
+        ``max_entries`` directories cached (the least recently used are evicted first).
+        Once a listing is older than ``ttl``, if ``revalidate`` is true, the directory's own
+        entry is requested (without its contents) and the cached listing is reused for
+        another ``ttl`` seconds if the directory's ``fdLastModifiedDate`` has not changed
+        since it was listed.  Writes and deletes made through this API invalidate the
+        listings of the affected directories and their parents.  Changes made by others
+        (e.g. devices) may not be seen until a listing is revalidated.
+
+        Example::
+
+            dc.filedata.enable_listing_cache(ttl=30)
+            while True:
+                for dirpath, directories, files in dc.filedata.walk("~/uploads/"):
+                    process_new(files)  # unchanged directories are mostly served from memory
+                time.sleep(5)
+
+        :param ttl: The number of seconds a listing is used without being revalidated
+        :param int max_entries: The maximum number of directory listings to cache
+        :param bool revalidate: If true, expired listings are revalidated using the
+            directory's ``fdLastModifiedDate`` rather than always being fetched again
+
+        """
+        ttl = validate_type(ttl, float, *six.integer_types)
+        max_entries = validate_type(max_entries, *six.integer_types)
+        revalidate = validate_type(revalidate, bool)
+        self._listing_cache = _ListingCache(ttl, max_entries, revalidate)
+
+    def disable_listing_cache(self):
+        """Stop caching directory listings and discard any cached listings (the default)"""
+        self._listing_cache = None
+
+    def get_filedata(self, condition=None, page_size=1000, fields=None):
         """Return a generator over all results matching the provided condition
 
         :param condition: An :class:`.Expression` which defines the condition
@@ -40,6 +113,13 @@ class FileDataAPI(APIBase):
         :param int page_size: The number of results to fetch in a single page.  Regardless
             of the size specified, :meth:`.get_filedata` will continue to fetch pages
             and yield results until all items have been fetched.
+        :param fields: If not None, a list of the attribute names (or :class:`.Attribute`
+            objects) which should be kept for each object, e.g. ``["fdSize"]``.  The
+            path, name and type are always kept.  Unless ``"fdData"`` is included, file
+            contents are not requested from the device cloud (``embed=false``), which
+            can greatly reduce the size of listings.  Accessing any other attribute of
+            a returned object loads its metadata on demand (still without the contents,
+            which :meth:`.FileDataObject.get_data` downloads when called).
         :return: Generator yielding :class:`.FileDataObject` instances matching the
             provided conditions.
 
@@ -47,20 +127,80 @@ class FileDataAPI(APIBase):
 
         condition = validate_type(condition, type(None), Expression, *six.string_types)
         page_size = validate_type(page_size, *six.integer_types)
+        fields = validate_type(fields, type(None), list, tuple, set, frozenset)
         if condition is None:
             condition = (fd_path == "~/")  # home directory
 
-        params = {"embed": "true", "condition": condition.compile()}
+        if fields is not None:
+            fields = set(str(validate_type(field, Attribute, *six.string_types)) for field in fields)
+            fields.update(("id", "fdType"))
+
+        embed = "true" if fields is None or "fdData" in fields else "false"
+        params = {"embed": embed, "condition": condition.compile()}
         for fd_json in self._conn.iter_json_pages("/ws/FileData", page_size=page_size, **params):
-            yield FileDataObject.from_json(self, fd_json)
+            if fields is not None:
+                fd_json = dict((key, value) for key, value in fd_json.items() if key in fields)
+            yield FileDataObject.from_json(self, fd_json, partial=fields is not None)
+
+    def download_many(self, objects, dest_dir, max_workers=4, progress=None):
+        """Download the contents of many files concurrently into a local directory
+
+        Each file is streamed to disk in chunks (see :meth:`.FileDataFile.download`), so
+        memory use is bounded by ``max_workers`` regardless of the size of the files.
+        Files are written beneath ``dest_dir`` at their full path in the file data store
+        (e.g. ``/db/CUS0000033/dev/log.txt`` is written to ``<dest_dir>/db/CUS0000033/dev/log.txt``),
+        creating directories as needed.  Each file is written to a temporary ``.part`` file
+        which is renamed once the download completes.  Files whose path would resolve to
+        a location outside of ``dest_dir`` (e.g. a name containing ``..``) are not written
+        and are reported with a ``ValueError``.
+
+        Example::
+
+            logs = dc.filedata.get_filedata(fd_path == "~/logs/", fields=["fdSize"])
+            results = dc.filedata.download_many(
+                (fd for fd in logs if fd.get_type() == "file"), "/tmp/logs")
+
+        :param objects: Iterable of :class:`.FileDataFile` objects to download
+        :param str dest_dir: The local directory to download into
+        :param int max_workers: The maximum number of files to download at once
+        :param progress: If not None, a callable called as ``progress(num_completed, num_total)``
+            each time a download completes.  ``num_total`` is None if ``objects`` does not
+            support ``len()`` (e.g. a generator).
+        :return: Mapping of the full path of each file to None if it was downloaded
+            successfully or to the exception raised while downloading it
+
+        """
+        dest_dir = validate_type(dest_dir, *six.string_types)
+
+        root = os.path.abspath(dest_dir)
+
+        def download(fd_file):
+            _download_to(fd_file, _safe_local_path(root, fd_file.get_full_path()))
+
+        def validated(objects):
+            for fd_file in objects:
+                yield validate_type(fd_file, FileDataFile)
+
+        results = {}
+        total = len(objects) if hasattr(objects, "__len__") else None
+        for fd_file, _, exception in iter_concurrently(download, validated(objects), max_workers=max_workers,
+                                                       progress=progress, total=total):
+            results[fd_file.get_full_path()] = exception
+        return results
 
     def write_file(self, path, name, data, content_type=None, archive=False):
         """Write a file to the file data store at the given path
 
+        The contents are base64 encoded incrementally as the request body is sent, so
+        only a small buffer (rather than the encoded file) is held in memory.  To
+        upload a local file by its path, see :meth:`upload_file`.
+
         :param str path: The path (directory) into which the file should be written.
         :param str name: The name of the file to be written.
-        :param data: The binary data that should be written into the file.
-        :type data: str (Python2) or bytes (Python3)
+        :param data: The binary data that should be written into the file, or a file-like
+            object opened in binary mode from which it is read (from the current position
+            to the end of the file).
+        :type data: str (Python2), bytes (Python3) or file-like object
         :param content_type: The content type for the data being written to the file.  May
              be left unspecified.
         :type content_type: str or None
@@ -70,38 +210,236 @@ class FileDataAPI(APIBase):
         """
         path = validate_type(path, *six.string_types)
         name = validate_type(name, *six.string_types)
-        data = validate_type(data, six.binary_type)
         content_type = validate_type(content_type, type(None), *six.string_types)
         archive_str = "true" if validate_type(archive, bool) else "false"
-
-        if not path.startswith("/"):
-            path = "/" + path
-        if not path.endswith("/"):
-            path += "/"
-        name = name.lstrip("/")
-
-        if six.PY3:
-            base64_encoded_data = base64.encodebytes(data).decode('utf-8')
+        if isinstance(data, six.binary_type):
+            fobj, size = six.BytesIO(data), len(data)
+        elif hasattr(data, "read"):
+            fobj, size = data, _remaining_size(data)
         else:
-            base64_encoded_data = base64.encodestring(data)
+            raise TypeError("data must be bytes or a file-like object, not %r" % type(data))
 
+        self._put_filedata(_normalize_dir(path) + name.lstrip("/"), "file", fobj, size, content_type, archive_str)
+
+    def _put_filedata(self, full_path, fd_type, fobj, size, content_type, archive_str):
+        """PUT ``size`` bytes (None if unknown) read from fobj as a FileData of type fd_type"""
         sio = six.moves.StringIO()
         sio.write("<FileData>")
         if content_type is not None:
             sio.write("<fdContentType>{}</fdContentType>".format(content_type))
-        sio.write("<fdType>file</fdType>")
-        sio.write("<fdData>{}</fdData>".format(base64_encoded_data))
-        sio.write("<fdArchive>{}</fdArchive>".format(archive_str))
-        sio.write("</FileData>")
+        sio.write("<fdType>{}</fdType>".format(fd_type))
+        sio.write("<fdData>")
+        prefix = sio.getvalue().encode('utf-8')
+        suffix = "</fdData><fdArchive>{}</fdArchive></FileData>".format(archive_str).encode('utf-8')
 
         params = {
-            "type": "file",
+            "type": fd_type,
             "archive": archive_str
         }
-        self._conn.put(
-            "/ws/FileData{path}{name}".format(path=path, name=name),
-            sio.getvalue(),
-            params=params)
+        try:
+            self._conn.put(
+                "/ws/FileData{}".format(full_path),
+                _Base64Body(prefix, fobj, size, suffix),
+                params=params)
+        finally:
+            # a failed request may still have been applied
+            self._invalidate_listings(full_path, recursive=fd_type == "zip")
+
+    def upload_file(self, local_path, path, name=None, content_type=None, archive=False):
+        """Write the contents of a local file to the file data store
+
+        The local file is memory-mapped and encoded as it is sent (see :meth:`write_file`),
+        so files much larger than the available memory may be uploaded.
+
+        :param str local_path: The path of the local file to upload
+        :param str path: The path (directory) into which the file should be written.
+        :param name: The name of the file to be written (by default, the name of the
+            local file)
+        :type name: str or None
+        :param content_type: The content type for the data being written to the file.
+        :type content_type: str or None
+        :param bool archive: If true, history will be retained for various revisions of this file.
+
+        """
+        local_path = validate_type(local_path, *six.string_types)
+        name = validate_type(name, type(None), *six.string_types)
+        if name is None:
+            name = os.path.basename(local_path)
+
+        with open(local_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return self.write_file(path, name, b"", content_type, archive)  # empty files cannot be mapped
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return self.write_file(path, name, mapped, content_type, archive)
+            finally:
+                mapped.close()
+
+    def upload_tree(self, local_dir, remote_path, small_file_size=SMALL_FILE_SIZE,
+                    max_archive_size=MAX_ARCHIVE_SIZE, max_workers=4):
+        """Upload every file beneath a local directory, packing small files into zip archives
+
+        Files no larger than ``small_file_size`` are packed into zip archives which are
+        uploaded with an ``fdType`` of ``zip`` and expanded by the device cloud into
+        ``remote_path``, so thousands of small files cost a handful of requests.  Each
+        archive holds at most ``max_archive_size`` bytes of (uncompressed) files.  Archives
+        are built one file at a time in a temporary file (which is only held in memory
+        while it is small) and encoded as they are sent.  Larger files are uploaded
+        individually with :meth:`upload_file`.  Archives and large files are uploaded
+        concurrently.
+
+        Example::
+
+            results = dc.filedata.upload_tree("/etc/device-configs", "~/configs/")
+            failed = [relpath for relpath, exception in results.items() if exception is not None]
+
+        :param str local_dir: The local directory to upload
+        :param str remote_path: The directory in the file data store to upload into.  The
+            directory structure beneath ``local_dir`` is recreated beneath it.
+        :param int small_file_size: Files of at most this many bytes are packed into archives
+        :param int max_archive_size: The maximum total size of the files in one archive
+        :param int max_workers: The maximum number of archives or files to upload at once
+        :return: Mapping of the "/" separated path of each file relative to ``local_dir`` to
+            None if it was uploaded successfully or to the exception raised while uploading
+            it (or the archive containing it)
+
+        """
+        local_root = os.path.abspath(validate_type(local_dir, *six.string_types))
+        remote_path = _normalize_dir(validate_type(remote_path, *six.string_types))
+        small_file_size = validate_type(small_file_size, *six.integer_types)
+        max_archive_size = validate_type(max_archive_size, *six.integer_types)
+
+        def batches():
+            """Yield (is archive, [(relpath, local path), ...]) for each upload to perform"""
+            batch, batch_size = [], 0
+            for dirpath, dirnames, filenames in os.walk(local_root):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    local_path = os.path.join(dirpath, filename)
+                    relpath = os.path.relpath(local_path, local_root).replace(os.sep, "/")
+                    size = os.path.getsize(local_path)
+                    if size > small_file_size:
+                        yield False, [(relpath, local_path)]
+                        continue
+                    if batch and batch_size + size > max_archive_size:
+                        yield True, batch
+                        batch, batch_size = [], 0
+                    batch.append((relpath, local_path))
+                    batch_size += size
+            if batch:
+                yield True, batch
+
+        def upload(item):
+            is_archive, batch = item
+            if not is_archive:
+                relpath, local_path = batch[0]
+                directory, _, name = relpath.rpartition("/")
+                return self.upload_file(local_path, remote_path + directory, name)
+            with tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE) as archive:
+                with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+                    for relpath, local_path in batch:
+                        zf.write(local_path, relpath)
+                size = archive.tell()
+                archive.seek(0)
+                self._put_filedata(remote_path, "zip", archive, size, None, "false")
+
+        results = {}
+        for (_, batch), _, exception in iter_concurrently(upload, batches(), max_workers=max_workers):
+            for relpath, _ in batch:
+                results[relpath] = exception
+        return results
+
+    def write_many(self, files, content_type=None, archive=False, max_workers=4, progress=None):
+        """Write many files to the file data store concurrently
+
+        Each file is written as by :meth:`write_file`, with its contents encoded as the
+        request body is sent.  ``files`` is consumed lazily, so it may be a generator over
+        a very large number of files.  To avoid holding many files open at once, ``data``
+        may be a callable which is only called when the file is about to be written;
+        file-like objects returned by such a callable are closed once written.
+
+        Example::
+
+            results = dc.filedata.write_many(
+                ("~/devices/{}/".format(dev_id), "config.xml", functools.partial(open, local_path, "rb"))
+                for dev_id, local_path in configs)
+            failed = [path for path, exception in results.items() if exception is not None]
+
+        :param files: Iterable of ``(path, name, data)`` tuples, where ``data`` is bytes, a
+            file-like object opened in binary mode or a callable returning either
+        :param content_type: The content type of every file (may be left unspecified)
+        :param bool archive: If true, history will be retained for each file
+        :param int max_workers: The maximum number of files to write at once
+        :param progress: If not None, called as ``progress(num_completed, num_total)`` each
+            time a write completes.  ``num_total`` is None if ``files`` does not support ``len()``.
+        :return: Mapping of the full path of each file to None if it was written successfully
+            or to the exception raised while writing it
+
+        """
+        content_type = validate_type(content_type, type(None), *six.string_types)
+        archive = validate_type(archive, bool)
+
+        def write(item):
+            path, name, data = item
+            if not callable(data):
+                return self.write_file(path, name, data, content_type, archive)
+            data = data()
+            try:
+                self.write_file(path, name, data, content_type, archive)
+            finally:
+                if hasattr(data, "close"):
+                    data.close()
+
+        results = {}
+        for (path, name, _), _, exception in iter_concurrently(write, files, max_workers=max_workers,
+                                                               progress=progress):
+            results[_normalize_dir(path) + name.lstrip("/")] = exception
+        return results
+
+    def delete(self, path, recursive=False):
+        """Delete a file or directory from the file data store
+
+        :param str path: The full path of the file or directory to delete
+        :param bool recursive: If true, a directory is deleted along with its contents.
+            Otherwise, deleting a directory which is not empty will fail.
+        :raises DeviceCloudHttpException: If the file or directory could not be deleted
+
+        """
+        path = validate_type(path, *six.string_types)
+        params = {"recursive": "true"} if validate_type(recursive, bool) else {}
+        if not path.startswith("/"):
+            path = "/" + path
+        try:
+            self._conn.delete(_filedata_url_path(path), params=params)
+        finally:
+            self._invalidate_listings(path, recursive=True)
+
+    def delete_many(self, paths, recursive=False, max_workers=4, progress=None):
+        """Delete many files or directories from the file data store concurrently
+
+        :param paths: Iterable of full paths or :class:`.FileDataObject` instances to delete
+        :param bool recursive: If true, directories are deleted along with their contents
+        :param int max_workers: The maximum number of deletions to perform at once
+        :param progress: If not None, called as ``progress(num_completed, num_total)`` each
+            time a deletion completes.  ``num_total`` is None if ``paths`` does not support ``len()``.
+        :return: Mapping of each path to None if it was deleted successfully or to the
+            exception raised while deleting it
+
+        """
+        recursive = validate_type(recursive, bool)
+
+        def full_paths(paths):
+            for path in paths:
+                if isinstance(path, FileDataObject):
+                    path = path.get_full_path()
+                yield validate_type(path, *six.string_types)
+
+        total = len(paths) if hasattr(paths, "__len__") else None
+        results = {}
+        for path, _, exception in iter_concurrently(lambda path: self.delete(path, recursive), full_paths(paths),
+                                                    max_workers=max_workers, progress=progress, total=total):
+            results[path] = exception
+        return results
 
     def walk(self, root="~/"):
         """Emulation of os.walk behavior against the device cloud filedata store
@@ -117,58 +455,663 @@ class FileDataAPI(APIBase):
         """
         root = validate_type(root, *six.string_types)
 
-        directories = []
-        files = []
+        # an explicit stack (rather than recursion) so deep trees do not hit the recursion limit
+        stack = [root]
+        while stack:
+            dirpath = stack.pop()
+            directories, files = self._list_directory(dirpath)
+            yield (dirpath, directories, files)
+            stack.extend(directory.get_full_path() for directory in reversed(directories))
+
+    def walk_concurrently(self, root="~/", max_workers=4, max_depth=None, include=None, exclude=None,
+                          fields=None):
+        """Walk the filedata store breadth-first, listing the directories of each level concurrently
+
+        Like :meth:`walk`, this yields tuples in the form ``(dirpath, FileDataDirectory's,
+        FileData's)``.  Rather than listing one directory at a time, every directory at a
+        given depth is listed using a pool of ``max_workers`` threads and the results for
+        the level are yielded (in the order the directories were found) once the whole
+        level has been listed.  Only one level of the tree is held in memory at a time.
+
+        Subtrees can be pruned before their listings are requested using ``max_depth``
+        and the ``include`` and ``exclude`` patterns.  Patterns are matched against the
+        full path of each directory using :mod:`fnmatch` (so ``*`` also matches ``/``).
+        Pruned directories still appear in the directories of their parent.
+
+        Example::
+
+            # list the logs directory of each device, without walking anything else
+            for dirpath, dirs, files in dc.filedata.walk_concurrently(
+                    "~/", max_workers=16, max_depth=2, exclude=["*/firmware"]):
+                ...
+
+        :param str root: The root path from which the walk should commence.
+        :param int max_workers: The maximum number of directory listings requested at once
+        :param max_depth: If not None, the maximum depth of directories to list (the
+            root is at depth 0, so a ``max_depth`` of 0 only lists the root)
+        :param include: If not None, a list of patterns; only directories whose path
+            matches one of them are listed
+        :param exclude: If not None, a list of patterns; directories whose path matches
+            any of them are not listed
+        :param fields: If not None, the attributes to keep for each object (see
+            :meth:`get_filedata`).  Passing e.g. ``["fdSize"]`` avoids requesting the
+            contents of every file along with the listings.
+        :return: Generator yielding 3-tuples of dirpath, directories, and files
+        :rtype: 3-tuple in form (dirpath, list of :class:`FileDataDirectory`, list of :class:`FileDataFile`)
+
+        """
+        root = validate_type(root, *six.string_types)
+        max_depth = validate_type(max_depth, type(None), *six.integer_types)
+        include = validate_type(include, type(None), list, tuple)
+        exclude = validate_type(exclude, type(None), list, tuple)
+
+        def should_list(dirpath):
+            if include is not None and not any(fnmatch.fnmatchcase(dirpath, p) for p in include):
+                return False
+            return not (exclude is not None and any(fnmatch.fnmatchcase(dirpath, p) for p in exclude))
+
+        level = [root]
+        depth = 0
+        while level:
+            listings = {}
+            for dirpath, listing, exception in iter_concurrently(
+                    lambda dirpath: self._list_directory(dirpath, fields), level, max_workers=max_workers):
+                if exception is not None:
+                    raise exception
+                listings[dirpath] = listing
+
+            next_level = []
+            for dirpath in level:
+                directories, files = listings[dirpath]
+                yield (dirpath, directories, files)
+                if max_depth is None or depth < max_depth:
+                    next_level.extend(path for path in (d.get_full_path() for d in directories)
+                                      if should_list(path))
+            level = next_level
+            depth += 1
+
+    def sync_down(self, remote_root, local_dir, delete=False, checksum=False, max_workers=4,
+                  manifest_path=None, progress=None):
+        """Mirror a directory tree in the file data store into a local directory
+
+        The size and ``fdLastModifiedDate`` of each remote file (and the size and
+        modification time of each local file) are recorded in a manifest stored in
+        ``local_dir``.  Subsequent syncs only download files which have changed on the
+        device cloud, or whose local copy has been changed or removed, since the
+        previous sync.  Downloads are performed concurrently and streamed to disk.
+
+        Example::
+
+            result = dc.filedata.sync_down("~/backups/", "/var/backups/filedata", delete=True)
+            print "%d downloaded, %d unchanged" % (len(result.get_transferred()),
+                                                   len(result.get_unchanged()))
+
+        :param str remote_root: The directory in the file data store to mirror
+        :param str local_dir: The local directory to mirror into (created if needed)
+        :param bool delete: If True, local files which do not exist in the file data store
+            are deleted.  Otherwise they are kept.
+        :param bool checksum: If True, a local file whose modification time has changed is
+            only considered modified if the MD5 of its contents has changed as well
+        :param int max_workers: The maximum number of listings or transfers performed at once
+        :param manifest_path: The path of the manifest (by default,
+            ``<local_dir>/.filedata-sync.json``)
+        :param progress: If not None, called as ``progress(num_completed, num_total)`` as
+            each download completes
+        :return: A :class:`FileDataSyncResult`, with paths relative to the roots
+        :raises ValueError: If the manifest was created for a different pair of directories
+
+        """
+        remote_root, local_root, manifest = self._prepare_sync(remote_root, local_dir, manifest_path)
+        delete = validate_type(delete, bool)
+        checksum = validate_type(checksum, bool)
 
+        remote_files = self._list_tree(remote_root, max_workers)
+        local_files = _list_local_files(local_root, manifest.path)
+        to_transfer, unchanged = [], []
+        for relpath in sorted(remote_files):
+            entry = manifest.get(relpath)
+            if (entry is not None and relpath in local_files and
+                    manifest.remote_unchanged(entry, remote_files[relpath]) and
+                    manifest.local_unchanged(entry, local_files[relpath], checksum)):
+                unchanged.append(relpath)
+            else:
+                to_transfer.append(relpath)
+
+        def download(relpath):
+            local_path = _safe_local_path(local_root, relpath)
+            _download_to(remote_files[relpath], local_path)
+            return _local_state(local_path)
+
+        transferred, errors = [], {}
+        for relpath, local_state, exception in iter_concurrently(download, to_transfer, max_workers=max_workers,
+                                                                 progress=progress):
+            if exception is not None:
+                errors[relpath] = exception
+            else:
+                manifest.set(relpath, remote_files[relpath], local_state)
+                transferred.append(relpath)
+
+        deleted = []
+        for relpath in sorted(set(local_files) - set(remote_files)):
+            if delete:
+                os.remove(local_files[relpath].path)
+                deleted.append(relpath)
+        manifest.retain(remote_files)
+        manifest.save()
+        return FileDataSyncResult(sorted(transferred), deleted, unchanged, errors)
+
+    def sync_up(self, local_dir, remote_root, delete=False, checksum=False, max_workers=4,
+                manifest_path=None, progress=None):
+        """Mirror a local directory tree into a directory in the file data store
+
+        This is the reverse of :meth:`sync_down` and uses the same manifest (so a pair of
+        directories may be synchronized in either direction).  Only local files which
+        have changed, and remote files which are missing or have been changed on the
+        device cloud, since the previous sync are uploaded (see :meth:`upload_file`).
+
+        :param str local_dir: The local directory to mirror
+        :param str remote_root: The directory in the file data store to mirror into
+        :param bool delete: If True, files in the file data store which do not exist
+            locally are deleted.  Otherwise they are kept.
+        :param bool checksum: If True, a local file whose modification time has changed is
+            only uploaded if the MD5 of its contents has changed as well
+        :param int max_workers: The maximum number of listings or transfers performed at once
+        :param manifest_path: The path of the manifest (by default,
+            ``<local_dir>/.filedata-sync.json``)
+        :param progress: If not None, called as ``progress(num_completed, num_total)`` as
+            each upload completes
+        :return: A :class:`FileDataSyncResult`, with paths relative to the roots
+        :raises ValueError: If the manifest was created for a different pair of directories
+
+        """
+        remote_root, local_root, manifest = self._prepare_sync(remote_root, local_dir, manifest_path)
+        delete = validate_type(delete, bool)
+        checksum = validate_type(checksum, bool)
+
+        remote_files = self._list_tree(remote_root, max_workers)
+        local_files = _list_local_files(local_root, manifest.path)
+        to_transfer, unchanged = [], []
+        for relpath in sorted(local_files):
+            entry = manifest.get(relpath)
+            fd_file = remote_files.get(relpath)
+            if (entry is not None and fd_file is not None and
+                    manifest.remote_unchanged(entry, fd_file) and
+                    manifest.local_unchanged(entry, local_files[relpath], checksum)):
+                manifest.set(relpath, fd_file, local_files[relpath])
+                unchanged.append(relpath)
+            else:
+                to_transfer.append(relpath)
+
+        def upload(relpath):
+            directory, _, name = relpath.rpartition("/")
+            self.upload_file(local_files[relpath].path, remote_root + directory, name)
+
+        transferred, errors = [], {}
+        for relpath, _, exception in iter_concurrently(upload, to_transfer, max_workers=max_workers,
+                                                       progress=progress):
+            if exception is not None:
+                errors[relpath] = exception
+            else:
+                # the new fdLastModifiedDate is not known until the next listing
+                manifest.set(relpath, None, local_files[relpath])
+                transferred.append(relpath)
+
+        deleted = []
+        for relpath in sorted(set(remote_files) - set(local_files)):
+            if delete:
+                try:
+                    remote_files[relpath].delete()
+                except DeviceCloudHttpException as exception:
+                    errors[relpath] = exception
+                else:
+                    deleted.append(relpath)
+        manifest.retain(local_files)
+        manifest.save()
+        return FileDataSyncResult(sorted(transferred), deleted, unchanged, errors)
+
+    def _prepare_sync(self, remote_root, local_dir, manifest_path):
+        """Validate sync arguments, returning (remote root, local root, manifest)"""
+        remote_root = validate_type(remote_root, *six.string_types)
+        local_dir = validate_type(local_dir, *six.string_types)
+        manifest_path = validate_type(manifest_path, type(None), *six.string_types)
+        if not remote_root.endswith("/"):
+            remote_root += "/"
+        local_root = os.path.abspath(local_dir)
+        if not os.path.isdir(local_root):
+            os.makedirs(local_root)
+        if manifest_path is None:
+            manifest_path = os.path.join(local_root, SYNC_MANIFEST_NAME)
+        return remote_root, local_root, _SyncManifest(manifest_path, remote_root, local_root)
+
+    def _list_tree(self, remote_root, max_workers):
+        """Return a mapping of "/" separated path relative to remote_root -> :class:`FileDataFile`"""
+        relative_dirs = {remote_root: ""}
+        files = {}
+        for dirpath, directories, dir_files in self.walk_concurrently(
+                remote_root, max_workers=max_workers, fields=["fdSize", "fdLastModifiedDate"]):
+            prefix = relative_dirs.pop(dirpath)
+            for directory in directories:
+                relative_dirs[directory.get_full_path()] = prefix + directory.get_name() + "/"
+            for fd_file in dir_files:
+                files[prefix + fd_file.get_name()] = fd_file
+        return files
+
+    def _list_directory(self, dirpath, fields=None):
+        """Return ``(directories, files)`` for the contents of the directory at dirpath"""
         # fd_path is real picky
-        query_fd_path = root
+        query_fd_path = dirpath
         if not query_fd_path.endswith("/"):
             query_fd_path += "/"
 
-        for fd_object in self.get_filedata(fd_path == query_fd_path):
+        cache = self._listing_cache
+        if cache is None:
+            return self._fetch_listing(query_fd_path, fields)
+        fields_key = None if fields is None else frozenset(str(field) for field in fields)
+        listing = cache.get(query_fd_path, fields_key, self._get_directory_modified_date)
+        if listing is None:
+            modified_date = self._get_directory_modified_date(query_fd_path) if cache.revalidate else None
+            listing = self._fetch_listing(query_fd_path, fields)
+            cache.put(query_fd_path, fields_key, modified_date, listing)
+        directories, files = listing
+        return list(directories), list(files)  # callers may prune the lists (as with os.walk)
+
+    def _get_directory_modified_date(self, dirpath):
+        """Return the fdLastModifiedDate of the directory at dirpath (None if it cannot be found)"""
+        parent, _, name = dirpath.rstrip("/").rpartition("/")
+        if not parent:
+            return None  # a root such as ~/ has no entry of its own
+        condition = (fd_path == parent + "/") & (fd_name == name)
+        for fd_object in self.get_filedata(condition, fields=["fdLastModifiedDate"]):
+            return fd_object._json_data.get("fdLastModifiedDate")
+        return None
+
+    def _invalidate_listings(self, full_path, recursive=False):
+        """Discard cached listings affected by a change to the object at full_path"""
+        if self._listing_cache is not None:
+            self._listing_cache.invalidate(full_path, recursive)
+
+    def _fetch_listing(self, query_fd_path, fields):
+        directories = []
+        files = []
+        for fd_object in self.get_filedata(fd_path == query_fd_path, fields=fields):
             if fd_object.get_type() == "directory":
                 directories.append(fd_object)
             else:
                 files.append(fd_object)
+        return directories, files
 
-        # Yield the walk results for this level of the tree
-        yield (root, directories, files)
 
-        # recurse on each directory and yield results up the chain
-        for directory in directories:
-            for dirpath, directories, files in self.walk(directory.get_full_path()):
-                yield (dirpath, directories, files)
+def _listing_key(path):
+    """Return the key under which the listing of the directory at path is cached"""
+    path = path.lstrip("/")  # writes use a leading slash ("/~/dir/") but listings do not
+    return path if path.endswith("/") else path + "/"
+
+
+class _ListingCache(object):
+    """Thread-safe LRU cache of directory listings keyed by fdPath (used internally)"""
+
+    def __init__(self, ttl, max_entries, revalidate):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.revalidate = revalidate
+        # fdPath -> {fields key -> [time validated, directory fdLastModifiedDate, listing]}
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._home = None  # the absolute path of ~/ (e.g. "db/CUS0000033/"), once known
+
+    def _key(self, path):
+        key = _listing_key(path)
+        if self._home is not None and key.startswith("~/"):
+            key = self._home + key[2:]
+        return key
+
+    def get(self, dirpath, fields_key, get_modified_date):
+        """Return the cached (directories, files) for dirpath, or None if it must be fetched"""
+        with self._lock:
+            key = self._key(dirpath)
+            listings = self._entries.pop(key, None)
+            if listings is None:
+                return None
+            self._entries[key] = listings  # most recently used
+            entry = listings.get(fields_key)
+        if entry is None:
+            return None
+        validated, modified_date, listing = entry
+        if time.time() - validated < self.ttl:
+            return listing
+        if not self.revalidate or modified_date is None or get_modified_date(dirpath) != modified_date:
+            return None
+        entry[0] = time.time()
+        return listing
+
+    def put(self, dirpath, fields_key, modified_date, listing):
+        with self._lock:
+            if self._home is None and _listing_key(dirpath).startswith("~/"):
+                self._learn_home(_listing_key(dirpath), listing)
+            key = self._key(dirpath)
+            listings = self._entries.pop(key, {})
+            listings[fields_key] = [time.time(), modified_date, listing]
+            self._entries[key] = listings
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, full_path, recursive=False):
+        """Discard the listings of the directories containing full_path (and beneath it if recursive)
+
+        Every ancestor is invalidated since a write may create intermediate directories
+        (and changes the modification date of the directories containing it).
+
+        """
+        with self._lock:
+            path = self._key(full_path)
+            for key in list(self._entries):
+                if path.startswith(key) or (recursive and key.startswith(path)):
+                    del self._entries[key]
+
+    def _learn_home(self, key, listing):
+        """Learn the absolute path of ~/ from the paths of the objects listed in key (~/...)"""
+        for fd_object in itertools.chain(*listing):
+            object_path = _listing_key(fd_object.get_path())
+            if object_path != key and object_path.endswith(key[2:]):
+                self._home = object_path[:len(object_path) - len(key) + 2]
+                # entries cached by their ~/ path before the home was known
+                for cached_key in [k for k in self._entries if k.startswith("~/")]:
+                    self._entries.pop(cached_key)
+            return
+
+
+class FileDataSyncResult(object):
+    """The result of a call to :meth:`FileDataAPI.sync_down` or :meth:`FileDataAPI.sync_up`"""
+
+    def __init__(self, transferred, deleted, unchanged, errors):
+        self._transferred = transferred
+        self._deleted = deleted
+        self._unchanged = unchanged
+        self._errors = errors
+
+    def __repr__(self):
+        return "FileDataSyncResult(transferred=%d, deleted=%d, unchanged=%d, errors=%d)" % (
+            len(self._transferred), len(self._deleted), len(self._unchanged), len(self._errors))
+
+    def get_transferred(self):
+        """Get the list of relative paths of files copied by this sync"""
+        return self._transferred
+
+    def get_deleted(self):
+        """Get the list of relative paths of files deleted from the destination by this sync"""
+        return self._deleted
+
+    def get_unchanged(self):
+        """Get the list of relative paths of files which were already up to date"""
+        return self._unchanged
+
+    def get_errors(self):
+        """Get a mapping of relative path -> exception for files which could not be synchronized"""
+        return self._errors
+
+
+_LocalFile = collections.namedtuple("_LocalFile", ["path", "size", "mtime"])
+
+
+def _local_state(local_path):
+    stat = os.stat(local_path)
+    return _LocalFile(local_path, stat.st_size, stat.st_mtime)
+
+
+def _list_local_files(local_root, manifest_path):
+    """Return a mapping of "/" separated path relative to local_root -> _LocalFile"""
+    files = {}
+    for dirpath, _, filenames in os.walk(local_root):
+        for filename in filenames:
+            local_path = os.path.join(dirpath, filename)
+            if local_path == os.path.abspath(manifest_path) or filename.endswith((".part", ".tmp")):
+                continue
+            relpath = os.path.relpath(local_path, local_root).replace(os.sep, "/")
+            files[relpath] = _local_state(local_path)
+    return files
+
+
+def _md5(local_path):
+    digest = hashlib.md5()
+    with open(local_path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _SyncManifest(object):
+    """Persistent record of the state of each file as of the last sync (used internally)"""
+
+    def __init__(self, path, remote_root, local_root):
+        self.path = path
+        self._data = {"remote_root": remote_root, "local_root": local_root, "files": {}}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            if (data.get("remote_root"), data.get("local_root")) != (remote_root, local_root):
+                raise ValueError("Manifest %r was created to sync %r with %r" %
+                                 (path, data.get("local_root"), data.get("remote_root")))
+            self._data = data
+        self._files = self._data["files"]
+
+    def get(self, relpath):
+        return self._files.get(relpath)
+
+    def remote_unchanged(self, entry, fd_file):
+        if entry["size"] != fd_file.get_size():
+            return False
+        # None if the file was uploaded by the last sync (and not listed since)
+        return entry["modified"] in (None, fd_file._json_data.get("fdLastModifiedDate"))
+
+    def local_unchanged(self, entry, local_file, checksum):
+        if entry["local_size"] != local_file.size:
+            return False
+        if entry["local_mtime"] == local_file.mtime:
+            return True
+        return checksum and entry.get("md5") is not None and entry["md5"] == _md5(local_file.path)
+
+    def set(self, relpath, fd_file, local_file):
+        entry = self._files.get(relpath) or {}
+        if fd_file is not None:
+            entry["size"] = fd_file.get_size()
+            entry["modified"] = fd_file._json_data.get("fdLastModifiedDate")
+        else:
+            entry["size"] = local_file.size
+            entry["modified"] = None
+        if entry.get("local_mtime") != local_file.mtime or "md5" not in entry:
+            entry["md5"] = _md5(local_file.path)
+        entry["local_size"] = local_file.size
+        entry["local_mtime"] = local_file.mtime
+        self._files[relpath] = entry
+
+    def retain(self, relpaths):
+        """Forget every file which is not in relpaths"""
+        for relpath in list(self._files):
+            if relpath not in relpaths:
+                del self._files[relpath]
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(self._data, f, separators=(',', ':'))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temp_path, self.path)
+
+
+def _normalize_dir(path):
+    """Return path with leading and trailing slashes"""
+    if not path.startswith("/"):
+        path = "/" + path
+    if not path.endswith("/"):
+        path += "/"
+    return path
+
+
+def _filedata_url_path(full_path):
+    """Return the web services path of the raw contents of a file in the file data store"""
+    return "/ws/FileData{}".format(six.moves.urllib.parse.quote(full_path, safe="/~"))
+
+
+def _safe_local_path(root, relative_path):
+    """Return the local path for a "/" separated path beneath root, refusing to leave root"""
+    local_path = os.path.normpath(os.path.join(root, *relative_path.split("/")))
+    if not local_path.startswith(os.path.join(root, "")):
+        raise ValueError("{!r} would be written outside of {!r}".format(relative_path, root))
+    return local_path
+
+
+def _download_to(fd_file, local_path):
+    """Download a file to local_path via a temporary ``.part`` file, creating directories"""
+    local_dir = os.path.dirname(local_path)
+    if not os.path.isdir(local_dir):
+        try:
+            os.makedirs(local_dir)
+        except OSError:
+            if not os.path.isdir(local_dir):  # another worker may have created it
+                raise
+    part_path = local_path + ".part"
+    try:
+        with open(part_path, "wb") as f:
+            fd_file.download(f)
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    if os.path.exists(local_path):
+        os.remove(local_path)
+    os.rename(part_path, local_path)
+
+
+def _remaining_size(fobj):
+    """Return the number of bytes remaining in a file-like object, or None if unknown"""
+    if isinstance(fobj, mmap.mmap):
+        return len(fobj) - fobj.tell()
+    try:
+        return os.fstat(fobj.fileno()).st_size - fobj.tell()
+    except (AttributeError, EnvironmentError, ValueError):
+        pass
+    try:
+        position = fobj.tell()
+        fobj.seek(0, os.SEEK_END)
+        size = fobj.tell() - position
+        fobj.seek(position)
+        return size
+    except (AttributeError, EnvironmentError, ValueError):
+        return None
+
+
+class _Base64Body(object):
+    """File-like request body which base64 encodes the contents of a file as it is read
+
+    The body consists of ``prefix``, the base64 encoded contents of ``fobj`` and then
+    ``suffix``.  If ``size`` (the number of bytes to be read from ``fobj``) is known, the
+    length of the body is exposed so that it is sent with a ``Content-Length`` rather
+    than chunked.
+
+    """
+
+    def __init__(self, prefix, fobj, size, suffix):
+        self._pieces = self._iter_pieces(prefix, fobj, suffix)
+        self._buffer = b""
+        if size is not None:
+            self.len = len(prefix) + 4 * ((size + 2) // 3) + len(suffix)
+
+    @staticmethod
+    def _iter_pieces(prefix, fobj, suffix):
+        yield prefix
+        leftover = b""
+        while True:
+            raw = fobj.read(UPLOAD_CHUNK_SIZE)
+            if not raw:
+                break
+            raw = leftover + raw
+            usable = len(raw) - len(raw) % 3  # short reads must not introduce padding
+            leftover = raw[usable:]
+            yield base64.b64encode(raw[:usable])
+        yield base64.b64encode(leftover)
+        yield suffix
+
+    def read(self, size=-1):
+        while size is None or size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += six.next(self._pieces)
+            except StopIteration:
+                break
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
 
 
 class FileDataObject(object):
     """Encapsulate state and logic surrounding a "filedata" element"""
 
     @classmethod
-    def from_json(cls, fdapi, json_data):
+    def from_json(cls, fdapi, json_data, partial=False):
         fd_type = json_data["fdType"]
         if fd_type == "directory":
-            return FileDataDirectory.from_json(fdapi, json_data)
+            return FileDataDirectory.from_json(fdapi, json_data, partial)
         else:
-            return FileDataFile.from_json(fdapi, json_data)
+            return FileDataFile.from_json(fdapi, json_data, partial)
 
-    def __init__(self, fdapi, json_data):
+    def __init__(self, fdapi, json_data, partial=False):
         self._fdapi = fdapi
         self._json_data = json_data
+        self._partial = partial  # True if json_data only holds some attributes
+        self._metadata_loaded = not partial
+
+    def _get_attribute(self, name):
+        """Get an attribute from the json data, loading the metadata if it was projected out
+
+        The metadata is requested without the file contents (``embed=false``); contents
+        are only fetched by :meth:`get_data`.
+
+        """
+        if not self._metadata_loaded and name not in self._json_data:
+            condition = (fd_path == self.get_path()) & (fd_name == self.get_name())
+            for fd_json in self._fdapi._conn.iter_json_pages(
+                    "/ws/FileData", embed="false", condition=condition.compile()):
+                fd_json.update(self._json_data)
+                self._json_data = fd_json
+                break
+            self._metadata_loaded = True
+        return self._json_data.get(name)
 
-    def get_data(self):
+    def get_data(self, download=None):
         """Get the data associated with this filedata object
 
+        If the data was embedded in the listing this object came from, it is decoded
+        from there.  Otherwise the contents of a file are only fetched from the device
+        cloud (see :meth:`.FileDataFile.download`) if ``download`` is True or, when
+        ``download`` is left as None, if this object came from a listing which projected
+        out ``fdData`` (see the ``fields`` argument of :meth:`.FileDataAPI.get_filedata`).
+
+        :param download: Whether to fetch the contents of a file whose data was not
+            embedded.  If None, contents are only fetched for projected listings.
+        :type download: bool or None
         :returns: Data associated with this object or None if none exists
         :rtype: str (Python2)/bytes (Python3) or None
 
         """
-        # NOTE: we assume that the "embed" option is used
+        download = validate_type(download, type(None), bool)
+        if download is None:
+            download = self._partial
         base64_data = self._json_data.get("fdData")
-        if base64_data is None:
-            return None
-        else:
+        if base64_data is not None:
             # need to convert to bytes() with python 3
-            return base64.decodestring(six.b(base64_data))
+            return base64.b64decode(six.b(base64_data))
+        elif download and self.get_type() == "file":
+            fobj = six.BytesIO()
+            self.download(fobj)
+            return fobj.getvalue()
+        else:
+            return None
 
     def get_type(self):
         """Get the type (file/directory) of this object"""
@@ -176,19 +1119,19 @@ class FileDataObject(object):
 
     def get_last_modified_date(self):
         """Get the last modified datetime of this object"""
-        return iso8601_to_dt(self._json_data["fdLastModifiedDate"])
+        return iso8601_to_dt(self._get_attribute("fdLastModifiedDate"))
 
     def get_content_type(self):
         """Get the content type of this object (or None)"""
-        return self._json_data["fdContentType"]
+        return self._get_attribute("fdContentType")
 
     def get_customer_id(self):
         """Get the customer ID associated with this object"""
-        return self._json_data["cstId"]
+        return self._get_attribute("cstId")
 
     def get_created_date(self):
         """Get the datetime this object was created"""
-        return iso8601_to_dt(self._json_data["fdCreatedDate"])
+        return iso8601_to_dt(self._get_attribute("fdCreatedDate"))
 
     def get_name(self):
         """Get the name of this object"""
@@ -204,18 +1147,22 @@ class FileDataObject(object):
 
     def get_size(self):
         """Get this size of this object (will be 0 for directories)"""
-        return int(self._json_data["fdSize"])
+        return int(self._get_attribute("fdSize"))
+
+    def delete(self, recursive=False):
+        """Delete this object from the file data store (see :meth:`.FileDataAPI.delete`)"""
+        return self._fdapi.delete(self.get_full_path(), recursive)
 
 
 class FileDataDirectory(FileDataObject):
     """Provide access to a directory and its metadata in the filedata store"""
 
     @classmethod
-    def from_json(cls, fdapi, json_data):
-        return cls(fdapi, json_data)
+    def from_json(cls, fdapi, json_data, partial=False):
+        return cls(fdapi, json_data, partial)
 
-    def __init__(self, fdapi, data):
-        FileDataObject.__init__(self, fdapi, data)
+    def __init__(self, fdapi, data, partial=False):
+        FileDataObject.__init__(self, fdapi, data, partial)
 
     def __repr__(self):
         return "FileDataDirectory({!r})".format(self._json_data)
@@ -246,11 +1193,34 @@ class FileDataFile(FileDataObject):
     """Provide access to a file and its metadata in the filedata store"""
 
     @classmethod
-    def from_json(cls, fdapi, json_data):
-        return cls(fdapi, json_data)
+    def from_json(cls, fdapi, json_data, partial=False):
+        return cls(fdapi, json_data, partial)
 
-    def __init__(self, fdapi, json_data):
-        FileDataObject.__init__(self, fdapi, json_data)
+    def __init__(self, fdapi, json_data, partial=False):
+        FileDataObject.__init__(self, fdapi, json_data, partial)
 
     def __repr__(self):
         return "FileDataFile({!r})".format(self._json_data)
+
+    def download(self, fobj, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """Stream the contents of this file from the device cloud into ``fobj``
+
+        The raw contents are requested from ``/ws/FileData/<path>`` and written to
+        ``fobj`` in chunks as they are received, so the file is never held in memory
+        in full (or as base64).
+
+        :param fobj: A file-like object opened for writing in binary mode
+        :param int chunk_size: The size of the chunks in which the response is read
+        :return: The number of bytes written to ``fobj``
+
+        """
+        chunk_size = validate_type(chunk_size, *six.integer_types)
+        response = self._fdapi._conn.get(_filedata_url_path(self.get_full_path()), stream=True)
+        written = 0
+        try:
+            for chunk in self._fdapi._conn._iter_content(response, chunk_size):
+                fobj.write(chunk)
+                written += len(chunk)
+        finally:
+            response.close()
+        return written
@@ -0,0 +1,245 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2014 Etherios, Inc. All rights reserved.
+# Etherios, Inc. is a Division of Digi International.
+
+"""Incremental parsing of paged JSON list responses
+
+Paged web services resources respond with a JSON object holding some page
+metadata (``resultSize``, ``remainingSize``, ``pageCursor``, ...) and an
+``items`` list.  Parsing such a response with ``json.loads`` requires the
+entire body, its decoded text, and the full object tree to be held in memory
+at once.  :func:`iter_page_items` instead consumes the body a chunk at a time
+and yields each element of ``items`` as soon as it has been decoded.
+
+If the optional `ijson <https://pypi.python.org/pypi/ijson>`_ package is
+installed it is used for tokenizing; otherwise a pure-Python parser built on
+:meth:`json.JSONDecoder.raw_decode` is used.
+
+"""
+
+import codecs
+import decimal
+import json
+import re
+
+import six
+
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:  # pragma: no cover - optional dependency
+    ijson = None
+
+
+# Discard consumed text from the buffer once this many characters have been read
+_COMPACT_THRESHOLD = 64 * 1024
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",]}"
+_STRUCTURAL = re.compile(r'["{}\[\]]')  # characters of interest outside of strings
+_STRING_SPECIAL = re.compile(r'["\\]')  # characters of interest within strings
+
+
+def iter_page_items(chunks, metadata):
+    """Yield each element of the ``items`` list in a JSON page as it is decoded
+
+    :param chunks: Iterable over the body of the response as byte strings (for instance,
+        ``response.iter_content(chunk_size)``)
+    :param dict metadata: Dictionary which will be updated with every top-level key of the
+        page other than ``items``.  Keys appearing after ``items`` in the body are only
+        available once the generator has been exhausted.
+    :raises ValueError: If the body is not a JSON object
+
+    """
+    if ijson is not None:
+        return _iter_page_items_ijson(chunks, metadata)
+    return _iter_page_items_pure(chunks, metadata)
+
+
+class _ChunkFile(object):
+    """Minimal file-like adapter over an iterable of byte strings (for ijson)"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += six.next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _iter_page_items_ijson(chunks, metadata):
+    builder, depth = None, 0
+    for prefix, event, value in ijson.parse(_ChunkFile(chunks)):
+        if isinstance(value, decimal.Decimal):
+            value = float(value)  # match json.loads, which decodes non-integers as floats
+        if builder is not None:
+            builder.event(event, value)
+            if event in ("start_map", "start_array"):
+                depth += 1
+            elif event in ("end_map", "end_array"):
+                depth -= 1
+                if depth == 0:
+                    yield builder.value
+                    builder = None
+        elif prefix == "items.item":
+            if event in ("start_map", "start_array"):
+                builder, depth = ObjectBuilder(), 1
+                builder.event(event, value)
+            else:
+                yield value
+        elif prefix and "." not in prefix and prefix != "items":
+            if event in ("string", "number", "boolean", "null"):
+                metadata[prefix] = value
+
+
+class _TextBuffer(object):
+    """Incrementally decoded text with a read position, refilled from byte chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json_decoder = json.JSONDecoder()
+        self.text = u""
+        self.pos = 0
+        self.eof = False
+
+    def _read_text(self):
+        """Return the text decoded from the next chunk, or None if there is no more input"""
+        if self.eof:
+            return None
+        try:
+            chunk = six.next(self._chunks)
+        except StopIteration:
+            self.eof = True
+            return self._decoder.decode(b"", final=True)
+        return self._decoder.decode(chunk)
+
+    def fill(self):
+        """Append the next chunk to the buffer, returning False if there is no more input"""
+        text = self._read_text()
+        if text is None:
+            return False
+        if self.pos > _COMPACT_THRESHOLD:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        self.text += text
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it (None at the end)"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected %r at offset %d of JSON page" % (char, self.pos))
+        self.pos += 1
+
+    def _consume_composite(self):
+        """Consume the object, array or string at the current position, returning its text
+
+        Nesting and string state are tracked as each chunk arrives and the chunks are
+        only joined once the end of the value has been found, so a value spanning many
+        chunks is scanned once rather than re-parsed after every chunk.
+
+        """
+        pieces = []
+        text, start = self.text, self.pos
+        i = start
+        depth, in_string, escaped = 0, False, False
+        while True:
+            while i < len(text):
+                if escaped:
+                    i += 1
+                    escaped = False
+                    continue
+                match = (_STRING_SPECIAL if in_string else _STRUCTURAL).search(text, i)
+                if match is None:
+                    i = len(text)
+                    break
+                i = match.end()
+                char = match.group()
+                if char == "\\":
+                    escaped = True
+                    continue
+                if char == '"':
+                    in_string = not in_string
+                elif char in "{[":
+                    depth += 1
+                else:
+                    depth -= 1
+                if depth == 0 and not in_string:
+                    self.text, self.pos = text, i
+                    if not pieces:
+                        return text[start:i]
+                    pieces.append(text[:i])
+                    return u"".join(pieces)
+
+            pieces.append(text[start:])
+            text, start, i = self._read_text(), 0, 0
+            if text is None:
+                raise ValueError("Unterminated value in JSON page")
+
+    def decode_value(self):
+        """Decode and consume the next complete JSON value"""
+        if self.peek() in ("{", "[", '"'):
+            return self._json_decoder.decode(self._consume_composite())
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self.text, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+            # a number not followed by a delimiter may continue in the next chunk
+            if (isinstance(value, (float, ) + six.integer_types) and not isinstance(value, bool) and
+                    (end == len(self.text) or self.text[end] not in _DELIMITERS) and self.fill()):
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_page_items_pure(chunks, metadata):
+    buf = _TextBuffer(chunks)
+    buf.expect("{")
+    while True:
+        char = buf.peek()
+        if char == "}":
+            break
+        elif char == ",":
+            buf.pos += 1
+            continue
+        elif char is None:
+            raise ValueError("Unterminated JSON page")
+        key = buf.decode_value()
+        buf.expect(":")
+        if key == "items" and buf.peek() == "[":
+            buf.pos += 1
+            while True:
+                char = buf.peek()
+                if char == "]":
+                    buf.pos += 1
+                    break
+                elif char == ",":
+                    buf.pos += 1
+                    continue
+                elif char is None:
+                    raise ValueError("Unterminated items list in JSON page")
+                yield buf.decode_value()
+        else:
+            metadata[key] = buf.decode_value()
@@ -6,13 +6,36 @@
 # Etherios, Inc. is a Division of Digi International.
 
 """Server Command Interface functionality"""
+import logging
+import threading
+import time
+from xml.etree import ElementTree
+
+from concurrent.futures import Future
+
+from devicecloud import DeviceCloudException
 from devicecloud.apibase import APIBase
+from devicecloud.jsonstream import _ChunkFile
+from devicecloud.util import validate_type, iter_concurrently, RateLimiter
 import six
 
 
+# Size of the chunks in which streamed SCI replies are read and parsed
+SCI_REPLY_CHUNK_SIZE = 64 * 1024
+
+# Number of devices targeted by each request made by fan_out
+DEFAULT_FANOUT_BATCH_SIZE = 250
+
+# Bounds (in seconds) of the interval between polls of an outstanding asynchronous job
+DEFAULT_JOB_POLL_MIN_INTERVAL = 1.0
+DEFAULT_JOB_POLL_MAX_INTERVAL = 30.0
+
+logger = logging.getLogger("devicecloud.sci")
+
+
 SCI_TEMPLATE = """\
 <sci_request version="1.0">
-  <{operation}{synchronous}{cache}{sync_timeout}{allow_offline}{wait_for_reconnect}>
+  <{operation}{reply}{synchronous}{cache}{sync_timeout}{allow_offline}{wait_for_reconnect}>
     <targets>
       {targets}
     </targets>
@@ -22,6 +45,10 @@ SCI_TEMPLATE = """\
 """.replace("  ", "").replace("\r", "").replace("\n", "")  # two spaces is indentation
 
 
+class SciJobException(DeviceCloudException):
+    """An asynchronous SCI job could not be submitted, failed, or was canceled"""
+
+
 class TargetABC(object):
     """Abstract base class for all target types"""
 
@@ -32,6 +59,10 @@ class DeviceTarget(TargetABC):
     def __init__(self, device_id):
         self._device_id = device_id
 
+    def get_device_id(self):
+        """Get the id of the targeted device"""
+        return self._device_id
+
     def to_xml(self):
         return '<device id="{}"/>'.format(self._device_id)
 
@@ -73,6 +104,9 @@ class ServerCommandInterfaceAPI(APIBase):
                  cache=None, allow_offline=None, wait_for_reconnect=None):
         """Send SCI request to 1 or more targets
 
+        The raw ``requests`` response is returned.  To parse the reply for each device as
+        it is received, use :meth:`send_sci_results` instead.
+
         :param str operation: The operation is one of {send_message, update_firmware, disconnect, query_firmware_targets,
             file_system, data_service, and reboot}
         :param target: The device(s) to be targeted with this request
@@ -81,18 +115,58 @@ class ServerCommandInterfaceAPI(APIBase):
         TODO: document other params
 
         """
+        return self._conn.post("/ws/sci", self._build_request(
+            operation, target, payload, reply, synchronous, sync_timeout, cache, allow_offline, wait_for_reconnect))
+
+    def send_sci_results(self, operation, target, payload, chunk_size=SCI_REPLY_CHUNK_SIZE, **kwargs):
+        """Send an SCI request, yielding a :class:`SciDeviceResult` for each device as its reply is parsed
+
+        The reply is streamed and parsed incrementally (see :func:`iter_device_results`),
+        so replies covering thousands of devices are handled with flat memory use.
+
+        Example::
+
+            for result in dc.sci.send_sci_results("send_message", targets, "<rci_request>...</rci_request>"):
+                if result.is_success():
+                    handle(result.get_device_id(), result.get_payload())
+
+        :param chunk_size: The size of the chunks in which the reply is read
+        :param kwargs: The other arguments of :meth:`send_sci`
+        :return: Generator of :class:`SciDeviceResult`
+
+        """
+        return self._iter_results(self._build_request(operation, target, payload, **kwargs), chunk_size)
+
+    def prepare_sci(self, operation, payload, **kwargs):
+        """Validate and render an SCI request once, to be sent to varying targets
+
+        See :class:`PreparedSciRequest`.
+
+        :param str operation: The SCI operation (see :meth:`send_sci`)
+        :param str payload: The payload of the request
+        :param kwargs: The other arguments of :meth:`send_sci` (other than ``target``)
+        :return: A :class:`PreparedSciRequest`
+
+        """
+        return PreparedSciRequest(self, operation, payload, **kwargs)
+
+    def _iter_results(self, body, chunk_size):
+        """POST an SCI request body, yielding the :class:`SciDeviceResult` for each device"""
+        chunk_size = validate_type(chunk_size, *six.integer_types)
+        response = self._conn.post("/ws/sci", body, stream=True)
+        try:
+            for result in iter_device_results(self._conn._iter_content(response, chunk_size)):
+                yield result
+        finally:
+            response.close()
+
+    def _build_request(self, operation, target, payload, reply=None, synchronous=None, sync_timeout=None,
+                       cache=None, allow_offline=None, wait_for_reconnect=None):
+        """Validate the arguments of an SCI request, returning the body of the request"""
         if not isinstance(payload, six.string_types):
             raise TypeError("payload is required to be string")
 
-        # validate targets and bulid targets xml section
-        try:
-            iter(target)
-            targets = target
-        except TypeError:
-            targets = [target, ]
-        if not all(isinstance(t, TargetABC) for t in targets):
-            raise TypeError("Target(s) must each be instances of TargetABC")
-        targets_xml = "".join(t.to_xml() for t in targets)
+        targets_xml = _targets_xml(target)
 
         # reply argument
         if not isinstance(reply, (type(None), six.string_types)):
@@ -112,7 +186,7 @@ class ServerCommandInterfaceAPI(APIBase):
 
         # sync_timeout argument
         # TODO: What units is syncTimeout in?  seconds?
-        if not sync_timeout is None or isinstance(sync_timeout, six.integer_types):
+        if not (sync_timeout is None or isinstance(sync_timeout, six.integer_types)):
             raise TypeError("sync_timeout expected to either be None or a number")
         if sync_timeout is not None:
             sync_timeout_xml = ' syncTimeout="{}"'.format(sync_timeout)
@@ -143,7 +217,7 @@ class ServerCommandInterfaceAPI(APIBase):
         else:
             wait_for_reconnect_xml = ''
 
-        full_request = SCI_TEMPLATE.format(
+        return SCI_TEMPLATE.format(
             operation=operation,
             targets=targets_xml,
             reply=reply_xml,
@@ -155,5 +229,476 @@ class ServerCommandInterfaceAPI(APIBase):
             payload=payload
         )
 
-        # TODO: do parsing here?
-        return self._conn.post("/ws/sci", full_request)
+    def fan_out(self, operation, targets, payload, batch_size=DEFAULT_FANOUT_BATCH_SIZE, max_workers=4,
+                rate=None, retries=0, **kwargs):
+        """Send the same SCI request to many devices using concurrent batched requests
+
+        A single :meth:`send_sci` targeting thousands of devices is likely to time out.
+        This method instead splits the targets into batches of ``batch_size`` devices,
+        sends the batches concurrently (optionally limiting how many requests are started
+        per second) and records the outcome reported for each device.  Devices which failed
+        (because the device reported an error, was missing from the reply, or the request
+        covering it failed) are sent the request again, in new batches, up to ``retries``
+        more times.
+
+        Example::
+
+            report = dc.sci.fan_out("reboot", [DeviceTarget(d) for d in device_ids], "",
+                                    batch_size=500, max_workers=8, rate=5, retries=2)
+            for device_id in report.get_failed():
+                print device_id, report.get_results()[device_id].get_error_desc()
+
+        :param str operation: The SCI operation (see :meth:`send_sci`)
+        :param targets: Iterable of :class:`DeviceTarget` instances (duplicates are sent once)
+        :param str payload: The payload sent to each batch of devices
+        :param int batch_size: The maximum number of devices targeted by each request
+        :param int max_workers: The maximum number of requests in flight at once
+        :param rate: If not None, the maximum number of requests started per second
+        :param int retries: The number of times failed devices are retried
+        :param kwargs: Other keyword arguments to :meth:`send_sci` (e.g. ``synchronous``)
+        :return: A :class:`SciFanoutReport` covering every targeted device
+
+        """
+        batch_size = validate_type(batch_size, *six.integer_types)
+        retries = validate_type(retries, *six.integer_types)
+        rate = validate_type(rate, type(None), float, *six.integer_types)
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        device_ids = []
+        seen = set()
+        for target in targets:
+            device_id = validate_type(target, DeviceTarget).get_device_id()
+            if device_id not in seen:
+                seen.add(device_id)
+                device_ids.append(device_id)
+        limiter = RateLimiter(rate) if rate is not None else None
+        prepared = self.prepare_sci(operation, payload, **kwargs)
+
+        def send_batch(batch):
+            if limiter is not None:
+                limiter.acquire()
+            targets = [DeviceTarget(device_id) for device_id in batch]
+            return dict((result.get_device_id(), result) for result in prepared.send_results(targets))
+
+        results = {}
+        pending = device_ids
+        attempts = 0
+        while pending and attempts <= retries:
+            attempts += 1
+            batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+            for batch, replies, exception in iter_concurrently(send_batch, batches, max_workers=max_workers):
+                for device_id in batch:
+                    if exception is not None:
+                        results[device_id] = SciDeviceResult(device_id, exception=exception)
+                    else:
+                        results[device_id] = replies.get(device_id) or SciDeviceResult(
+                            device_id, error_desc="No reply for device")
+            pending = [device_id for device_id in pending if not results[device_id].is_success()]
+        return SciFanoutReport(device_ids, results, attempts)
+
+    def send_sci_async(self, operation, target, payload, **kwargs):
+        """Submit an SCI request as an asynchronous job, returning the id of the job
+
+        The device cloud replies as soon as the job has been queued rather than waiting
+        for the targeted devices.  Poll the job with :meth:`get_job_status` or, to manage
+        many outstanding jobs at once, submit them through a :class:`SciJobPoller`.
+
+        :param str operation: The SCI operation (see :meth:`send_sci`)
+        :param target: The device(s) to be targeted (see :meth:`send_sci`)
+        :param str payload: The payload of the request
+        :param kwargs: Other keyword arguments to :meth:`send_sci` (other than ``synchronous``)
+        :return: The job id (a string)
+        :raises SciJobException: If the reply does not include a job id
+
+        """
+        kwargs["synchronous"] = False
+        response = self.send_sci(operation, target, payload, **kwargs)
+        job_id = ElementTree.fromstring(response.content).findtext(".//jobId")
+        if not job_id:
+            raise SciJobException("No job id in reply to asynchronous SCI request: %r" % response.content)
+        return job_id.strip()
+
+    def get_job_status(self, job_id):
+        """Get the status of an asynchronous SCI job
+
+        :param str job_id: The id of the job (as returned by :meth:`send_sci_async`)
+        :return: A tuple of the job status (e.g. ``"in_progress"`` or ``"complete"``) and the
+            body of the ``<sci_reply>`` (which holds the results once the job is complete)
+
+        """
+        job_id = validate_type(job_id, *six.string_types)
+        response = self._conn.get("/ws/sci/{}".format(job_id))
+        return ElementTree.fromstring(response.content).get("job_status"), response.content
+
+
+class PreparedSciRequest(object):
+    """An SCI request which has been validated and rendered once, to be sent to varying targets
+
+    Schedulers often send the same command (operation, flags and payload) many times,
+    varying only the targets.  A prepared request validates its arguments and renders the
+    parts of the request before and after the targets to bytes when it is created, so each
+    send only renders the targets.  Prepared requests are immutable and may be shared
+    between threads.  They are created with :meth:`ServerCommandInterfaceAPI.prepare_sci`.
+
+    Example::
+
+        reboot = dc.sci.prepare_sci("reboot", "", synchronous=True)
+        for device_ids in due_for_reboot():
+            reboot.send([DeviceTarget(device_id) for device_id in device_ids])
+
+    """
+
+    def __init__(self, sci_api, operation, payload, **kwargs):
+        self._sci = sci_api
+        body = sci_api._build_request(operation, _PLACEHOLDER_TARGET, payload, **kwargs)
+        prefix, _, suffix = body.partition(_PLACEHOLDER_TARGET.to_xml())
+        self._prefix = prefix.encode('utf-8')
+        self._suffix = suffix.encode('utf-8')
+
+    def render(self, target):
+        """Return the body of the request for the provided target(s) (as bytes)"""
+        return self._prefix + _targets_xml(target).encode('utf-8') + self._suffix
+
+    def send(self, target):
+        """Send the request to the provided target(s), returning the raw response (as :meth:`send_sci`)"""
+        return self._sci._conn.post("/ws/sci", self.render(target))
+
+    def send_results(self, target, chunk_size=SCI_REPLY_CHUNK_SIZE):
+        """Send the request to the provided target(s), yielding a :class:`SciDeviceResult` per device
+
+        The reply is streamed and parsed as with :meth:`ServerCommandInterfaceAPI.send_sci_results`.
+
+        """
+        return self._sci._iter_results(self.render(target), chunk_size)
+
+
+class _PlaceholderTarget(TargetABC):
+    """Marks where targets are spliced into a :class:`PreparedSciRequest` (used internally)"""
+
+    def to_xml(self):
+        return "\x00targets\x00"  # NUL cannot appear in XML, so cannot clash with the payload
+
+
+_PLACEHOLDER_TARGET = _PlaceholderTarget()
+
+
+def _targets_xml(target):
+    """Validate a target or iterable of targets, returning the XML for the <targets> element"""
+    if isinstance(target, TargetABC):
+        targets = [target]
+    else:
+        try:
+            targets = list(target)
+        except TypeError:
+            targets = [target]
+    if not all(isinstance(t, TargetABC) for t in targets):
+        raise TypeError("Target(s) must each be instances of TargetABC")
+    return "".join(t.to_xml() for t in targets)
+
+
+class SciJobPoller(object):
+    """Track many outstanding asynchronous SCI jobs, polling them from a single thread
+
+    Each job is represented by a :class:`concurrent.futures.Future` which is resolved
+    with a mapping of device id -> :class:`SciDeviceResult` once the job completes (or
+    fails with a :class:`SciJobException`).  A background thread polls the jobs which are
+    due, up to ``max_workers`` at a time.  Each job is first polled ``min_interval``
+    seconds after it is submitted, and the interval doubles (up to ``max_interval``)
+    each time the job is found to be still in progress, so long running jobs such as
+    firmware updates cost few requests while short ones complete promptly.  Callbacks
+    are invoked from the polling thread.
+
+    Example::
+
+        with SciJobPoller(dc.sci) as poller:
+            futures = [poller.submit("reboot", DeviceTarget(device_id), "<reboot/>")
+                       for device_id in device_ids]
+            for future in concurrent.futures.as_completed(futures):
+                print future.result()
+
+    :param sci_api: The :class:`ServerCommandInterfaceAPI` used to submit and poll jobs
+    :param min_interval: The delay (in seconds) before a job is first polled
+    :param max_interval: The maximum delay (in seconds) between polls of a job
+    :param int max_workers: The maximum number of status requests in flight at once
+
+    """
+
+    def __init__(self, sci_api, min_interval=DEFAULT_JOB_POLL_MIN_INTERVAL,
+                 max_interval=DEFAULT_JOB_POLL_MAX_INTERVAL, max_workers=4):
+        self._sci = validate_type(sci_api, ServerCommandInterfaceAPI)
+        self._min_interval = float(validate_type(min_interval, float, *six.integer_types))
+        self._max_interval = float(validate_type(max_interval, float, *six.integer_types))
+        self._max_workers = validate_type(max_workers, *six.integer_types)
+        self._lock = threading.Condition()
+        self._jobs = {}  # job id -> _PolledJob
+        self._closed = False
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(cancel=exc_type is not None)
+
+    def submit(self, operation, target, payload, callback=None, **kwargs):
+        """Submit an asynchronous SCI request (see :meth:`ServerCommandInterfaceAPI.send_sci_async`)
+
+        :param callback: If not None, called as ``callback(job_id, future)`` once the job
+            is done
+        :return: A :class:`concurrent.futures.Future` for the results of the job
+
+        """
+        return self.watch(self._sci.send_sci_async(operation, target, payload, **kwargs), callback)
+
+    def watch(self, job_id, callback=None):
+        """Track a job which has already been submitted
+
+        :param str job_id: The id of the job
+        :param callback: If not None, called as ``callback(job_id, future)`` once the job
+            is done
+        :return: A :class:`concurrent.futures.Future` for the results of the job
+
+        """
+        job_id = validate_type(job_id, *six.string_types)
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(lambda f: callback(job_id, f))
+        with self._lock:
+            if self._closed:
+                raise SciJobException("The poller has been closed")
+            self._jobs[job_id] = _PolledJob(job_id, future, self._min_interval)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="devicecloud-sci-poller")
+                self._thread.daemon = True
+                self._thread.start()
+            self._lock.notify_all()
+        return future
+
+    def get_pending_count(self):
+        """Get the number of jobs which have not yet completed"""
+        with self._lock:
+            return len(self._jobs)
+
+    def close(self, cancel=False):
+        """Stop accepting jobs and stop the polling thread
+
+        :param bool cancel: If true, stop immediately, cancelling the futures of jobs which
+            have not completed (the jobs themselves continue on the device cloud).
+            Otherwise, wait for every outstanding job to complete.
+
+        """
+        with self._lock:
+            self._closed = True
+            if cancel:
+                for job in self._jobs.values():
+                    job.future.cancel()
+                self._jobs.clear()
+            self._lock.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _due_jobs(self):
+        """Wait for jobs to be due for polling, returning them (or None when closed and idle)"""
+        with self._lock:
+            while True:
+                if not self._jobs:
+                    if self._closed:
+                        return None
+                    self._lock.wait()
+                    continue
+                now = time.time()
+                due = [job for job in self._jobs.values() if job.next_poll <= now]
+                if due:
+                    return due
+                self._lock.wait(min(job.next_poll for job in self._jobs.values()) - now)
+
+    def _run(self):
+        while True:
+            due = self._due_jobs()
+            if due is None:
+                return
+            for job, reply, exception in iter_concurrently(lambda job: self._sci.get_job_status(job.job_id), due,
+                                                           max_workers=self._max_workers):
+                status = None
+                if exception is not None:
+                    logger.warning("Polling SCI job %s failed (will retry): %r", job.job_id, exception)
+                else:
+                    status, body = reply
+                if status in ("complete", "failed", "canceled"):
+                    with self._lock:
+                        self._jobs.pop(job.job_id, None)
+                    self._resolve(job, status, body)
+                else:
+                    job.interval = min(job.interval * 2, self._max_interval)
+                    job.next_poll = time.time() + job.interval
+
+    def _resolve(self, job, status, body):
+        if not job.future.set_running_or_notify_cancel():
+            return
+        if status != "complete":
+            job.future.set_exception(SciJobException("SCI job %s %s" % (job.job_id, status)))
+            return
+        try:
+            results = _parse_device_results(body)
+        except Exception as exception:
+            job.future.set_exception(exception)
+        else:
+            job.future.set_result(results)
+
+
+class _PolledJob(object):
+    """An outstanding job tracked by a :class:`SciJobPoller` (used internally)"""
+
+    def __init__(self, job_id, future, interval):
+        self.job_id = job_id
+        self.future = future
+        self.interval = interval
+        self.next_poll = time.time() + interval
+
+
+class SciDeviceResult(object):
+    """The outcome of an SCI request for a single device
+
+    If the device replied, :meth:`get_element` returns its ``<device>`` element from the
+    reply, which holds the operation specific response.  A device which reported an
+    ``<error>`` has an error id and description, and a device covered by a request which
+    failed altogether has the exception raised by the request.
+
+    """
+
+    def __init__(self, device_id, element=None, error_id=None, error_desc=None, exception=None, operation=None):
+        self._device_id = device_id
+        self._operation = operation
+        self._element = element
+        self._error_id = error_id
+        self._error_desc = error_desc
+        self._exception = exception
+
+    def __repr__(self):
+        if self.is_success():
+            return "SciDeviceResult({!r})".format(self._device_id)
+        return "SciDeviceResult({!r}, error_id={!r}, error_desc={!r})".format(
+            self._device_id, self._error_id, self._error_desc or str(self._exception))
+
+    def get_device_id(self):
+        """Get the id of the device"""
+        return self._device_id
+
+    def get_operation(self):
+        """Get the operation the device replied to (e.g. ``"send_message"``), if known"""
+        return self._operation
+
+    def get_payload(self):
+        """Get the first child of the ``<device>`` element other than ``<error>`` (or None)
+
+        For ``send_message`` this is the ``<rci_reply>``, for ``data_service`` the
+        ``<requests>`` element holding each ``<device_request>``.
+
+        """
+        if self._element is None:
+            return None
+        for child in self._element:
+            if child.tag != "error":
+                return child
+        return None
+
+    def get_element(self):
+        """Get the ``<device>`` :class:`~xml.etree.ElementTree.Element` from the reply (or None)"""
+        return self._element
+
+    def get_error_id(self):
+        """Get the id of the error reported for the device (or None)"""
+        return self._error_id
+
+    def get_error_desc(self):
+        """Get the description of the error reported for the device (or None)"""
+        return self._error_desc
+
+    def get_exception(self):
+        """Get the exception raised by the request covering the device (or None)"""
+        return self._exception
+
+    def is_success(self):
+        """Return True if the device replied without an error"""
+        return self._error_id is None and self._error_desc is None and self._exception is None
+
+
+class SciFanoutReport(object):
+    """The result of a call to :meth:`ServerCommandInterfaceAPI.fan_out`"""
+
+    def __init__(self, device_ids, results, attempts):
+        self._device_ids = device_ids
+        self._results = results
+        self._attempts = attempts
+
+    def __repr__(self):
+        return "SciFanoutReport(devices=%d, succeeded=%d, failed=%d, attempts=%d)" % (
+            len(self._device_ids), len(self.get_succeeded()), len(self.get_failed()), self._attempts)
+
+    def get_results(self):
+        """Get a mapping of device id -> :class:`SciDeviceResult` (from the last attempt)"""
+        return self._results
+
+    def get_succeeded(self):
+        """Get the list of ids of devices which replied without an error"""
+        return [device_id for device_id in self._device_ids if self._results[device_id].is_success()]
+
+    def get_failed(self):
+        """Get the list of ids of devices which failed on every attempt"""
+        return [device_id for device_id in self._device_ids if not self._results[device_id].is_success()]
+
+    def get_attempts(self):
+        """Get the number of rounds of requests that were sent"""
+        return self._attempts
+
+
+def iter_device_results(source):
+    """Incrementally parse an ``<sci_reply>``, yielding a :class:`SciDeviceResult` per device
+
+    The reply is parsed with :func:`~xml.etree.ElementTree.iterparse` and a result is
+    yielded as soon as each ``<device>`` element is complete.  Each device element is
+    then detached from the reply's tree, so memory use does not grow with the number of
+    devices (unless the caller keeps the results).
+
+    A device replying with an ``<error>`` has its error id and description set.  For
+    ``data_service`` replies, a ``<device_request>`` with a non-zero ``status`` is reported
+    as an error with the status as its id and the text of the request as its description.
+
+    :param source: The reply as bytes, a file-like object or an iterable of byte chunks
+    :return: Generator of :class:`SciDeviceResult`
+
+    """
+    if isinstance(source, six.binary_type):
+        source = six.BytesIO(source)
+    elif not hasattr(source, "read"):
+        source = _ChunkFile(source)
+    depth = 0
+    operation = None
+    for event, element in ElementTree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 2:
+                operation = element
+            continue
+        depth -= 1
+        if depth == 2 and element.tag == "device":
+            operation.remove(element)
+            yield _device_result(operation.tag, element)
+
+
+def _device_result(operation, device):
+    device_id = device.get("id")
+    error = device.find("error")
+    if error is not None:
+        return SciDeviceResult(device_id, device, error.get("id"), error.findtext("desc", ""), operation=operation)
+    if operation == "data_service":
+        for request in device.iter("device_request"):
+            status = request.get("status")
+            if status not in (None, "0"):
+                return SciDeviceResult(device_id, device, status, (request.text or "").strip(), operation=operation)
+    return SciDeviceResult(device_id, device, operation=operation)
+
+
+def _parse_device_results(reply):
+    """Return a mapping of device id -> :class:`SciDeviceResult` for an ``<sci_reply>``"""
+    return dict((result.get_device_id(), result) for result in iter_device_results(reply))
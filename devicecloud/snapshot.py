@@ -0,0 +1,216 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2014 Etherios, Inc. All rights reserved.
+# Etherios, Inc. is a Division of Digi International.
+
+"""Compact on-disk snapshots of the DeviceCore inventory
+
+Snapshots are written by :meth:`.DeviceCoreAPI.export_snapshot` and opened with
+:meth:`.DeviceCoreAPI.load_snapshot`.  A snapshot file has the following layout:
+
+1. An 8 byte magic string identifying the format.
+2. One record per device, each holding the device's compact JSON metadata
+   (UTF-8) prefixed by its length as a 4 byte big-endian integer.  Records are
+   written as devices are received, so exporting does not hold the inventory in
+   memory.  Index entries are sorted in bounded runs which are spilled to
+   temporary files and merged, so memory use while exporting stays constant
+   regardless of the number of devices.
+3. An index of fixed-width entries, sorted by connectware id, each holding the
+   connectware id (NUL padded) and the offset of the device's record.
+4. A trailer holding the offset of the index, the number of index entries, the
+   number of records, and the magic string again.
+
+Loading a snapshot memory-maps the file and reads only the trailer, so opening
+is fast regardless of the size of the inventory.  Devices are looked up by
+binary search over the index and decoded on demand.
+
+"""
+
+import heapq
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+from devicecloud import DeviceCloudException
+from devicecloud.devicecore import Device
+from devicecloud.util import validate_type
+import six
+
+
+SNAPSHOT_MAGIC = b"DCSNAP01"
+RECORD_HEADER = struct.Struct(">I")  # length of the record
+KEY_WIDTH = 64  # width of the connectware id in index entries
+INDEX_ENTRY = struct.Struct(">%dsQ" % KEY_WIDTH)  # (connectware id, record offset)
+TRAILER = struct.Struct(">QQQ8s")  # (index offset, index entries, records, magic)
+INDEX_RUN_ENTRIES = 65536  # index entries sorted in memory before being spilled to disk
+
+
+class SnapshotFormatException(DeviceCloudException):
+    """The file is not a valid device snapshot"""
+
+
+def _spill_run(entries):
+    """Sort index entries and write them to a temporary file, returning the file"""
+    entries.sort()  # entries begin with the NUL padded key, so this sorts by key
+    run = tempfile.TemporaryFile()
+    for entry in entries:
+        run.write(entry)
+    run.seek(0)
+    return run
+
+
+def _iter_run(run):
+    """Yield the index entries in a spilled run"""
+    while True:
+        entry = run.read(INDEX_ENTRY.size)
+        if len(entry) < INDEX_ENTRY.size:
+            return
+        yield entry
+
+
+def write_snapshot(path, devices):
+    """Write the metadata of each :class:`.Device` in ``devices`` to a snapshot at ``path``
+
+    ``devices`` may be a generator.  At most ``INDEX_RUN_ENTRIES`` index entries are
+    held in memory while writing; larger inventories are sorted in runs spilled to
+    temporary files which are merged into the index.  The snapshot is written to a
+    temporary file which replaces ``path`` once complete (and is removed on failure).
+
+    :return: The number of devices written
+
+    """
+    path = validate_type(path, *six.string_types)
+    temp_path = path + ".tmp"
+    entries = []
+    runs = []
+    count = 0
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            offset = len(SNAPSHOT_MAGIC)
+            for device in devices:
+                device_json = device.get_device_json()
+                record = json.dumps(device_json, separators=(',', ':')).encode('utf-8')
+                f.write(RECORD_HEADER.pack(len(record)))
+                f.write(record)
+                connectware_id = device_json.get("devConnectwareId")
+                if connectware_id:
+                    key = connectware_id.encode('utf-8')
+                    if len(key) > KEY_WIDTH:
+                        raise ValueError("Connectware id %r is too long to index" % connectware_id)
+                    entries.append(INDEX_ENTRY.pack(key, offset))
+                    if len(entries) >= INDEX_RUN_ENTRIES:
+                        runs.append(_spill_run(entries))
+                        entries = []
+                offset += RECORD_HEADER.size + len(record)
+                count += 1
+
+            entries.sort()
+            num_entries = len(entries) + sum(os.fstat(run.fileno()).st_size // INDEX_ENTRY.size
+                                             for run in runs)
+            for entry in heapq.merge(entries, *[_iter_run(run) for run in runs]):
+                f.write(entry)
+            f.write(TRAILER.pack(offset, num_entries, count, SNAPSHOT_MAGIC))
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        for run in runs:
+            run.close()
+
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temp_path, path)
+    return count
+
+
+class DeviceSnapshot(object):
+    """Read-only, memory-mapped view of a snapshot written by :func:`write_snapshot`
+
+    Instances are returned by :meth:`.DeviceCoreAPI.load_snapshot`.  Devices returned
+    from a snapshot hold the metadata from the time the snapshot was taken but are
+    otherwise ordinary :class:`.Device` objects (e.g. ``get_device_json(use_cached=False)``
+    will fetch current metadata).
+
+    Snapshots may be used as context managers, closing the file on exit.
+
+    """
+
+    def __init__(self, conn, sci, path):
+        self._conn = conn
+        self._sci = sci
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self._file.close()
+            raise SnapshotFormatException("%s is not a device snapshot" % path)
+        if (len(self._map) < len(SNAPSHOT_MAGIC) + TRAILER.size or
+                self._map[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC):
+            self.close()
+            raise SnapshotFormatException("%s is not a device snapshot" % path)
+        self._index_offset, self._index_count, self._record_count, magic = \
+            TRAILER.unpack_from(self._map, len(self._map) - TRAILER.size)
+        if magic != SNAPSHOT_MAGIC:
+            self.close()
+            raise SnapshotFormatException("%s is truncated" % path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._record_count
+
+    def __iter__(self):
+        offset = len(SNAPSHOT_MAGIC)
+        while offset < self._index_offset:
+            device_json, offset = self._read_record(offset)
+            yield Device(self._conn, self._sci, device_json)
+
+    def __contains__(self, connectware_id):
+        return self._find(connectware_id) is not None
+
+    def close(self):
+        """Unmap and close the snapshot file"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def _read_record(self, offset):
+        """Return (device json, offset of the next record) for the record at offset"""
+        length, = RECORD_HEADER.unpack_from(self._map, offset)
+        start = offset + RECORD_HEADER.size
+        return json.loads(self._map[start:start + length].decode('utf-8')), start + length
+
+    def _find(self, connectware_id):
+        """Binary search the index, returning the record offset for connectware_id or None"""
+        key = connectware_id.encode('utf-8').ljust(KEY_WIDTH, b"\0")
+        low, high = 0, self._index_count
+        while low < high:
+            middle = (low + high) // 2
+            entry_key, offset = INDEX_ENTRY.unpack_from(self._map, self._index_offset + middle * INDEX_ENTRY.size)
+            if entry_key < key:
+                low = middle + 1
+            elif entry_key > key:
+                high = middle
+            else:
+                return offset
+        return None
+
+    def get(self, connectware_id):
+        """Return the :class:`.Device` with the provided connectware id or None"""
+        connectware_id = validate_type(connectware_id, *six.string_types)
+        offset = self._find(connectware_id)
+        if offset is None:
+            return None
+        device_json, _ = self._read_record(offset)
+        return Device(self._conn, self._sci, device_json)
@@ -0,0 +1,428 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2014 Etherios, Inc. All rights reserved.
+# Etherios, Inc. is a Division of Digi International.
+
+"""Durable, disk-backed spooling of datapoint writes
+
+When writing datapoints from a gateway with unreliable connectivity, a failed
+:meth:`.StreamsAPI.bulk_write_datapoints` raises an exception and the points
+being written are lost unless the caller keeps them around.  The
+:class:`SpoolingWriter` provided here instead appends each datapoint to an
+on-disk log and returns immediately.  A background thread drains the log to
+the device cloud, retrying with backoff for as long as the device cloud is
+unreachable.
+
+The log is made up of append-only segment files.  Each record in a segment
+holds the serialized XML for a single datapoint prefixed by its length and a
+CRC32 checksum so that a torn write (e.g. from a power failure) can be detected
+and discarded on replay.  Segments are deleted once all of their datapoints
+have been acknowledged by the device cloud.  Datapoints rejected by the device
+cloud with a client error (e.g. a 400 for a malformed point) would never be
+accepted, so rather than blocking the spool they are moved to a dead-letter
+file (with the same record format, readable with :func:`read_segment`) and
+the sender moves on to the next segment.  Any segments found in the spool
+directory when a writer is created are replayed, so delivery is at-least-once:
+a segment that was partially sent when the process exited will be sent again
+in its entirety.
+
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from devicecloud import DeviceCloudHttpException
+from devicecloud.streams import StreamException, DataPoint, DeduplicationFilter, \
+    MAXIMUM_DATAPOINTS_PER_POST, _iter_post_datapoints_xml
+from devicecloud.util import validate_type
+import requests
+import six
+
+
+SEGMENT_SUFFIX = ".seg"
+DEAD_LETTER_SUFFIX = ".dead"
+RECORD_HEADER = struct.Struct(">II")  # (payload length, crc32 of payload)
+
+logger = logging.getLogger("devicecloud.spool")
+
+
+class SpoolFullException(StreamException):
+    """The spool has reached its configured maximum size"""
+
+
+class SpoolClosedException(StreamException):
+    """The spooling writer has been closed and cannot accept more datapoints"""
+
+
+class SpoolSenderException(StreamException):
+    """The background sender of a spooling writer has stopped unexpectedly"""
+
+
+def _segment_path(spool_dir, segment_number):
+    return os.path.join(spool_dir, "%020d%s" % (segment_number, SEGMENT_SUFFIX))
+
+
+def _is_retryable(exception):
+    """Return False if resending the datapoints which caused exception can never succeed"""
+    if isinstance(exception, DeviceCloudHttpException):
+        status_code = exception.response.status_code
+        return not (400 <= status_code < 500) or status_code in (408, 429)
+    return True
+
+
+def write_segment(path, records):
+    """Write serialized datapoints (as text) to a new segment file at path"""
+    with open(path, "wb") as f:
+        for record in records:
+            payload = record.encode('utf-8')
+            f.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload)
+
+
+def read_segment(path):
+    """Read and return the list of serialized datapoints (as text) in a segment file
+
+    Reading stops at the first truncated or corrupt record, with the remainder of
+    the file discarded (this is what a torn final write looks like).
+
+    """
+    records = []
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if not header:
+                break
+            if len(header) < RECORD_HEADER.size:
+                logger.warning("Discarding truncated record header in spool segment %s", path)
+                break
+            length, checksum = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or (zlib.crc32(payload) & 0xffffffff) != checksum:
+                logger.warning("Discarding corrupt record in spool segment %s", path)
+                break
+            records.append(payload.decode('utf-8'))
+    return records
+
+
+class SpoolingWriter(object):
+    """Write datapoints through a durable on-disk spool
+
+    Rather than creating this object directly, it is generally easier to use
+    :meth:`.StreamsAPI.get_spooling_writer`.  Example::
+
+        writer = dc.streams.get_spooling_writer("/var/spool/mygateway")
+        for reading in sensor_readings():
+            writer.write(DataPoint(stream_id="sensors/temperature", data=reading))
+        writer.close()  # wait for the spool to drain and stop the sender
+
+    :param conn: The :class:`.DeviceCloudConnection` used to send datapoints
+    :param str spool_dir: The directory in which segment files are stored.  It will
+        be created if it does not exist.  Only one writer may use a directory at a time.
+    :param int segment_max_datapoints: The number of datapoints after which the active
+        segment is sealed and made available to the sender.
+    :param float max_latency: The maximum time (in seconds) that a datapoint will sit in
+        the active segment before the segment is sealed and sent, even if not full.
+    :param max_spool_bytes: If not None, the maximum total size of all segments on disk.
+        Writes that would exceed this raise :class:`SpoolFullException`.
+    :param chunk_policy: The :class:`.ChunkPolicy` used when sending the contents of a
+        segment.  By default, datapoints are sent in requests of 250.
+    :param float retry_interval: The initial delay (in seconds) before retrying after a
+        failure to send.  The delay doubles on each consecutive failure up to
+        ``max_retry_interval``.
+    :param float max_retry_interval: The maximum delay between retries in seconds.
+    :param bool fsync: If True, each write will be flushed to stable storage before
+        returning.  This is slower but survives an operating system crash.
+    :param bool start: If True (the default), the background sender is started immediately.
+    :param dedup: If not None, a :class:`.DeduplicationFilter` used to drop datapoints
+        which have already been spooled before they are written to disk.
+
+    """
+
+    def __init__(self, conn, spool_dir, segment_max_datapoints=10 * MAXIMUM_DATAPOINTS_PER_POST,
+                 max_latency=5.0, max_spool_bytes=None, chunk_policy=None, retry_interval=1.0,
+                 max_retry_interval=300.0, fsync=False, start=True, dedup=None):
+        self._conn = conn
+        self._spool_dir = validate_type(spool_dir, *six.string_types)
+        self._segment_max_datapoints = validate_type(segment_max_datapoints, *six.integer_types)
+        self._max_latency = float(max_latency)
+        self._max_spool_bytes = validate_type(max_spool_bytes, type(None), *six.integer_types)
+        self._chunk_policy = chunk_policy
+        self._retry_interval = float(retry_interval)
+        self._max_retry_interval = float(max_retry_interval)
+        self._fsync = validate_type(fsync, bool)
+        self._dedup = validate_type(dedup, type(None), DeduplicationFilter)
+
+        self._lock = threading.Condition()
+        self._closed = False
+        self._stopping = False
+        self._thread = None
+        self._sender_exception = None
+        self._stats = {"spooled": 0, "sent": 0, "send_failures": 0, "dead_lettered": 0}
+
+        if not os.path.isdir(self._spool_dir):
+            os.makedirs(self._spool_dir)
+
+        # Any segments left over from a previous run are replayed before new ones
+        self._sealed_segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self._spool_dir)
+            if name.endswith(SEGMENT_SUFFIX))
+        if self._sealed_segments:
+            logger.info("Replaying %d spool segment(s) from %s", len(self._sealed_segments), self._spool_dir)
+        self._spool_bytes = sum(os.path.getsize(_segment_path(self._spool_dir, n))
+                                for n in self._sealed_segments)
+        self._next_segment_number = (self._sealed_segments[-1] + 1) if self._sealed_segments else 0
+        self._active_file = None
+        self._active_segment_number = None
+        self._active_count = 0
+        self._active_opened_at = None
+
+        if start:
+            self.start()
+
+    def start(self):
+        """Start the background thread which sends spooled datapoints"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="devicecloud-spool-sender")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def write(self, datapoint):
+        """Append a single datapoint to the spool
+
+        :param DataPoint datapoint: The datapoint to write.  It must have a stream id set.
+        :raises SpoolFullException: if the spool has reached ``max_spool_bytes``
+        :raises SpoolClosedException: if the writer has been closed
+
+        """
+        self.write_many([datapoint])
+
+    def write_many(self, datapoints):
+        """Append many datapoints to the spool
+
+        All of the datapoints are validated before any are written.
+
+        :param datapoints: Iterable of :class:`.DataPoint` objects, each having a stream id
+        :raises SpoolFullException: if the spool has reached ``max_spool_bytes``
+        :raises SpoolClosedException: if the writer has been closed
+
+        """
+        datapoints = list(datapoints)
+        for dp in datapoints:
+            if not isinstance(dp, DataPoint):
+                raise TypeError("All items in the datapoints list must be DataPoints")
+            if dp.get_stream_id() is None:
+                raise ValueError("stream_id must be set on all datapoints")
+
+        with self._lock:
+            if self._closed:
+                raise SpoolClosedException("Spooling writer has been closed")
+            if self._dedup is not None:
+                # only recorded as seen once written to the spool below
+                datapoints = self._dedup.filter(datapoints, record=False)
+            records = []
+            for dp in datapoints:
+                payload = dp.to_xml().encode('utf-8')
+                records.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload)
+            size = sum(len(record) for record in records)
+            if self._max_spool_bytes is not None and self._spool_bytes + size > self._max_spool_bytes:
+                raise SpoolFullException("Spool at %s is full" % self._spool_dir)
+
+            for record in records:
+                if self._active_file is None:
+                    self._open_active_segment()
+                self._active_file.write(record)
+                self._active_count += 1
+                if self._active_count >= self._segment_max_datapoints:
+                    self._seal_active_segment()
+            if self._active_file is not None:
+                self._active_file.flush()
+                if self._fsync:
+                    os.fsync(self._active_file.fileno())
+            self._spool_bytes += size
+            self._stats["spooled"] += len(records)
+            if self._dedup is not None:
+                self._dedup.record(datapoints)
+
+    def flush(self, timeout=None):
+        """Seal the active segment and wait for everything spooled so far to be sent
+
+        If the background sender has not been started, this returns immediately.
+
+        :param timeout: The maximum time to wait in seconds (or None to wait forever)
+        :return: True if the spool was drained, False if the timeout expired first
+        :raises SpoolSenderException: if the background sender has stopped unexpectedly
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            self._seal_active_segment()
+            self._lock.notify_all()
+            self._check_sender()
+            if self._thread is None:
+                return not self._sealed_segments
+            while self._sealed_segments:
+                self._check_sender()
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        """Stop accepting datapoints, wait for the spool to drain, and stop the sender
+
+        Any datapoints not sent before the timeout expires remain on disk and will be
+        replayed by the next writer created for this spool directory.
+
+        :param timeout: The maximum time to wait for the spool to drain (None to wait forever)
+        :return: True if the spool was drained, False if the timeout expired first
+        :raises SpoolSenderException: if the background sender has stopped unexpectedly
+
+        """
+        with self._lock:
+            self._closed = True
+            self._seal_active_segment()
+        if self._thread is None:
+            return not self._sealed_segments
+        try:
+            drained = self.flush(timeout)
+        except SpoolSenderException:
+            self._thread.join()
+            raise
+        with self._lock:
+            self._stopping = True
+            self._lock.notify_all()
+        self._thread.join()
+        return drained
+
+    def get_stats(self):
+        """Get a dictionary with counters for this writer
+
+        Includes ``spooled``, ``sent`` and ``dead_lettered`` datapoint counts, the number of
+        ``send_failures``, ``pending_segments`` waiting to be sent and the current
+        ``spool_bytes`` on disk.
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending_segments"] = len(self._sealed_segments) + (1 if self._active_count else 0)
+            stats["spool_bytes"] = self._spool_bytes
+            return stats
+
+    def _check_sender(self):
+        """Raise if the background sender has died (lock must be held)"""
+        if self._sender_exception is not None:
+            raise SpoolSenderException("Spool sender stopped unexpectedly: %r" % (self._sender_exception, ))
+
+    def _open_active_segment(self):
+        self._active_segment_number = self._next_segment_number
+        self._next_segment_number += 1
+        self._active_file = open(_segment_path(self._spool_dir, self._active_segment_number), "ab")
+        self._active_count = 0
+        self._active_opened_at = time.time()
+
+    def _seal_active_segment(self):
+        """Close the active segment (if any) and queue it for sending (lock must be held)"""
+        if self._active_file is None:
+            return
+        if self._fsync:
+            os.fsync(self._active_file.fileno())
+        self._active_file.close()
+        self._sealed_segments.append(self._active_segment_number)
+        self._active_file = None
+        self._active_segment_number = None
+        self._active_count = 0
+        self._lock.notify_all()
+
+    def _next_segment(self):
+        """Wait for and return the number of the next segment to send (or None when stopping)"""
+        with self._lock:
+            while True:
+                if self._sealed_segments:
+                    return self._sealed_segments[0]
+                if self._stopping:
+                    return None
+                if self._active_file is not None:
+                    age = time.time() - self._active_opened_at
+                    if age >= self._max_latency:
+                        self._seal_active_segment()
+                        continue
+                    self._lock.wait(self._max_latency - age)
+                else:
+                    self._lock.wait()
+
+    def _run(self):
+        try:
+            self._send_segments()
+        except Exception as exception:
+            logger.exception("Spool sender for %s stopped unexpectedly", self._spool_dir)
+            with self._lock:
+                self._sender_exception = exception
+                self._lock.notify_all()
+
+    def _backoff(self, retry_interval):
+        """Wait before retrying a failed send, returning True if the writer is stopping"""
+        with self._lock:
+            self._stats["send_failures"] += 1
+            if not self._stopping:
+                self._lock.wait(retry_interval)
+            return self._stopping
+
+    def _send_segments(self):
+        retry_interval = self._retry_interval
+        sent_offsets = {}  # segment number -> number of records already acknowledged
+        while True:
+            segment_number = self._next_segment()
+            if segment_number is None:
+                return
+
+            path = _segment_path(self._spool_dir, segment_number)
+            offset = sent_offsets.get(segment_number, 0)
+            previously_written = 0
+            try:
+                records = read_segment(path)
+                for num_written in _iter_post_datapoints_xml(self._conn, "/ws/DataPoint",
+                                                             records[offset:], self._chunk_policy):
+                    sent_offsets[segment_number] = offset + num_written
+                    with self._lock:
+                        self._stats["sent"] += num_written - previously_written
+                    previously_written = num_written
+            except (DeviceCloudHttpException, requests.exceptions.RequestException) as exception:
+                if not _is_retryable(exception):
+                    unsent = records[sent_offsets.get(segment_number, 0):]
+                    dead_path = path[:-len(SEGMENT_SUFFIX)] + DEAD_LETTER_SUFFIX
+                    logger.error("Device cloud rejected spooled datapoints (%r); moving %d datapoint(s) "
+                                 "to %s", exception, len(unsent), dead_path)
+                    write_segment(dead_path, unsent)
+                    with self._lock:
+                        self._stats["dead_lettered"] += len(unsent)
+                else:
+                    logger.warning("Failed to send spooled datapoints (retrying in %.1fs): %r",
+                                   retry_interval, exception)
+                    if self._backoff(retry_interval):
+                        return
+                    retry_interval = min(retry_interval * 2, self._max_retry_interval)
+                    continue
+            except Exception:
+                # Unexpected (e.g. reading the segment failed); keep the sender alive and retry
+                logger.exception("Unexpected error sending spooled datapoints (retrying in %.1fs)",
+                                 retry_interval)
+                if self._backoff(retry_interval):
+                    return
+                retry_interval = min(retry_interval * 2, self._max_retry_interval)
+                continue
+
+            # every record in the segment has been acknowledged or dead-lettered
+            retry_interval = self._retry_interval
+            sent_offsets.pop(segment_number, None)
+            with self._lock:
+                self._spool_bytes -= os.path.getsize(path)
+                os.remove(path)
+                self._sealed_segments.remove(segment_number)
+                self._lock.notify_all()
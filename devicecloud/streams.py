@@ -7,14 +7,19 @@
 
 r"""Module providing classes for interacting with device cloud data streams"""
 
+import collections
 import logging
 import datetime
+import itertools
+import threading
+import time
 
+import requests
 import six
 from devicecloud.apibase import APIBase
 from devicecloud import DeviceCloudException, DeviceCloudHttpException
 from devicecloud.util import conditional_write, to_none_or_dt, validate_type, isoformat, \
-    dc_utc_timestamp_to_dt
+    dc_utc_timestamp_to_dt, iter_concurrently
 from six import StringIO
 
 
@@ -43,6 +48,9 @@ ROLLUP_METHOD_STDDEV = "standarddev"
 
 MAXIMUM_DATAPOINTS_PER_POST = 250
 
+# When coalescing deletes, runs shorter than this are cheaper to delete one at a time
+MINIMUM_DELETE_RANGE_RUN = 3
+
 
 # Mapping in the following form:
 # <dc-type> -> (<dc-to-python-fn>, <python-to-dc-fn>)
@@ -58,6 +66,7 @@ DSTREAM_TYPE_MAP = {
 
 
 ONE_DAY = 86400  # in seconds
+ONE_MILLISECOND = datetime.timedelta(milliseconds=1)
 
 logger = logging.getLogger("devicecloud.streams")
 
@@ -186,7 +195,7 @@ class StreamsAPI(APIBase):
         else:
             return stream
 
-    def bulk_write_datapoints(self, datapoints):
+    def bulk_write_datapoints(self, datapoints, chunk_policy=None, dedup=None):
         """Perform a bulk write (or set of writes) of a collection of data points
 
         This method takes a list (or other iterable) of datapoints and writes them
@@ -213,9 +222,14 @@ class StreamsAPI(APIBase):
             dc.streams.bulk_write_datapoints(datapoints)
 
         Depending on the size of the list of datapoints provided, this method may
-        need to make multiple calls to the device cloud (in chunks of 250).
+        need to make multiple calls to the device cloud (in chunks of 250 by default,
+        see :class:`.ChunkPolicy` for alternatives).
 
         :param list datapoints: a list of datapoints to be written to the device cloud
+        :param chunk_policy: The :class:`.ChunkPolicy` determining how the datapoints are
+            split into requests.  If None, a :class:`.FixedChunkPolicy` of 250 points is used.
+        :param dedup: If not None, a :class:`.DeduplicationFilter` used to drop datapoints
+            which have already been written.
         :raises TypeError: if a list of datapoints is not provided
         :raises ValueError: if any of the provided data points do not have all required
             information (such as information about the stream)
@@ -230,22 +244,402 @@ class StreamsAPI(APIBase):
             if dp.get_stream_id() is None:
                 raise ValueError("stream_id must be set on all datapoints")
 
-        remaining_datapoints = datapoints
-        while remaining_datapoints:
-            # take up to 250 points and post them until complete
-            this_chunk_of_datapoints = remaining_datapoints[:MAXIMUM_DATAPOINTS_PER_POST]
-            remaining_datapoints = remaining_datapoints[MAXIMUM_DATAPOINTS_PER_POST:]
+        dedup = validate_type(dedup, type(None), DeduplicationFilter)
+        _write_datapoints_in_chunks(self._conn, "/ws/DataPoint", datapoints, chunk_policy, dedup)
+
+    def get_spooling_writer(self, spool_dir, **kwargs):
+        """Return a :class:`.SpoolingWriter` which writes datapoints via a durable on-disk spool
+
+        Datapoints written to the returned writer are appended to a log in ``spool_dir``
+        and acknowledged immediately.  A background thread sends them to the device cloud,
+        retrying for as long as necessary, and any datapoints left in the spool when the
+        process exits are sent by the next writer created for the same directory.  See
+        :mod:`devicecloud.spool` for details and the additional keyword arguments accepted.
+
+        :param str spool_dir: The directory in which to store the spool
+        :return: A started :class:`.SpoolingWriter`
+
+        """
+        from devicecloud.spool import SpoolingWriter  # prevent circular imports
+
+        return SpoolingWriter(self._conn, spool_dir, **kwargs)
+
+    def delete_datapoints(self, datapoints, coalesce=False, max_workers=4, progress=None):
+        """Delete a collection of data points which may span multiple streams
+
+        Each DataPoint provided must have both its id and stream id set (this is
+        the case for all points returned by :meth:`.DataStream.read`).  The points
+        are grouped by stream and each group is deleted as described in
+        :meth:`.DataStream.delete_datapoints`, with the deletes for all streams sharing
+        a single pool of workers.
+
+        :param datapoints: An iterable of :class:`.DataPoint` objects to be deleted
+        :param bool coalesce: If True, runs of points which are contiguous on the device
+            cloud will be deleted using a single time range delete.  See
+            :meth:`.DataStream.delete_datapoints` for details.
+        :param int max_workers: The maximum number of delete requests that will be in
+            flight at any one time.
+        :param progress: If not None, a callable that will be called as
+            ``progress(num_completed, num_total)`` after each point (or range of points)
+            has been deleted.
+        :raises TypeError: if any of the provided items are not DataPoints
+        :raises ValueError: if any of the provided data points do not have an id or stream id
+        :return: A dictionary mapping each datapoint id to None if it was deleted
+            successfully or the exception raised while trying to delete it.
+
+        """
+        datapoints_by_stream = {}
+        for dp in datapoints:
+            if not isinstance(dp, DataPoint):
+                raise TypeError("All items in the datapoints list must be DataPoints")
+            if dp.get_stream_id() is None or dp.get_id() is None:
+                raise ValueError("stream_id and id must be set on all datapoints")
+            datapoints_by_stream.setdefault(dp.get_stream_id(), []).append(dp)
+
+        operations = []
+        for stream_id, stream_datapoints in datapoints_by_stream.items():
+            stream = DataStream(self._conn, stream_id)
+            operations.extend(stream._get_delete_operations(stream_datapoints, coalesce))
+        return _perform_delete_operations(self._conn, operations, max_workers, progress)
+
+
+def _perform_delete_operations(conn, operations, max_workers, progress):
+    """Execute a list of ``(path, datapoint_ids)`` DELETEs concurrently (used internally)"""
+    total = sum(len(ids) for _path, ids in operations)
+    completed = 0
+    results = {}
+    for (path, ids), _result, exception in iter_concurrently(
+            lambda operation: conn.delete(operation[0]), operations, max_workers):
+        if exception is not None:
+            logger.warning("Failed to delete %s datapoint(s) with %s: %r", len(ids), path, exception)
+        for dp_id in ids:
+            results[dp_id] = exception
+        completed += len(ids)
+        if progress is not None:
+            progress(completed, total)
+    return results
+
+
+class ChunkPolicy(object):
+    """Base class for policies controlling how bulk writes are split into requests
+
+    A chunk policy is consulted before each request made by a bulk write (e.g.
+    :meth:`.StreamsAPI.bulk_write_datapoints`) to determine how many of the remaining
+    datapoints should be included, and is informed of the outcome of each request.
+    Policies may be reused across many bulk writes (which allows adaptive policies to
+    retain what they have learned) but are not safe to share between threads.
+
+    """
+
+    def get_chunk_size(self, datapoints_xml, start):
+        """Return the number of datapoints (at least 1) to include in the next request
+
+        :param list datapoints_xml: The serialized XML for every datapoint in this bulk write
+        :param int start: The index of the first datapoint not yet written
+
+        """
+        raise NotImplementedError("Should be implemented in subclass")
+
+    def record_result(self, num_datapoints, num_bytes, elapsed, exception=None):
+        """Record the outcome of a request and indicate if a failed request should be retried
+
+        :param int num_datapoints: The number of datapoints included in the request
+        :param int num_bytes: The size of the request body
+        :param float elapsed: The time taken by the request in seconds
+        :param exception: The exception raised by the request or None if it was successful
+        :return: True if the datapoints from a failed request should be retried (with
+            a new chunk size) rather than the exception being raised.
+
+        """
+        return False
+
+
+class FixedChunkPolicy(ChunkPolicy):
+    """Write a fixed number of datapoints in each request (the default behavior)"""
+
+    def __init__(self, max_datapoints=MAXIMUM_DATAPOINTS_PER_POST):
+        self._max_datapoints = _validate_datapoint_count(max_datapoints, "max_datapoints")
+
+    def get_chunk_size(self, datapoints_xml, start):
+        return self._max_datapoints
+
+
+class MaxBytesChunkPolicy(ChunkPolicy):
+    """Limit the size of each request body as well as the number of datapoints
+
+    This is useful when writing large string or binary datapoints where 250 points
+    may result in a very large request.  A single datapoint larger than ``max_bytes``
+    will still be written (in a request by itself).
+
+    """
+
+    def __init__(self, max_bytes, max_datapoints=MAXIMUM_DATAPOINTS_PER_POST):
+        self._max_bytes = validate_type(max_bytes, *six.integer_types)
+        self._max_datapoints = _validate_datapoint_count(max_datapoints, "max_datapoints")
+
+    def get_chunk_size(self, datapoints_xml, start):
+        return _count_datapoints_within(datapoints_xml, start, self._max_datapoints, self._max_bytes)
+
+
+class AdaptiveChunkPolicy(ChunkPolicy):
+    """Grow or shrink the number of datapoints per request based on observed performance
+
+    The chunk size is adjusted using additive-increase/multiplicative-decrease: while
+    requests complete within ``target_latency`` the chunk size grows by ``increment``
+    (up to the server limit of 250 points); when a request is slower than the target,
+    the chunk size is scaled down proportionally.  Requests that fail with a 413 (request
+    too large) or with a connection error (the request could not be sent) cause the chunk
+    size to be halved and the datapoints from the failed request to be retried.  Other
+    errors are raised to the caller as usual.
+
+    POSTs to ``/ws/DataPoint`` are not idempotent: a request which fails with a server
+    error (5xx) may still have been partially or wholly applied, in which case retrying
+    it writes datapoints twice.  Server errors are therefore only retried if
+    ``retry_server_errors`` is True, which is only safe if duplicate points are
+    acceptable (or every datapoint has a timestamp, as points are keyed by stream and
+    timestamp).
+
+    """
+
+    def __init__(self, target_latency=2.0, initial_datapoints=50, increment=25,
+                 min_datapoints=1, max_datapoints=MAXIMUM_DATAPOINTS_PER_POST, max_bytes=None,
+                 retry_server_errors=False):
+        self._target_latency = float(target_latency)
+        self._increment = validate_type(increment, *six.integer_types)
+        self._min_datapoints = _validate_datapoint_count(min_datapoints, "min_datapoints")
+        self._max_datapoints = _validate_datapoint_count(max_datapoints, "max_datapoints")
+        self._max_bytes = validate_type(max_bytes, type(None), *six.integer_types)
+        self._retry_server_errors = validate_type(retry_server_errors, bool)
+        self._chunk_size = max(self._min_datapoints, min(self._max_datapoints, initial_datapoints))
+
+    def get_current_chunk_size(self):
+        """Get the number of datapoints the policy will currently place in each request"""
+        return self._chunk_size
+
+    def get_chunk_size(self, datapoints_xml, start):
+        return _count_datapoints_within(datapoints_xml, start, self._chunk_size, self._max_bytes)
+
+    def record_result(self, num_datapoints, num_bytes, elapsed, exception=None):
+        if exception is not None:
+            if isinstance(exception, DeviceCloudHttpException):
+                status_code = exception.response.status_code
+                retryable = status_code == 413 or (self._retry_server_errors and status_code >= 500)
+            else:
+                # the request was never sent; read timeouts and the like may have been applied
+                retryable = isinstance(exception, requests.exceptions.ConnectionError)
+            self._chunk_size = max(self._min_datapoints, min(self._chunk_size, num_datapoints) // 2)
+            return retryable and num_datapoints > self._min_datapoints
+
+        if elapsed > self._target_latency:
+            scaled = int(num_datapoints * self._target_latency / elapsed)
+            self._chunk_size = max(self._min_datapoints, min(self._chunk_size, scaled))
+        elif num_datapoints >= self._chunk_size:
+            # only grow if we actually filled the chunk (and it was fast enough)
+            self._chunk_size = min(self._max_datapoints, self._chunk_size + self._increment)
+        return False
+
+
+class DeduplicationFilter(object):
+    """Drop datapoints that have already been seen within a recent window
+
+    Producers which resend overlapping windows of data (e.g. after reconnecting)
+    can pass a filter to the bulk write methods (or to a :class:`.SpoolingWriter`)
+    in order to avoid writing the same point twice.  Datapoints are considered
+    duplicates if they share a stream id and timestamp (and, if ``include_data``
+    is True, the same data).  Datapoints without a timestamp are never considered
+    duplicates as their timestamp is assigned by the device cloud.
 
-            # Build XML list containing data for all points
-            datapoints_out = StringIO()
-            datapoints_out.write("<list>")
-            for dp in this_chunk_of_datapoints:
-                datapoints_out.write(dp.to_xml())
-            datapoints_out.write("</list>")
+    Memory use is bounded: keys are forgotten once they are older than ``window``
+    seconds or once more than ``max_entries`` keys are being tracked (oldest first).
+    A filter may be shared between threads and reused across many writes.
 
-            # And send the HTTP Post
-            self._conn.post("/ws/DataPoint", datapoints_out.getvalue())
-            logger.info('DataPoint batch of %s datapoints written', len(this_chunk_of_datapoints))
+    The bulk write methods only record datapoints as seen once the request which
+    included them has been acknowledged by the device cloud, so points from a failed
+    write are not suppressed when the write is retried.
+
+    Example::
+
+        dedup = DeduplicationFilter(window=3600)
+        for window_of_points in producer():
+            dc.streams.bulk_write_datapoints(window_of_points, dedup=dedup)
+        print dedup.get_stats()
+
+    """
+
+    def __init__(self, window=ONE_DAY, max_entries=100000, include_data=False):
+        self._window = float(window)
+        self._max_entries = validate_type(max_entries, *six.integer_types)
+        self._include_data = validate_type(include_data, bool)
+        self._seen = collections.OrderedDict()  # key -> time first seen, oldest first
+        self._lock = threading.Lock()
+        self._passed = 0
+        self._suppressed = 0
+
+    def _make_key(self, datapoint):
+        timestamp = datapoint.get_timestamp()
+        if timestamp is None:
+            return None
+        key = (datapoint.get_stream_id(), isoformat(timestamp))
+        if self._include_data:
+            key += (six.text_type(datapoint.get_data()), )
+        return key
+
+    def _check_and_record(self, key, record):
+        """Return True if key was seen before, otherwise record it if requested (lock must be held)"""
+        if key is None:
+            return False
+        now = time.time()
+        self._expire(now)
+        if key in self._seen:
+            return True
+        if record:
+            self._seen[key] = now
+            self._expire(now)
+        return False
+
+    def _expire(self, now):
+        cutoff = now - self._window
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if seen_at >= cutoff and len(self._seen) <= self._max_entries:
+                break
+            del self._seen[key]
+
+    def is_duplicate(self, datapoint):
+        """Return True if the datapoint has been seen before, recording it if not"""
+        key = self._make_key(validate_type(datapoint, DataPoint))
+        with self._lock:
+            if self._check_and_record(key, True):
+                self._suppressed += 1
+                return True
+            self._passed += 1
+            return False
+
+    def filter(self, datapoints, record=True):
+        """Return a list of the provided datapoints which are not duplicates
+
+        Duplicates within ``datapoints`` itself are also removed.
+
+        :param datapoints: Iterable of :class:`.DataPoint` objects
+        :param bool record: If True, the returned datapoints are recorded as seen.  If
+            False, they are not and :meth:`record` should be called once they have been
+            written successfully.
+
+        """
+        record = validate_type(record, bool)
+        result = []
+        batch_keys = set()
+        for dp in datapoints:
+            key = self._make_key(validate_type(dp, DataPoint))
+            with self._lock:
+                if key in batch_keys or self._check_and_record(key, record):
+                    self._suppressed += 1
+                    continue
+                self._passed += 1
+            if key is not None:
+                batch_keys.add(key)
+            result.append(dp)
+        return result
+
+    def record(self, datapoints):
+        """Record the provided datapoints as seen (e.g. once they have been written)"""
+        for dp in datapoints:
+            key = self._make_key(validate_type(dp, DataPoint))
+            if key is not None:
+                with self._lock:
+                    now = time.time()
+                    self._seen[key] = now
+                    self._expire(now)
+
+    def get_stats(self):
+        """Get a dictionary with counts of datapoints ``passed`` and ``suppressed``
+
+        The number of keys currently being tracked is available as ``tracked``.
+
+        """
+        with self._lock:
+            return {"passed": self._passed, "suppressed": self._suppressed, "tracked": len(self._seen)}
+
+    def clear(self):
+        """Forget all datapoints seen so far (counters are not reset)"""
+        with self._lock:
+            self._seen.clear()
+
+
+def _validate_datapoint_count(count, name):
+    """Ensure a datapoint count is an integer within the limit imposed by the device cloud"""
+    count = validate_type(count, *six.integer_types)
+    if not 1 <= count <= MAXIMUM_DATAPOINTS_PER_POST:
+        raise ValueError("%s must be between 1 and %d" % (name, MAXIMUM_DATAPOINTS_PER_POST))
+    return count
+
+
+def _count_datapoints_within(datapoints_xml, start, max_datapoints, max_bytes):
+    """Count how many datapoints from start fit within the provided limits (at least 1)"""
+    if max_bytes is None:
+        return max_datapoints
+    total_bytes = len("<list></list>")
+    count = 0
+    for xml in itertools.islice(datapoints_xml, start, start + max_datapoints):
+        total_bytes += len(xml.encode('utf-8'))
+        if count > 0 and total_bytes > max_bytes:
+            break
+        count += 1
+    return max(count, 1)
+
+
+def _write_datapoints_in_chunks(conn, path, datapoints, chunk_policy=None, dedup=None):
+    """POST datapoints to path in <list> chunks as determined by the chunk policy (used internally)
+
+    If a deduplication filter is provided, duplicates are dropped before writing and
+    the datapoints in each chunk are recorded as seen once the chunk is acknowledged.
+
+    """
+    if dedup is not None:
+        datapoints = dedup.filter(datapoints, record=False)
+    datapoints_xml = [dp.to_xml() for dp in datapoints]
+    written = 0
+    for num_written in _iter_post_datapoints_xml(conn, path, datapoints_xml, chunk_policy):
+        if dedup is not None:
+            dedup.record(datapoints[written:num_written])
+        written = num_written
+
+
+def _iter_post_datapoints_xml(conn, path, datapoints_xml, chunk_policy=None):
+    """POST serialized datapoints in chunks, yielding the number written after each chunk"""
+    if chunk_policy is None:
+        chunk_policy = FixedChunkPolicy()
+    chunk_policy = validate_type(chunk_policy, ChunkPolicy)
+
+    start = 0
+    while start < len(datapoints_xml):
+        chunk_size = max(1, chunk_policy.get_chunk_size(datapoints_xml, start))
+        this_chunk_xml = datapoints_xml[start:start + chunk_size]
+
+        # Build XML list containing data for all points in this chunk
+        datapoints_out = StringIO()
+        datapoints_out.write("<list>")
+        for xml in this_chunk_xml:
+            datapoints_out.write(xml)
+        datapoints_out.write("</list>")
+        body = datapoints_out.getvalue()
+        body_size = len(body.encode('utf-8'))
+
+        # And send the HTTP Post
+        request_start = time.time()
+        try:
+            conn.post(path, body)
+        except (DeviceCloudHttpException, requests.exceptions.RequestException) as exception:
+            elapsed = time.time() - request_start
+            if chunk_policy.record_result(len(this_chunk_xml), body_size, elapsed, exception):
+                logger.warning("DataPoint batch of %s datapoints to %s failed, retrying with smaller chunks",
+                               len(this_chunk_xml), path)
+                continue
+            raise
+        chunk_policy.record_result(len(this_chunk_xml), body_size, time.time() - request_start)
+        logger.info('DataPoint batch of %s datapoints written to %s', len(this_chunk_xml), path)
+        start += len(this_chunk_xml)
+        yield start
 
 
 class DataPoint(object):
@@ -760,6 +1154,107 @@ class DataStream(object):
             datapoint_id=datapoint.get_id(),
         ))
 
+    def delete_datapoints(self, datapoints, coalesce=False, max_workers=4, progress=None):
+        """Delete a collection of datapoints from this stream
+
+        Rather than deleting each point serially (as would be the case when calling
+        :meth:`delete_datapoint` in a loop), the deletes are performed concurrently
+        using up to ``max_workers`` requests in flight at once.
+
+        If ``coalesce`` is True, this method will additionally read back the points
+        stored on the device cloud between the oldest and newest timestamps of the
+        provided points.  Runs of points where every point sharing a timestamp is
+        to be deleted are then removed with a single time range delete (see
+        :meth:`delete_datapoints_in_time_range`) rather than one request per point.
+        This is only worthwhile when deleting large, mostly contiguous sets of points.
+        Note that points written to the stream between the read and the delete within
+        a coalesced time range will also be deleted.
+
+        Example::
+
+            # remove every point with a bogus reading
+            bad_points = [dp for dp in stream.read() if dp.get_data() < 0]
+            stream.delete_datapoints(bad_points, coalesce=True)
+
+        :param datapoints: An iterable of :class:`.DataPoint` objects or datapoint id
+            strings.  Only :class:`.DataPoint` objects with a timestamp are eligible
+            for coalescing.
+        :param bool coalesce: If True, contiguous runs of points will be deleted using
+            time range deletes as described above.
+        :param int max_workers: The maximum number of delete requests that will be in
+            flight at any one time.
+        :param progress: If not None, a callable that will be called as
+            ``progress(num_completed, num_total)`` after each point (or range of points)
+            has been deleted.
+        :raises TypeError: if the datapoints are not DataPoints or strings
+        :raises ValueError: if any of the provided DataPoints do not have an id
+        :raises devicecloud.DeviceCloudHttpException: in the case of an unexpected http error
+            while reading back points for coalescing
+        :return: A dictionary mapping each datapoint id to None if it was deleted
+            successfully or the exception raised while trying to delete it.
+
+        """
+        datapoints = list(datapoints)
+        for dp in datapoints:
+            if isinstance(dp, DataPoint):
+                if dp.get_id() is None:
+                    raise ValueError("id must be set on all datapoints")
+            elif not isinstance(dp, six.string_types):
+                raise TypeError("All items in the datapoints list must be DataPoints or ids")
+
+        operations = self._get_delete_operations(datapoints, validate_type(coalesce, bool))
+        return _perform_delete_operations(self._conn, operations, max_workers, progress)
+
+    def _get_delete_operations(self, datapoints, coalesce):
+        """Return a list of ``(path, datapoint_ids)`` DELETEs to remove the datapoints (used internally)"""
+        ids = set(dp.get_id() if isinstance(dp, DataPoint) else dp for dp in datapoints)
+        operations = []
+        if coalesce:
+            for start_dt, end_dt, run_ids in self._find_contiguous_runs(datapoints, ids):
+                path = "/ws/DataPoint/{stream_id}?{querystring}".format(
+                    stream_id=self.get_stream_id(),
+                    querystring=urllib.parse.urlencode([
+                        ('startTime', isoformat(start_dt)),
+                        ('endTime', isoformat(end_dt)),
+                    ]))
+                operations.append((path, run_ids))
+                ids.difference_update(run_ids)
+
+        for dp_id in ids:
+            path = "/ws/DataPoint/{stream_id}/{datapoint_id}".format(
+                stream_id=self.get_stream_id(),
+                datapoint_id=dp_id,
+            )
+            operations.append((path, [dp_id]))
+        return operations
+
+    def _find_contiguous_runs(self, datapoints, ids):
+        """Yield ``(start_dt, end_dt, datapoint_ids)`` for runs that may be deleted by time range"""
+        timestamps = [dp.get_timestamp() for dp in datapoints
+                      if isinstance(dp, DataPoint) and dp.get_timestamp() is not None]
+        if not timestamps:
+            return
+
+        # Read back everything in the window, grouping the points by timestamp.  A
+        # timestamp may only be part of a run if every point with that timestamp is
+        # being deleted; any other point breaks the run.
+        runs = [[]]  # each run is a list of (timestamp, [ids])
+        stored_points = self.read(start_time=min(timestamps),
+                                  end_time=max(timestamps) + ONE_MILLISECOND,
+                                  newest_first=False)
+        for timestamp, group in itertools.groupby(stored_points, key=lambda dp: dp.get_timestamp()):
+            group_ids = [dp.get_id() for dp in group]
+            if all(dp_id in ids for dp_id in group_ids):
+                runs[-1].append((timestamp, group_ids))
+            elif runs[-1]:
+                runs.append([])
+
+        for run in runs:
+            run_ids = [dp_id for _timestamp, group_ids in run for dp_id in group_ids]
+            if len(run_ids) >= MINIMUM_DELETE_RANGE_RUN:
+                # endTime is exclusive and the device cloud stores timestamps with millisecond precision
+                yield (run[0][0], run[-1][0] + ONE_MILLISECOND, run_ids)
+
     def delete_datapoints_in_time_range(self, start_dt=None, end_dt=None):
         """Delete datapoints from this stream between the provided start and end times
 
@@ -787,7 +1282,7 @@ class DataStream(object):
             querystring="?" + urllib.parse.urlencode(params) if params else "",
         ))
 
-    def bulk_write_datapoints(self, datapoints):
+    def bulk_write_datapoints(self, datapoints, chunk_policy=None, dedup=None):
         """Perform a bulk write of a number of datapoints to this stream
 
         It is assumed that all datapoints here are to be written to this
@@ -797,6 +1292,10 @@ class DataStream(object):
         instead.
 
         :param list datapoints: A list of datapoints to be written into this stream
+        :param chunk_policy: The :class:`.ChunkPolicy` determining how the datapoints are
+            split into requests.  If None, a :class:`.FixedChunkPolicy` of 250 points is used.
+        :param dedup: If not None, a :class:`.DeduplicationFilter` used to drop datapoints
+            which have already been written.
 
         """
         datapoints = list(datapoints)  # effectively performs validation that we have the right type
@@ -805,26 +1304,9 @@ class DataStream(object):
                 raise TypeError("All items in the datapoints list must be DataPoints")
             dp.set_stream_id(self.get_stream_id())
 
-        # One could argue that this should just call out to StreamAPI.bulk_write_datapoints.  At
-        # the time of writing, the stream has no reference back to StreamsAPI, so that is less
-        # simple.
-        remaining_datapoints = datapoints
-        while remaining_datapoints:
-            # take up to 250 points and post them until complete
-            this_chunk_of_datapoints = remaining_datapoints[:MAXIMUM_DATAPOINTS_PER_POST]
-            remaining_datapoints = remaining_datapoints[MAXIMUM_DATAPOINTS_PER_POST:]
-
-            # Build XML list containing data for all points
-            datapoints_out = StringIO()
-            datapoints_out.write("<list>")
-            for dp in this_chunk_of_datapoints:
-                datapoints_out.write(dp.to_xml())
-            datapoints_out.write("</list>")
-
-            # And send the HTTP Post
-            self._conn.post("/ws/DataPoint/{}".format(self.get_stream_id()), datapoints_out.getvalue())
-            logger.info('DataPoint batch of %s datapoints written to stream %s',
-                        len(this_chunk_of_datapoints), self.get_stream_id())
+        dedup = validate_type(dedup, type(None), DeduplicationFilter)
+        _write_datapoints_in_chunks(self._conn, "/ws/DataPoint/{}".format(self.get_stream_id()),
+                                    datapoints, chunk_policy, dedup)
 
     def write(self, datapoint):
         """Write some raw data to a stream using the DataPoint API
@@ -962,7 +1444,7 @@ class DataStream(object):
         while result_size == page_size:
             # request the next page of data or first if pageCursor is not set as query param
             try:
-                result = self._conn.get_json("/ws/DataPoint/{stream_id}?{query_params}".format(
+                result, items = self._conn.get_json_page("/ws/DataPoint/{stream_id}?{query_params}".format(
                     stream_id=self.get_stream_id(),
                     query_params=urllib.parse.urlencode(query_parameters)
                 ))
@@ -971,11 +1453,13 @@ class DataStream(object):
                     raise NoSuchStreamException()
                 raise http_exception
 
-            result_size = int(result["resultSize"])  # how many are actually included here?
-            query_parameters["pageCursor"] = result.get("pageCursor")  # will not be present if result set is empty
-            for item_info in result.get("items", []):
+            for item_info in items:
                 if is_rollup:
                     data_point = DataPoint.from_rollup_json(self, item_info)
                 else:
                     data_point = DataPoint.from_json(self, item_info)
                 yield data_point
+
+            # with streaming parsing, page metadata is complete once the items are consumed
+            result_size = int(result["resultSize"])  # how many are actually included here?
+            query_parameters["pageCursor"] = result.get("pageCursor")  # will not be present if result set is empty
@@ -5,8 +5,10 @@
 # Copyright (c) 2014 Etherios, Inc. All rights reserved.
 # Etherios, Inc. is a Division of Digi International.
 import unittest
+import zlib
 
 from devicecloud.test.test_utilities import HttpTestBase
+import httpretty
 import six
 
 
@@ -75,5 +77,85 @@ class TestDeviceCloudConnection(HttpTestBase):
             "start": "1"
         })
 
+    def test_iter_json_pages_streaming(self):
+        conn = self.dc.get_connection()
+        conn.enable_streaming_json()
+        it = conn.iter_json_pages("/test/path", page_size=1)
+        self.prepare_response("GET", "/test/path", TEST_PAGED_RESPONSE_PAGE1)
+        self.assertEqual(six.next(it), {"id": 1, "name": "bob"})
+        self.prepare_response("GET", "/test/path", TEST_PAGED_RESPONSE_PAGE2)
+        self.assertEqual(six.next(it), {"id": 2, "name": "tim"})
+        self.assertRaises(StopIteration, six.next, it)
+        self.assertEqual(self._get_last_request_params()["start"], "1")
+
+    def test_get_json_page(self):
+        self.prepare_response("GET", "/test/path", TEST_BASIC_RESPONSE)
+        conn = self.dc.get_connection()
+        for streaming in (False, True):
+            if streaming:
+                conn.enable_streaming_json()
+            page, items = conn.get_json_page("/test/path")
+            self.assertEqual([item["id"] for item in items], [1, 2])
+            self.assertEqual(page["remainingSize"], "0")
+            self.assertNotIn("items", page)
+        conn.disable_streaming_json()
+
+    def test_streamed_bytes_counted(self):
+        self.prepare_response("GET", "/test/path", TEST_BASIC_RESPONSE)
+        conn = self.dc.get_connection()
+        conn.enable_streaming_json()
+        conn.reset_transfer_stats()
+        page, items = conn.get_json_page("/test/path")
+        list(items)
+        conn.disable_streaming_json()
+        self.assertEqual(conn.get_transfer_stats()["bytes_received_decoded"],
+                         len(TEST_BASIC_RESPONSE.encode('utf-8')))
+
+
+class TestDeviceCloudConnectionCompression(HttpTestBase):
+
+    def test_post_uncompressed_by_default(self):
+        self.prepare_response("POST", "/ws/DataPoint", "")
+        self.dc.get_connection().post("/ws/DataPoint", "<list>" + "<DataPoint/>" * 200 + "</list>")
+        self.assertNotIn("Content-Encoding", httpretty.last_request().headers)
+
+    def test_post_compressed(self):
+        conn = self.dc.get_connection()
+        conn.enable_compression(level=9, threshold=100)
+        self.prepare_response("POST", "/ws/DataPoint", "")
+        body = "<list>" + "<DataPoint/>" * 200 + "</list>"
+        conn.post("/ws/DataPoint", body)
+        request = httpretty.last_request()
+        self.assertEqual(request.headers["Content-Encoding"], "gzip")
+        self.assertEqual(zlib.decompress(request.body, 16 + zlib.MAX_WBITS), six.b(body))
+
+        stats = conn.get_transfer_stats()
+        self.assertEqual(stats["requests"], 1)
+        self.assertEqual(stats["bytes_sent_uncompressed"], len(body))
+        self.assertEqual(stats["bytes_sent"], len(request.body))
+        self.assertTrue(stats["bytes_sent"] < stats["bytes_sent_uncompressed"])
+
+    def test_put_below_threshold_and_override(self):
+        conn = self.dc.get_connection()
+        conn.enable_compression(threshold=1000)
+        self.prepare_response("PUT", "/ws/DeviceCore", "")
+        conn.put("/ws/DeviceCore", "<DeviceCore/>")
+        self.assertNotIn("Content-Encoding", httpretty.last_request().headers)
+        conn.put("/ws/DeviceCore", "<DeviceCore/>", compress=True)
+        self.assertEqual(httpretty.last_request().headers["Content-Encoding"], "gzip")
+
+    def test_bad_compression_level(self):
+        self.assertRaises(ValueError, self.dc.get_connection().enable_compression, level=10)
+
+    def test_get_json_accept_encoding(self):
+        self.prepare_response("GET", "/test/path", TEST_BASIC_RESPONSE)
+        conn = self.dc.get_connection()
+        conn.get_json("/test/path")
+        self.assertEqual(httpretty.last_request().headers["Accept-Encoding"], "gzip, deflate")
+        self.assertEqual(conn.get_transfer_stats()["bytes_received_decoded"], len(TEST_BASIC_RESPONSE))
+        conn.reset_transfer_stats()
+        self.assertEqual(conn.get_transfer_stats()["requests"], 0)
+
+
 if __name__ == "__main__":
     unittest.main()
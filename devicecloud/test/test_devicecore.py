@@ -6,10 +6,16 @@
 # Etherios, Inc. is a Division of Digi International.
 import copy
 import datetime
+import json
+import os
+import re
+import shutil
+import tempfile
 import unittest
 
 from dateutil.tz import tzutc
-from devicecloud.devicecore import dev_mac, group_id
+from devicecloud.devicecore import dev_mac, group_id, group_path, dev_vendor_id, Device
+from devicecloud.conditions import Attribute
 from devicecloud.test.test_utilities import HttpTestBase
 import httpretty
 from devicecloud.devicecore import ADD_GROUP_TEMPLATE
@@ -181,6 +187,49 @@ class TestDeviceCoreGroups(HttpTestBase):
         self.assertEqual(params["condition"], "grpId='123'")
 
 
+class TestGroupTree(HttpTestBase):
+
+    def setUp(self):
+        HttpTestBase.setUp(self)
+        self.prepare_response("GET", "/ws/Group", EXAMPLE_GET_GROUPS_EXTENDED)
+
+    def test_lookups(self):
+        tree = self.dc.devicecore.get_group_tree()
+        self.assertEqual(len(tree), 4)
+        self.assertEqual(tree.get_root().get_id(), "11817")
+        subdir = tree.get_by_path("/7603_Etherios/Demo/SubDir2/")
+        self.assertEqual(subdir.get_id(), "13544")
+        self.assertIs(tree.get_by_id("13544"), subdir)
+        self.assertIsNone(tree.get_by_path("/nope/"))
+        self.assertEqual([g.get_id() for g in tree.iter_ancestors(subdir)], ["13542", "11817"])
+        self.assertEqual(sorted(g.get_id() for g in tree.iter_descendants(tree.get_root())),
+                         ["13542", "13544", "13545"])
+        self.assertEqual(list(tree.iter_descendants(subdir)), [])
+
+    def test_cached(self):
+        tree = self.dc.devicecore.get_group_tree()
+        request_count = len(httpretty.HTTPretty.latest_requests)
+        self.assertIs(self.dc.devicecore.get_group_tree(), tree)
+        self.assertEqual(len(httpretty.HTTPretty.latest_requests), request_count)
+        self.assertIsNot(self.dc.devicecore.get_group_tree(ttl=0), tree)
+
+    def test_device_counts(self):
+        devices = copy.deepcopy(EXAMPLE_GET_DEVICES)
+        devices["items"][0]["grpPath"] = "/7603_Etherios/Demo/SubDir2/"
+        devices["items"].append(copy.deepcopy(devices["items"][0]))
+        devices["items"][2]["grpPath"] = "/7603_Etherios/Another Second Level/"
+        self.prepare_json_response("GET", "/ws/DeviceCore", devices)
+        tree = self.dc.devicecore.get_group_tree()
+        self.prepare_json_response("GET", "/ws/DeviceCore", devices)
+        counts = dict((g.get_path(), count) for g, count in tree.device_counts().items())
+        self.assertEqual(counts, {
+            "/7603_Etherios/": 3,
+            "/7603_Etherios/Demo/": 1,
+            "/7603_Etherios/Demo/SubDir2/": 1,
+            "/7603_Etherios/Another Second Level/": 1,
+        })
+
+
 class TestDeviceCoreDevices(HttpTestBase):
 
     def test_dc_get_devices(self):
@@ -242,6 +291,22 @@ class TestDeviceCoreDevices(HttpTestBase):
         self.assertEqual(qs['embed'][0], "true")
         self.assertEqual(qs['start'][0], "0")
 
+    def test_dc_get_devices_fields(self):
+        self.prepare_json_response("GET", "/ws/DeviceCore", EXAMPLE_GET_DEVICES)
+        device = six.next(self.dc.devicecore.get_devices(fields=[dev_mac]))
+        self.assertEqual(sorted(device.get_device_json().keys()), ["devConnectwareId", "devMac", "id"])
+        self.assertEqual(device.get_mac(), "00:40:9D:58:17:5B")
+
+        # other attributes are loaded on demand
+        get_device = copy.deepcopy(EXAMPLE_GET_DEVICES)
+        del get_device["items"][1]
+        self.prepare_json_response("GET", "/ws/DeviceCore/702077", get_device)
+        self.assertEqual(device.get_device_type(), "ConnectPort X5 R")
+        self.assertEqual(httpretty.last_request().path, "/ws/DeviceCore/702077")
+        request_count = len(httpretty.HTTPretty.latest_requests)
+        self.assertIsNone(device.get_zb_pan_id())  # absent in the full record; no further request
+        self.assertEqual(len(httpretty.HTTPretty.latest_requests), request_count)
+
     def test_refresh_from_cache(self):
         get_devices_update = copy.deepcopy(EXAMPLE_GET_DEVICES)
         get_devices_update["items"][0]["dpDeviceType"] = "Turboencabulator"
@@ -277,5 +342,263 @@ class TestDeviceCoreDevices(HttpTestBase):
         self.assertIsNone(dev._device_json)
         self.assertEqual(six.b(expected), httpretty.last_request().body)
 
+
+class TestDeviceIndex(HttpTestBase):
+
+    def setUp(self):
+        HttpTestBase.setUp(self)
+        self._prepare_devices()
+
+    def _prepare_devices(self):
+        devices = copy.deepcopy(EXAMPLE_GET_DEVICES)
+        devices["items"][0]["grpPath"] = "/7603_Etherios/Demo/"
+        devices["items"][0]["dpTags"] = "north,gateway"
+        devices["items"][1]["dpTags"] = "south"
+        self.prepare_json_response("GET", "/ws/DeviceCore", devices)
+
+    def _ids(self, devices):
+        return [d.get_device_id() for d in devices]
+
+    def test_lookups(self):
+        for compact in (False, True):
+            self._prepare_devices()
+            index = self.dc.devicecore.get_device_index(compact=compact)
+            self.assertEqual(len(index), 2)
+            self.assertEqual(self._ids(index), ["702077", "714038"])
+            self.assertEqual(index.get_by_connectware_id("00000000-00000000-001D09FF-FF2B7D8C").get_device_id(),
+                             "714038")
+            self.assertEqual(index.get_by_mac("00:40:9d:58:17:5b").get_device_id(), "702077")
+            self.assertEqual(index.get_by_mac("00:1D:09:2B:7D:8C").get_device_id(), "714038")
+            self.assertEqual(index.get_by_device_id("714038").get_mac(), "00:1d:09:2b:7d:8c")
+            self.assertIsNone(index.get_by_device_id("1"))
+            self.assertEqual(self._ids(index.get_by_group_path("/7603_Etherios/Demo/")), ["702077"])
+            self.assertEqual(self._ids(index.get_by_tag("gateway")), ["702077"])
+            self.assertEqual(self._ids(index.get_by_vendor_id("50331982")), ["714038"])
+            self.assertEqual(index.get_by_tag("missing"), [])
+
+    def test_find_locally(self):
+        index = self.dc.devicecore.get_device_index()
+        request_count = len(httpretty.HTTPretty.latest_requests)
+        self.assertEqual(self._ids(index.find(dev_vendor_id == "50331982")), ["714038"])
+        self.assertEqual(self._ids(index.find((dev_vendor_id == "50331982") |
+                                              (group_path == "/7603_Etherios/Demo/"))), ["702077", "714038"])
+        self.assertEqual(index.find((dev_vendor_id == "50331982") &
+                                    (group_path == "/7603_Etherios/Demo/")), [])
+        self.assertEqual(self._ids(index.find(Attribute("dpDeviceType").like("ConnectPort%"))), ["702077"])
+        self.assertEqual(self._ids(index.find(Attribute("dpCapabilities") > 10000)), ["714038"])
+        self.assertEqual(self._ids(index.find(Attribute("dpLastConnectTime") <
+                                              datetime.datetime(2013, 5, 1, tzinfo=tzutc()))), ["702077"])
+        self.assertEqual(len(httpretty.HTTPretty.latest_requests), request_count)
+
+    def test_find_remote_fallback(self):
+        index = self.dc.devicecore.get_device_index()
+        self.assertRaises(ValueError, index.find, "devMac='00:40:9D:58:17:5B'", allow_remote=False)
+        self._prepare_devices()
+        self.assertEqual(len(index.find("devMac='00:40:9D:58:17:5B'")), 2)  # canned response
+        self.assertEqual(httpretty.last_request().querystring["condition"][0], "devMac='00:40:9D:58:17:5B'")
+
+
+class TestDeviceCoreSync(HttpTestBase):
+
+    def setUp(self):
+        HttpTestBase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.tempdir, "devices.json")
+        self.requests = []
+        httpretty.reset()  # drop the ping response registered for /ws/DeviceCore
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        HttpTestBase.tearDown(self)
+
+    def _prepare_devicecore(self):
+        def handle_request(request, uri, headers):
+            qs = request.querystring
+            self.requests.append(qs)
+            if qs.get("embed") == ["true"]:
+                items = self.changed
+            else:
+                items = [{"id": item["id"]} for item in self.existing]
+            body = {"resultTotalRows": str(len(items)), "requestedStartRow": "0",
+                    "resultSize": str(len(items)), "requestedSize": "1000",
+                    "remainingSize": "0", "items": items}
+            return (200, headers, json.dumps(body))
+        self.prepare_response("GET", "/ws/DeviceCore", handle_request)
+
+    def test_sync(self):
+        self.changed = self.existing = EXAMPLE_GET_DEVICES["items"]
+        self._prepare_devicecore()
+        result = self.dc.devicecore.sync(self.snapshot_path)
+        self.assertEqual(sorted(result.get_added()), ["702077", "714038"])
+        self.assertEqual(result.get_deleted(), [])
+        self.assertEqual(result.get_watermark(), "2013-07-16T18:05:00.000Z")
+        self.assertEqual(len(self.requests), 1)  # no deletion listing on initial sync
+        self.assertNotIn("condition", self.requests[0])
+
+        # second sync: 702077 changed, 714038 removed from the account
+        changed = copy.deepcopy(self.changed[0])
+        changed["devRecordStartDate"] = "2014-01-01T00:00:00.000Z"
+        changed["dpDeviceType"] = "Turboencabulator"
+        self.requests = []
+        self.changed = self.existing = [changed]
+        result = self.dc.devicecore.sync(self.snapshot_path)
+        self.assertEqual(result.get_added(), [])
+        self.assertEqual(result.get_updated(), ["702077"])
+        self.assertEqual(result.get_deleted(), ["714038"])
+        self.assertEqual(result.get_watermark(), "2014-01-01T00:00:00.000Z")
+        self.assertEqual([d.get_device_type() for d in result.get_devices()], ["Turboencabulator"])
+        self.assertEqual(self.requests[0]["condition"][0],
+                         "devRecordStartDate>'2013-07-16T18:05:00.000Z' or "
+                         "devRecordStartDate='2013-07-16T18:05:00.000Z'")
+
+        with open(self.snapshot_path) as f:
+            snapshot = json.load(f)
+        self.assertEqual(list(snapshot["devices"].keys()), ["702077"])
+        self.assertEqual(snapshot["watermark"], "2014-01-01T00:00:00.000Z")
+
+    def test_sync_condition_mismatch(self):
+        self.changed = self.existing = EXAMPLE_GET_DEVICES["items"]
+        self._prepare_devicecore()
+        self.dc.devicecore.sync(self.snapshot_path, condition=group_path == "/a/")
+        self.assertRaises(ValueError, self.dc.devicecore.sync, self.snapshot_path)
+
+    def test_sync_or_condition_falls_back_to_full(self):
+        self.changed = self.existing = EXAMPLE_GET_DEVICES["items"]
+        self._prepare_devicecore()
+        condition = (group_path == "/a/") | (group_path == "/b/")
+        self.dc.devicecore.sync(self.snapshot_path, condition=condition)
+
+        self.requests = []
+        self.changed = self.existing = EXAMPLE_GET_DEVICES["items"][:1]
+        result = self.dc.devicecore.sync(self.snapshot_path, condition=condition)
+        self.assertEqual(len(self.requests), 1)  # full listing, deletions taken from it
+        self.assertEqual(self.requests[0]["condition"][0], "grpPath='/a/' or grpPath='/b/'")
+        self.assertEqual(result.get_deleted(), ["714038"])
+
+    def test_sync_failed_write_removes_temp_file(self):
+        self.changed = self.existing = EXAMPLE_GET_DEVICES["items"]
+        self._prepare_devicecore()
+        original_dump = json.dump
+
+        def failing_dump(obj, fp, **kwargs):
+            fp.write("{")
+            raise IOError("disk full")
+        json.dump = failing_dump
+        try:
+            self.assertRaises(IOError, self.dc.devicecore.sync, self.snapshot_path)
+        finally:
+            json.dump = original_dump
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+
+class TestDeviceCoreRefresh(HttpTestBase):
+
+    def setUp(self):
+        HttpTestBase.setUp(self)
+        httpretty.reset()  # drop the ping response registered for /ws/DeviceCore
+        self.request_paths = []
+        self.removed = set()
+
+    def _make_device_json(self, i, status):
+        device_json = copy.deepcopy(EXAMPLE_GET_DEVICES["items"][0])
+        device_json["id"]["devId"] = str(i)
+        device_json["devConnectwareId"] = "00000000-00000000-00409DFF-FF%06X" % i
+        device_json["dpConnectionStatus"] = status
+        return device_json
+
+    def _prepare_devicecore(self):
+        def handle_request(request, uri, headers):
+            self.request_paths.append(request.path)
+            wanted = re.findall(r"devConnectwareId='([^']+)'", request.querystring["condition"][0])
+            items = [self._make_device_json(int(cwid[-6:], 16), "1") for cwid in wanted
+                     if cwid not in self.removed]
+            body = {"resultTotalRows": str(len(items)), "requestedStartRow": "0",
+                    "resultSize": str(len(items)), "requestedSize": "1000",
+                    "remainingSize": "0", "items": items}
+            return (200, headers, json.dumps(body))
+        self.prepare_response("GET", "/ws/DeviceCore", handle_request)
+
+    def test_refresh(self):
+        self._prepare_devicecore()
+        conn = self.dc.get_connection()
+        devices = [Device(conn, None, self._make_device_json(i, "0")) for i in range(100)]
+        self.removed.add(devices[7].get_connectware_id())
+        missing = self.dc.devicecore.refresh(devices, max_url_length=1000)
+        self.assertEqual(missing, [devices[7]])
+        self.assertFalse(devices[7].is_connected())
+        self.assertTrue(all(d.is_connected() for d in devices if d is not devices[7]))
+        # far fewer requests than the one-per-device path and all URLs within the limit
+        self.assertTrue(1 < len(self.request_paths) < 20)
+        for path in self.request_paths:
+            self.assertLessEqual(len(conn._make_url(path)), 1000)
+
+    def test_refresh_requires_cached_json(self):
+        device = Device(self.dc.get_connection(), None, None)
+        self.assertRaises(ValueError, self.dc.devicecore.refresh, [device])
+
+
+class TestDeviceCoreMap(HttpTestBase):
+
+    def test_map(self):
+        self.prepare_json_response("GET", "/ws/DeviceCore", EXAMPLE_GET_DEVICES)
+        progress = []
+
+        def fn(device):
+            if device.get_device_id() == "714038":
+                raise ValueError("boom")
+            return device.get_mac()
+
+        results = self.dc.devicecore.map(fn, rate=100, progress=lambda *args: progress.append(args))
+        self.assertEqual(progress, [(1, None), (2, None)])
+        outcomes = dict((device.get_device_id(), (result, exception)) for device, result, exception in results)
+        self.assertEqual(outcomes["702077"], ("00:40:9D:58:17:5B", None))
+        self.assertIsNone(outcomes["714038"][0])
+        self.assertIsInstance(outcomes["714038"][1], ValueError)
+
+
+class TestDeviceCoreSetGroups(HttpTestBase):
+
+    def test_set_groups(self):
+        bodies = []
+
+        def handle_request(request, uri, headers):
+            body = request.body.decode('utf-8')
+            bodies.append(body)
+            if "FF000005" in body:
+                return (500, headers, "")
+            return (200, headers, "")
+        self.prepare_response("PUT", "/ws/DeviceCore", handle_request)
+
+        conn = self.dc.get_connection()
+        devices = []
+        for i in range(7):
+            device_json = copy.deepcopy(EXAMPLE_GET_DEVICES["items"][0])
+            device_json["devConnectwareId"] = "00000000-00000000-00409DFF-FF%06d" % i
+            devices.append(Device(conn, None, device_json))
+        devices[0]._device_json["grpPath"] = "/a&b/"  # already in place; skipped
+
+        assignments = dict((d, "/a&b/") for d in devices)
+        assignments["00000000-00000000-00409DFF-FF000099"] = ""
+        # httpretty mixes up request bodies across threads, so send one batch at a time
+        outcomes = self.dc.devicecore.set_groups(assignments, batch_size=3, max_workers=1)
+
+        self.assertEqual(len(bodies), 3)
+        self.assertTrue(all(b.startswith("<list>") and b.endswith("</list>") for b in bodies))
+        self.assertEqual(sum(b.count("<DeviceCore>") for b in bodies), 7)
+        self.assertTrue(any("<grpPath>/a&amp;b/</grpPath>" in b for b in bodies))
+        self.assertEqual(len(outcomes), 8)
+        failed = [key for key, exception in outcomes.items() if exception is not None]
+        self.assertIn(devices[5], failed)
+        # everything sent in the failing batch (whichever targets ended up in it) failed
+        failing_body = [b for b in bodies if "FF000005" in b][0]
+        failed_ids = set(re.findall(r"<devConnectwareId>([^<]+)</devConnectwareId>", failing_body))
+        self.assertEqual(set(key if isinstance(key, six.string_types) else key.get_connectware_id()
+                             for key in failed), failed_ids)
+        self.assertEqual(devices[5].get_group_path(), "")
+        for device in devices:
+            if device not in failed:
+                self.assertEqual(device.get_group_path(), "/a&b/")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,19 @@
 import base64
+import json
+import os
+import re
+import shutil
+import tempfile
 import unittest
+import zipfile
 from xml.etree import ElementTree
 import datetime
 
 from dateutil.tz import tzutc
+from devicecloud import DeviceCloudHttpException
+from devicecloud.filedata import _Base64Body, UPLOAD_CHUNK_SIZE
 from devicecloud.test.test_utilities import HttpTestBase
+import httpretty
 import six
 
 
@@ -103,6 +112,32 @@ class TestFileData(HttpTestBase):
         self.assertEqual(obj1.get_name(), "test_file.txt")
         self.assertEqual(obj2.get_name(), "test_file2.txt")
 
+    def test_get_filedata_fields(self):
+        self.prepare_response("GET", "/ws/FileData", GET_DIR3_RESULT)
+        obj = list(self.dc.filedata.get_filedata(fields=["fdSize"]))[0]
+        self.assertEqual(self._get_last_request_params()["embed"], "false")
+        self.assertEqual(sorted(obj._json_data.keys()), ["fdSize", "fdType", "id"])
+        self.assertEqual(obj.get_size(), 149)
+
+        # accessing a field that was projected out loads the metadata (but not the contents)
+        self.prepare_response("GET", "/ws/FileData", GET_DIR3_RESULT)
+        self.assertEqual(obj.get_content_type(), "text/plain")
+        params = self._get_last_request_params()
+        self.assertEqual(params["embed"], "false")
+        self.assertEqual(params["condition"],
+                         "fdPath='/db/CUS0000033_Spectrum_Design_Solutions__Paul_Osborne/test_dir/' "
+                         "and fdName='test_file.txt'")
+        self.assertNotIn("fdData", obj._json_data)
+
+        # the contents are only requested when the data itself is
+        self.prepare_response("GET", "/ws/FileData" + obj.get_full_path(), "hello")
+        self.assertEqual(obj.get_data(), six.b("hello"))
+
+    def test_get_filedata_fields_with_data(self):
+        self.prepare_response("GET", "/ws/FileData", GET_WITH_EMBED)
+        list(self.dc.filedata.get_filedata(fields=["fdData"]))
+        self.assertEqual(self._get_last_request_params()["embed"], "true")
+
     def test_write_file_simple(self):
         self.prepare_response("PUT", "/ws/FileData/test/path/test.txt", "<???>", status=200)
         data = six.b(''.join(map(chr, range(255))))
@@ -121,6 +156,55 @@ class TestFileData(HttpTestBase):
         self.assertEqual(base64.decodestring(six.b(fd_data)), data)
         self.assertEqual(root.find("fdArchive").text, "true")
 
+    def test_write_file_from_file_object(self):
+        self.prepare_response("PUT", "/ws/FileData/test/path/test.bin", "", status=200)
+        data = os.urandom(1000)
+        self.dc.filedata.write_file("test/path", "test.bin", six.BytesIO(data))
+        root = ElementTree.fromstring(self._get_last_request().body)
+        self.assertEqual(base64.b64decode(root.find("fdData").text), data)
+        self.assertEqual(self._get_last_request().headers["Content-Length"],
+                         str(len(self._get_last_request().body)))
+        self.assertRaises(TypeError, self.dc.filedata.write_file, "test/path", "test.bin", 42)
+
+    def test_upload_file(self):
+        self.prepare_response("PUT", "/ws/FileData/test/path/upload.bin", "", status=200)
+        tempdir = tempfile.mkdtemp()
+        try:
+            local_path = os.path.join(tempdir, "upload.bin")
+            for data in (os.urandom(1000), b""):
+                with open(local_path, "wb") as f:
+                    f.write(data)
+                self.dc.filedata.upload_file(local_path, "test/path")
+                root = ElementTree.fromstring(self._get_last_request().body)
+                self.assertEqual(base64.b64decode(root.find("fdData").text or ""), data)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_base64_body_streams(self):
+        class ShortReads(object):  # returns at most 1000 bytes per read, like a pipe
+            def __init__(self, data):
+                self._fobj = six.BytesIO(data)
+
+            def read(self, size=-1):
+                return self._fobj.read(min(size, 1000))
+
+        data = os.urandom(3 * UPLOAD_CHUNK_SIZE + 2)
+        for fobj, size in ((six.BytesIO(data), len(data)), (ShortReads(data), None)):
+            body = _Base64Body(b"<a>", fobj, size, b"</a>")
+            chunks = []
+            while True:
+                chunk = body.read(8192)
+                if not chunk:
+                    break
+                self.assertLessEqual(len(chunk), 8192)
+                chunks.append(chunk)
+            encoded = b"".join(chunks)
+            self.assertEqual(encoded, b"<a>" + base64.b64encode(data) + b"</a>")
+            if size is not None:
+                self.assertEqual(body.len, len(encoded))
+            else:
+                self.assertFalse(hasattr(body, "len"))  # sent chunked
+
     def test_walk(self):
         self.prepare_response("GET", "/ws/FileData", GET_HOME_RESULT)
         gen = self.dc.filedata.walk()
@@ -160,6 +244,341 @@ class TestFileData(HttpTestBase):
                          "/db/CUS0000033_Spectrum_Design_Solutions__Paul_Osborne/test_dir/test_file.txt")
 
 
+class TestFileDataWalkConcurrently(HttpTestBase):
+
+    TREE = {
+        "~/": ["/root/a/", "/root/b/"],
+        "/root/a/": ["/root/a/x/", "/root/a/log.txt"],
+        "/root/b/": ["/root/b/y/"],
+        "/root/a/x/": [],
+        "/root/b/y/": ["/root/b/y/z/"],
+        "/root/b/y/z/": [],
+    }
+
+    def setUp(self):
+        HttpTestBase.setUp(self)
+        self.listed = []
+
+        def handle_request(request, uri, headers):
+            listed_path = re.match(r"fdPath='(.*)'", request.querystring["condition"][0]).group(1)
+            self.listed.append(listed_path)
+            items = []
+            for child in self.TREE[listed_path]:
+                is_dir = child.endswith("/")
+                path, name = child.rstrip("/").rsplit("/", 1)
+                items.append({"id": {"fdPath": path + "/", "fdName": name},
+                              "fdType": "directory" if is_dir else "file"})
+            body = {"resultTotalRows": str(len(items)), "requestedStartRow": "0",
+                    "resultSize": str(len(items)), "requestedSize": "1000",
+                    "remainingSize": "0", "items": items}
+            return (200, headers, json.dumps(body))
+        self.prepare_response("GET", "/ws/FileData", handle_request)
+
+    def test_breadth_first(self):
+        results = [(dirpath, [d.get_name() for d in dirs], [f.get_name() for f in files])
+                   for dirpath, dirs, files in self.dc.filedata.walk_concurrently(max_workers=4)]
+        self.assertEqual(results, [
+            ("~/", ["a", "b"], []),
+            ("/root/a", ["x"], ["log.txt"]),
+            ("/root/b", ["y"], []),
+            ("/root/a/x", [], []),
+            ("/root/b/y", ["z"], []),
+            ("/root/b/y/z", [], []),
+        ])
+
+    def test_pruning(self):
+        dirpaths = [dirpath for dirpath, _, _ in self.dc.filedata.walk_concurrently(max_depth=1)]
+        self.assertEqual(dirpaths, ["~/", "/root/a", "/root/b"])
+
+        self.listed = []
+        dirpaths = [dirpath for dirpath, _, _ in self.dc.filedata.walk_concurrently(exclude=["*/b"])]
+        self.assertEqual(dirpaths, ["~/", "/root/a", "/root/a/x"])
+        self.assertNotIn("/root/b/", self.listed)  # pruned before being requested
+
+        dirpaths = [dirpath for dirpath, _, _ in self.dc.filedata.walk_concurrently(include=["/root/b*"])]
+        self.assertEqual(dirpaths, ["~/", "/root/b", "/root/b/y", "/root/b/y/z"])
+
+
+class TestFileDataSync(HttpTestBase):
+
+    # httpretty does not reliably separate requests made from several threads at once,
+    # so these tests sync with a single worker
+
+    def setUp(self):
+        HttpTestBase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+        self.local_dir = os.path.join(self.tempdir, "local")
+        self.remote = {
+            "/db/sync/a.txt": six.b("aaa"),
+            "/db/sync/sub/b.txt": six.b("bbbb"),
+        }
+        self.modified = {path: "2014-07-20T18:46:45.123Z" for path in self.remote}
+        self.requests = []
+
+        def handle_request(request, uri, headers):
+            path = six.moves.urllib.parse.unquote(six.moves.urllib.parse.urlparse(uri).path[len("/ws/FileData"):])
+            self.requests.append((request.method, path))
+            if request.method == "PUT":
+                encoded = re.search(six.b("<fdData>(.*)</fdData>"), request.body).group(1)
+                self.remote[path] = base64.b64decode(encoded)
+                self.modified[path] = "2014-07-21T00:00:00.000Z"
+            elif request.method == "DELETE":
+                del self.remote[path]
+            elif path:
+                return (200, headers, self.remote[path])
+            else:
+                return (200, headers, json.dumps(self._list(request.querystring["condition"][0])))
+            return (200, headers, "")
+        for method in (httpretty.GET, httpretty.PUT, httpretty.DELETE):
+            httpretty.register_uri(method, re.compile(r"https://login.etherios.com/ws/FileData.*"),
+                                   body=handle_request)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        HttpTestBase.tearDown(self)
+
+    def _list(self, condition):
+        listed_path = re.match(r"fdPath='(.*)'", condition).group(1)
+        items, directories = [], set()
+        for path in sorted(self.remote):
+            if not path.startswith(listed_path):
+                continue
+            child = path[len(listed_path):].split("/")
+            if len(child) > 1:
+                directories.add(child[0])
+            else:
+                items.append({"id": {"fdPath": listed_path, "fdName": child[0]}, "fdType": "file",
+                              "fdSize": str(len(self.remote[path])),
+                              "fdLastModifiedDate": self.modified[path]})
+        for directory in sorted(directories):
+            items.append({"id": {"fdPath": listed_path, "fdName": directory}, "fdType": "directory"})
+        return {"resultTotalRows": str(len(items)), "requestedStartRow": "0",
+                "resultSize": str(len(items)), "requestedSize": "1000",
+                "remainingSize": "0", "items": items}
+
+    def _local_files(self):
+        files = {}
+        for dirpath, _, filenames in os.walk(self.local_dir):
+            for filename in filenames:
+                with open(os.path.join(dirpath, filename), "rb") as f:
+                    files[os.path.relpath(os.path.join(dirpath, filename), self.local_dir)] = f.read()
+        return files
+
+    def _transfers(self):
+        return sorted((method, path) for method, path in self.requests if path)
+
+    def test_sync_down(self):
+        result = self.dc.filedata.sync_down("/db/sync", self.local_dir, max_workers=1)
+        self.assertEqual(result.get_transferred(), ["a.txt", "sub/b.txt"])
+        self.assertEqual(self._local_files(), {
+            ".filedata-sync.json": self._local_files()[".filedata-sync.json"],
+            "a.txt": six.b("aaa"),
+            os.path.join("sub", "b.txt"): six.b("bbbb"),
+        })
+
+        # only the file modified remotely is downloaded again
+        self.requests = []
+        self.remote["/db/sync/a.txt"] = six.b("AAAAA")
+        self.modified["/db/sync/a.txt"] = "2014-07-22T00:00:00.000Z"
+        result = self.dc.filedata.sync_down("/db/sync", self.local_dir, max_workers=1)
+        self.assertEqual(result.get_transferred(), ["a.txt"])
+        self.assertEqual(result.get_unchanged(), ["sub/b.txt"])
+        self.assertEqual(self._transfers(), [("GET", "/db/sync/a.txt")])
+
+        # locally removed files are restored, and extra local files deleted only on request
+        os.remove(os.path.join(self.local_dir, "sub", "b.txt"))
+        with open(os.path.join(self.local_dir, "extra.txt"), "wb") as f:
+            f.write(six.b("extra"))
+        result = self.dc.filedata.sync_down("/db/sync", self.local_dir, max_workers=1)
+        self.assertEqual(result.get_transferred(), ["sub/b.txt"])
+        self.assertEqual(result.get_deleted(), [])
+        self.assertTrue(os.path.exists(os.path.join(self.local_dir, "extra.txt")))
+        result = self.dc.filedata.sync_down("/db/sync", self.local_dir, delete=True, max_workers=1)
+        self.assertEqual(result.get_deleted(), ["extra.txt"])
+        self.assertFalse(os.path.exists(os.path.join(self.local_dir, "extra.txt")))
+
+    def test_sync_up(self):
+        os.makedirs(os.path.join(self.local_dir, "sub"))
+        with open(os.path.join(self.local_dir, "a.txt"), "wb") as f:
+            f.write(six.b("aaa"))
+        with open(os.path.join(self.local_dir, "sub", "c.txt"), "wb") as f:
+            f.write(six.b("cc"))
+        result = self.dc.filedata.sync_up(self.local_dir, "/db/sync/", delete=True, max_workers=1)
+        self.assertEqual(result.get_transferred(), ["a.txt", "sub/c.txt"])
+        self.assertEqual(result.get_deleted(), ["sub/b.txt"])
+        self.assertEqual(self.remote, {"/db/sync/a.txt": six.b("aaa"), "/db/sync/sub/c.txt": six.b("cc")})
+
+        self.requests = []
+        result = self.dc.filedata.sync_up(self.local_dir, "/db/sync/", max_workers=1)
+        self.assertEqual(result.get_transferred(), [])
+        self.assertEqual(result.get_unchanged(), ["a.txt", "sub/c.txt"])
+        self.assertEqual(self._transfers(), [])
+
+    def test_manifest_for_other_directories(self):
+        self.dc.filedata.sync_down("/db/sync/", self.local_dir, max_workers=1)
+        self.assertRaises(ValueError, self.dc.filedata.sync_down, "/db/other/", self.local_dir)
+
+
+class TestFileDataListingCache(HttpTestBase):
+
+    TREE = {
+        "/db/CUS/": ["/db/CUS/a/", "/db/CUS/f.txt"],
+        "/db/CUS/a/": ["/db/CUS/a/g.txt"],
+    }
+
+    def setUp(self):
+        HttpTestBase.setUp(self)
+        self.requests = []
+        self.modified = {"/db/CUS/a": "2014-07-20T18:46:45.123Z"}
+
+        def handle_request(request, uri, headers):
+            if request.method == "PUT":
+                self.requests.append(("PUT", six.moves.urllib.parse.urlparse(uri).path[len("/ws/FileData"):]))
+                return (200, headers, "")
+            match = re.match(r"fdPath='(.*?)'( and fdName='(.*)')?$", request.querystring["condition"][0])
+            listed_path, name = match.group(1), match.group(3)
+            if name is not None:
+                self.requests.append(("entry", listed_path + name))
+                children = [listed_path.replace("~/", "/db/CUS/") + name + "/"]
+            else:
+                self.requests.append(("list", listed_path))
+                children = self.TREE[listed_path.replace("~/", "/db/CUS/")]
+            items = []
+            for child in children:
+                is_dir = child.endswith("/")
+                path, child_name = child.rstrip("/").rsplit("/", 1)
+                items.append({"id": {"fdPath": path + "/", "fdName": child_name},
+                              "fdType": "directory" if is_dir else "file",
+                              "fdLastModifiedDate": self.modified.get(child.rstrip("/"), "2014-07-20T00:00:00Z")})
+            body = {"resultTotalRows": str(len(items)), "requestedStartRow": "0",
+                    "resultSize": str(len(items)), "requestedSize": "1000",
+                    "remainingSize": "0", "items": items}
+            return (200, headers, json.dumps(body))
+        for method in (httpretty.GET, httpretty.PUT):
+            httpretty.register_uri(method, re.compile(r"https://login.etherios.com/ws/FileData.*"),
+                                   body=handle_request)
+
+    def _walk(self):
+        self.requests = []
+        return [(dirpath, [d.get_name() for d in dirs], [f.get_name() for f in files])
+                for dirpath, dirs, files in self.dc.filedata.walk()]
+
+    def test_cached_until_written(self):
+        self.dc.filedata.enable_listing_cache(ttl=60)
+        expected = [("~/", ["a"], ["f.txt"]), ("/db/CUS/a", [], ["g.txt"])]
+        self.assertEqual(self._walk(), expected)
+        self.assertEqual(self.requests, [("list", "~/"), ("entry", "/db/CUS/a"), ("list", "/db/CUS/a/")])
+        self.assertEqual(self._walk(), expected)
+        self.assertEqual(self.requests, [])
+
+        # the write (through ~/) invalidates the directory and its parents
+        self.dc.filedata.write_file("~/a", "new.txt", six.b("new"))
+        self.assertEqual(self._walk(), expected)
+        self.assertEqual(self.requests, [("list", "~/"), ("entry", "/db/CUS/a"), ("list", "/db/CUS/a/")])
+
+    def test_revalidation(self):
+        self.dc.filedata.enable_listing_cache(ttl=0)
+        self._walk()
+        self._walk()
+        # ~/ has no entry of its own to revalidate against
+        self.assertEqual(self.requests, [("list", "~/"), ("entry", "/db/CUS/a")])
+        self.modified["/db/CUS/a"] = "2014-07-21T00:00:00.000Z"
+        self._walk()
+        self.assertEqual(self.requests, [("list", "~/"), ("entry", "/db/CUS/a"),
+                                         ("entry", "/db/CUS/a"), ("list", "/db/CUS/a/")])
+
+    def test_lru_bound(self):
+        self.dc.filedata.enable_listing_cache(max_entries=1)
+        self._walk()
+        self._walk()
+        self.assertEqual(self.requests, [("list", "~/"), ("entry", "/db/CUS/a"), ("list", "/db/CUS/a/")])
+
+        self.dc.filedata.disable_listing_cache()
+        self._walk()
+        self.assertEqual(self.requests, [("list", "~/"), ("list", "/db/CUS/a/")])
+
+
+class TestFileDataBulk(HttpTestBase):
+
+    def setUp(self):
+        HttpTestBase.setUp(self)
+        self.requests = []
+
+        def handle_request(request, uri, headers):
+            path = six.moves.urllib.parse.urlparse(uri).path[len("/ws/FileData"):]
+            self.requests.append((request.method, path, request.querystring, request.body))
+            if "fail" in path:
+                return (500, headers, "")
+            return (200, headers, "")
+        for method in (httpretty.PUT, httpretty.DELETE):
+            httpretty.register_uri(method, re.compile(r"https://login.etherios.com/ws/FileData/.*"),
+                                   body=handle_request)
+
+    def test_write_many(self):
+        opened = []
+
+        def open_config():
+            opened.append(six.BytesIO(six.b("config")))
+            return opened[-1]
+
+        results = self.dc.filedata.write_many([
+            ("~/dev1", "config.xml", open_config),
+            ("~/dev2/", "config.xml", six.b("other")),
+            ("~/fail", "config.xml", six.b("oops")),
+        ], max_workers=1)
+        self.assertEqual(sorted(results), ["/~/dev1/config.xml", "/~/dev2/config.xml", "/~/fail/config.xml"])
+        self.assertIsNone(results["/~/dev1/config.xml"])
+        self.assertIsNone(results["/~/dev2/config.xml"])
+        self.assertIsInstance(results["/~/fail/config.xml"], DeviceCloudHttpException)
+        self.assertTrue(opened[0].closed)
+        bodies = dict((path, body) for _, path, _, body in self.requests)
+        self.assertIn(six.b("<fdData>%s</fdData>") % base64.b64encode(six.b("config")),
+                      bodies["/~/dev1/config.xml"])
+
+    def test_upload_tree(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        os.makedirs(os.path.join(tempdir, "sub"))
+        contents = {"a.txt": "aaaa", "b.txt": "bbbb", "sub/c.txt": "cccc", "sub/large.bin": "x" * 100}
+        for relpath, data in contents.items():
+            with open(os.path.join(tempdir, *relpath.split("/")), "wb") as f:
+                f.write(six.b(data))
+        results = self.dc.filedata.upload_tree(tempdir, "~/configs", small_file_size=10,
+                                               max_archive_size=8, max_workers=1)
+        self.assertEqual(results, dict.fromkeys(contents))
+
+        archives, files = [], {}
+        for method, path, querystring, body in self.requests:
+            data = base64.b64decode(re.search(six.b("<fdData>(.*)</fdData>"), body).group(1))
+            if querystring["type"] == ["zip"]:
+                self.assertEqual(path, "/~/configs/")
+                zf = zipfile.ZipFile(six.BytesIO(data))
+                archives.append(dict((name, zf.read(name)) for name in zf.namelist()))
+            else:
+                files[path] = data
+        self.assertEqual(archives, [{"a.txt": six.b("aaaa"), "b.txt": six.b("bbbb")},
+                                    {"sub/c.txt": six.b("cccc")}])
+        self.assertEqual(files, {"/~/configs/sub/large.bin": six.b("x" * 100)})
+
+    def test_delete_many(self):
+        self.prepare_response("GET", "/ws/FileData", GET_DIR3_RESULT)
+        fd_file = list(self.dc.filedata.get_filedata())[0]
+        results = self.dc.filedata.delete_many(["~/dev1", fd_file, "/~/fail"], recursive=True)
+        self.assertEqual(results["~/dev1"], None)
+        self.assertEqual(results[fd_file.get_full_path()], None)
+        self.assertIsInstance(results["/~/fail"], DeviceCloudHttpException)
+        self.assertEqual(sorted(path for _, path, _, _ in self.requests),
+                         sorted(["/~/dev1", fd_file.get_full_path(), "/~/fail"]))
+        for _, _, querystring, _ in self.requests:
+            self.assertEqual(querystring, {"recursive": ["true"]})
+
+    def test_object_delete(self):
+        self.prepare_response("GET", "/ws/FileData", GET_DIR3_RESULT)
+        fd_file = list(self.dc.filedata.get_filedata())[0]
+        fd_file.delete()
+        self.assertEqual(self.requests, [("DELETE", fd_file.get_full_path(), {}, six.b(""))])
+
+
 class TestFileDataObject(HttpTestBase):
     def test_file_metadata_access(self):
         self.prepare_response("GET", "/ws/FileData", GET_FILEDATA_SIMPLE)
@@ -198,5 +617,60 @@ class TestFileDataObject(HttpTestBase):
         self.assertEqual(obj.get_data(), None)
 
 
+class TestFileDataDownload(HttpTestBase):
+
+    def setUp(self):
+        HttpTestBase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        HttpTestBase.tearDown(self)
+
+    def _get_files(self):
+        self.prepare_response("GET", "/ws/FileData", GET_DIR3_RESULT)
+        return list(self.dc.filedata.get_filedata(fields=["fdSize"]))
+
+    def test_download(self):
+        fd_file = self._get_files()[0]
+        contents = six.b("x" * 100000)
+        self.prepare_response("GET", "/ws/FileData" + fd_file.get_full_path(), contents)
+        fobj = six.BytesIO()
+        self.assertEqual(fd_file.download(fobj, chunk_size=4096), len(contents))
+        self.assertEqual(fobj.getvalue(), contents)
+        self.assertEqual(fd_file.get_data(), contents)  # fetched on demand (not embedded)
+
+    def test_get_data_not_fetched_by_default(self):
+        self.prepare_response("GET", "/ws/FileData", GET_DIR3_RESULT)
+        fd_file = list(self.dc.filedata.get_filedata())[0]
+        self.assertIsNone(fd_file.get_data())
+        self.prepare_response("GET", "/ws/FileData" + fd_file.get_full_path(), "hello")
+        self.assertEqual(fd_file.get_data(download=True), six.b("hello"))
+
+    def test_download_many(self):
+        files = self._get_files()
+        self.prepare_response("GET", "/ws/FileData" + files[0].get_full_path(), "hello")
+        self.prepare_response("GET", "/ws/FileData/db/missing.txt", "", status=404)
+        missing = type(files[0])(self.dc.filedata, {"fdType": "file", "id": {"fdPath": "/db/", "fdName": "missing.txt"}})
+        progress = []
+        results = self.dc.filedata.download_many(files + [missing], self.tempdir, max_workers=1,
+                                                 progress=lambda *args: progress.append(args))
+        self.assertEqual(progress, [(1, 2), (2, 2)])
+        self.assertIsNone(results[files[0].get_full_path()])
+        self.assertIsNotNone(results["/db/missing.txt"])
+        local_path = os.path.join(self.tempdir, *files[0].get_full_path().split("/"))
+        with open(local_path, "rb") as f:
+            self.assertEqual(f.read(), six.b("hello"))
+        self.assertEqual(os.listdir(os.path.join(self.tempdir, "db")), ["CUS0000033_Spectrum_Design_Solutions__Paul_Osborne"])
+
+    def test_download_many_outside_dest_dir(self):
+        escaping = type(self._get_files()[0])(
+            self.dc.filedata, {"fdType": "file", "id": {"fdPath": "/db/../../", "fdName": "evil.txt"}})
+        dest_dir = os.path.join(self.tempdir, "dest")
+        results = self.dc.filedata.download_many([escaping], dest_dir)
+        self.assertIsInstance(results["/db/../../evil.txt"], ValueError)
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,83 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2014 Etherios, Inc. All rights reserved.
+# Etherios, Inc. is a Division of Digi International.
+import json
+import unittest
+
+from devicecloud.jsonstream import _iter_page_items_pure, _iter_page_items_ijson, ijson
+from devicecloud.test.test_core import TEST_BASIC_RESPONSE
+import six
+
+
+def _chunked(data, size):
+    data = data.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestIterPageItems(unittest.TestCase):
+
+    def test_matches_json_loads(self):
+        expected = json.loads(TEST_BASIC_RESPONSE)
+        expected_items = expected.pop("items")
+        for size in (1, 2, 7, 4096):
+            page = {}
+            items = list(_iter_page_items_pure(_chunked(TEST_BASIC_RESPONSE, size), page))
+            self.assertEqual(items, expected_items)
+            self.assertEqual(page, expected)
+
+    def test_items_yielded_incrementally(self):
+        body = '{"remainingSize": "0", "items": [{"id": 1}, {"id": 2}'  # body not finished
+        page = {}
+        it = _iter_page_items_pure(_chunked(body, 3), page)
+        self.assertEqual(six.next(it), {"id": 1})
+        self.assertEqual(page, {"remainingSize": "0"})
+        self.assertEqual(six.next(it), {"id": 2})
+        self.assertRaises(ValueError, six.next, it)
+
+    def test_numbers_and_text_split_across_chunks(self):
+        body = u'{"items": [12345, 6.25e3, "café \\u2603", true, null, [1, [2]]], "pageCursor": "abc"}'
+        page = {}
+        items = list(_iter_page_items_pure(_chunked(body, 1), page))
+        self.assertEqual(items, [12345, 6250.0, u"café ☃", True, None, [1, [2]]])
+        self.assertEqual(page, {"pageCursor": "abc"})
+
+    def test_escapes_split_across_chunks(self):
+        item = {"text": u'quote " backslash \\ brace } bracket ] end\\', "nested": [{"a": "]}"}]}
+        body = json.dumps({"items": [item, "\\\"", {}], "remainingSize": "0"})
+        for size in (1, 2, 3, 5):
+            page = {}
+            items = list(_iter_page_items_pure(_chunked(body, size), page))
+            self.assertEqual(items, [item, "\\\"", {}])
+            self.assertEqual(page, {"remainingSize": "0"})
+
+    def test_large_item_spanning_many_chunks(self):
+        item = {"data": ["x" * 100] * 5000}
+        body = json.dumps({"items": [item, item]})
+        self.assertEqual(list(_iter_page_items_pure(_chunked(body, 512), {})), [item, item])
+
+    @unittest.skipIf(ijson is None, "ijson is not installed")
+    def test_ijson_matches_json_loads(self):
+        expected = json.loads(TEST_BASIC_RESPONSE)
+        expected_items = expected.pop("items")
+        for size in (1, 7, 4096):
+            page = {}
+            items = list(_iter_page_items_ijson(_chunked(TEST_BASIC_RESPONSE, size), page))
+            self.assertEqual(items, expected_items)
+            self.assertEqual(page, expected)
+        body = '{"items": [6.25, {"x": [1.5, 2]}], "remainingSize": "0"}'
+        items = list(_iter_page_items_ijson(_chunked(body, 3), {}))
+        self.assertEqual(items, json.loads(body)["items"])
+        self.assertEqual([type(items[0]), type(items[1]["x"][0])], [float, float])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, list, _iter_page_items_pure([b'["items"]'], {}))
+        self.assertRaises(ValueError, list, _iter_page_items_pure([b'{"items": [1, 2'], {}))
+        self.assertRaises(ValueError, list, _iter_page_items_pure([b''], {}))
+        self.assertRaises(ValueError, list, _iter_page_items_pure([b'{"items": [{"a": "b'], {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
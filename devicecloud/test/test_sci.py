@@ -5,9 +5,11 @@
 # Copyright (c) 2014 Etherios, Inc. All rights reserved.
 # Etherios, Inc. is a Division of Digi International.
 
+import re
 import unittest
 
-from devicecloud.sci import DeviceTarget
+from devicecloud import DeviceCloudHttpException
+from devicecloud.sci import DeviceTarget, TagTarget, SciJobPoller, SciJobException, iter_device_results
 from devicecloud.test.test_utilities import HttpTestBase
 import httpretty
 import six
@@ -17,6 +19,13 @@ EXAMPLE_SCI_DEVICE_NOT_CONNECTED = """\
 <sci_reply version="1.0"><reboot><device id="00000000-00000000-00409DFF-FF58175B"><error id="2001"><desc>Device Not Connected</desc></error></device></reboot></sci_reply>
 """
 
+EXAMPLE_SCI_DATA_SERVICE = """\
+<sci_reply version="1.0"><data_service>\
+<device id="dev1"><requests><device_request target_name="ping" status="1">unknown target</device_request></requests></device>\
+<device id="dev2"><requests><device_request target_name="ping" status="0">pong</device_request></requests></device>\
+</data_service></sci_reply>
+"""
+
 
 class TestSCI(HttpTestBase):
     def _prepare_sci_response(self, response, status=200):
@@ -39,6 +48,152 @@ class TestSCI(HttpTestBase):
                                '</sci_request>'))
 
 
+    def test_send_sci_options(self):
+        self._prepare_sci_response(EXAMPLE_SCI_DEVICE_NOT_CONNECTED)
+        self.dc.sci.send_sci("reboot", (DeviceTarget(d) for d in ["a", "b"]), "",
+                             reply="none", synchronous=True, sync_timeout=30)
+        self.assertEqual(httpretty.last_request().body,
+                         six.b('<sci_request version="1.0">'
+                               '<reboot reply="none" synchronous="true" syncTimeout="30">'
+                               '<targets><device id="a"/><device id="b"/></targets>'
+                               '</reboot>'
+                               '</sci_request>'))
+        self.assertRaises(TypeError, self.dc.sci.send_sci, "reboot", DeviceTarget("a"), "", sync_timeout="30")
+
+    def test_prepared_request(self):
+        self._prepare_sci_response(EXAMPLE_SCI_DEVICE_NOT_CONNECTED)
+        prepared = self.dc.sci.prepare_sci("send_message", "<reset/>", cache=False)
+        for device_id in ["a", "b"]:
+            self.dc.sci.send_sci("send_message", DeviceTarget(device_id), "<reset/>", cache=False)
+            expected = httpretty.last_request().body
+            prepared.send(DeviceTarget(device_id))
+            self.assertEqual(httpretty.last_request().body, expected)
+        self.assertEqual(prepared.render([DeviceTarget("a"), TagTarget("t")]),
+                         six.b('<sci_request version="1.0"><send_message cache="false">'
+                               '<targets><device id="a"/><device tag="t"/></targets>'
+                               '<reset/></send_message></sci_request>'))
+        result, = prepared.send_results(DeviceTarget("00000000-00000000-00409DFF-FF58175B"))
+        self.assertEqual(result.get_error_id(), "2001")
+        self.assertRaises(TypeError, prepared.render, ["a"])
+        self.assertRaises(TypeError, self.dc.sci.prepare_sci, "send_message", None)
+
+    def test_send_sci_results(self):
+        self._prepare_sci_response(EXAMPLE_SCI_DATA_SERVICE)
+        results = list(self.dc.sci.send_sci_results("data_service", [DeviceTarget("dev1"), DeviceTarget("dev2")],
+                                                    "<requests/>", chunk_size=16))
+        self.assertEqual([(r.get_device_id(), r.is_success()) for r in results], [("dev1", False), ("dev2", True)])
+
+    def test_fan_out(self):
+        attempts = {}
+
+        def handle_request(request, uri, headers):
+            replies = []
+            for device_id in re.findall(r'<device id="([^"]*)"/>', request.body.decode('utf-8')):
+                attempts[device_id] = attempts.get(device_id, 0) + 1
+                if device_id == "missing":
+                    continue
+                if device_id == "offline" or (device_id == "flaky" and attempts[device_id] == 1):
+                    replies.append('<device id="{}"><error id="2001"><desc>Device Not Connected</desc>'
+                                   '</error></device>'.format(device_id))
+                else:
+                    replies.append('<device id="{}"><reset/></device>'.format(device_id))
+            return (200, headers, '<sci_reply version="1.0"><send_message>{}</send_message></sci_reply>'.format(
+                "".join(replies)))
+        self.prepare_response("POST", "/ws/sci", handle_request)
+
+        device_ids = ["a", "b", "flaky", "offline", "missing", "c", "a"]
+        report = self.dc.sci.fan_out("send_message", [DeviceTarget(d) for d in device_ids], "<reset/>",
+                                     batch_size=2, max_workers=1, retries=1)
+        self.assertEqual(report.get_succeeded(), ["a", "b", "flaky", "c"])
+        self.assertEqual(report.get_failed(), ["offline", "missing"])
+        self.assertEqual(report.get_attempts(), 2)
+        self.assertEqual(attempts, {"a": 1, "b": 1, "flaky": 2, "offline": 2, "missing": 2, "c": 1})
+        offline = report.get_results()["offline"]
+        self.assertEqual((offline.get_error_id(), offline.get_error_desc()), ("2001", "Device Not Connected"))
+        self.assertEqual(report.get_results()["a"].get_element().find("reset").tag, "reset")
+
+    def test_fan_out_request_failure(self):
+        self._prepare_sci_response("", status=500)
+        report = self.dc.sci.fan_out("reboot", [DeviceTarget("a"), DeviceTarget("b")], "", max_workers=1)
+        self.assertEqual(report.get_failed(), ["a", "b"])
+        self.assertIsInstance(report.get_results()["a"].get_exception(), DeviceCloudHttpException)
+
+
+class TestIterDeviceResults(unittest.TestCase):
+
+    def test_send_message(self):
+        reply = six.b('<sci_reply version="1.0"><send_message>' +
+                      "".join('<device id="dev{}"><rci_reply version="1.1"><query_setting/></rci_reply></device>'.format(i)
+                              for i in range(100)) +
+                      '</send_message></sci_reply>')
+        chunks = [reply[i:i + 7] for i in range(0, len(reply), 7)]
+        results = list(iter_device_results(chunks))
+        self.assertEqual([r.get_device_id() for r in results], ["dev{}".format(i) for i in range(100)])
+        self.assertTrue(all(r.is_success() for r in results))
+        self.assertEqual(results[0].get_operation(), "send_message")
+        self.assertEqual(results[0].get_payload().tag, "rci_reply")
+
+    def test_errors(self):
+        reply = six.b(EXAMPLE_SCI_DEVICE_NOT_CONNECTED)
+        result, = iter_device_results(reply)
+        self.assertFalse(result.is_success())
+        self.assertEqual((result.get_error_id(), result.get_error_desc()), ("2001", "Device Not Connected"))
+        self.assertIsNone(result.get_payload())
+
+        result, ok = iter_device_results(six.BytesIO(six.b(EXAMPLE_SCI_DATA_SERVICE)))
+        self.assertEqual((result.get_error_id(), result.get_error_desc()), ("1", "unknown target"))
+        self.assertTrue(ok.is_success())
+        self.assertEqual(ok.get_payload().find("device_request").text, "pong")
+
+
+class TestSciJobs(HttpTestBase):
+
+    def setUp(self):
+        HttpTestBase.setUp(self)
+        self.polls = {}
+
+        def submit(request, uri, headers):
+            self.assertIn(six.b('synchronous="false"'), request.body)
+            job_id = str(1000 + len(self.polls))
+            self.polls[job_id] = 0
+            return (200, headers, '<sci_reply version="1.0"><send_message><jobId>{}</jobId></send_message>'
+                                  '</sci_reply>'.format(job_id))
+
+        def poll(request, uri, headers):
+            job_id = uri.rsplit("/", 1)[1]
+            self.polls[job_id] += 1
+            if job_id == "1001":
+                status = "failed"
+            elif self.polls[job_id] < 3:
+                status = "in_progress"
+            else:
+                status = "complete"
+            return (200, headers, '<sci_reply version="1.0" job_id="{}" job_status="{}"><send_message>'
+                                  '<device id="dev{}"><reset/></device></send_message></sci_reply>'.format(
+                                      job_id, status, job_id))
+        self.prepare_response("POST", "/ws/sci", submit)
+        httpretty.register_uri(httpretty.GET, re.compile(r"https://login.etherios.com/ws/sci/\d+"), body=poll)
+
+    def test_send_sci_async(self):
+        job_id = self.dc.sci.send_sci_async("send_message", DeviceTarget("dev"), "<reset/>")
+        self.assertEqual(job_id, "1000")
+        self.assertEqual(self.dc.sci.get_job_status(job_id)[0], "in_progress")
+
+    def test_poller(self):
+        done = []
+        with SciJobPoller(self.dc.sci, min_interval=0.01, max_interval=0.02, max_workers=1) as poller:
+            completed = poller.submit("send_message", DeviceTarget("dev"), "<reset/>",
+                                      callback=lambda job_id, future: done.append(job_id))
+            failed = poller.submit("send_message", DeviceTarget("dev"), "<reset/>")
+            results = completed.result(timeout=5)
+            self.assertRaises(SciJobException, failed.result, 5)
+        self.assertEqual(list(results), ["dev1000"])
+        self.assertTrue(results["dev1000"].is_success())
+        self.assertEqual(self.polls, {"1000": 3, "1001": 1})
+        self.assertEqual(done, ["1000"])
+        self.assertEqual(poller.get_pending_count(), 0)
+        self.assertRaises(SciJobException, poller.watch, "1002")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,86 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2014 Etherios, Inc. All rights reserved.
+# Etherios, Inc. is a Division of Digi International.
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+from devicecloud import snapshot
+from devicecloud.snapshot import SnapshotFormatException
+from devicecloud.test.test_devicecore import EXAMPLE_GET_DEVICES
+from devicecloud.test.test_utilities import HttpTestBase
+
+
+class TestDeviceSnapshot(HttpTestBase):
+
+    def setUp(self):
+        HttpTestBase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "devices.snap")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        HttpTestBase.tearDown(self)
+
+    def _prepare_devices(self, count):
+        devices = copy.deepcopy(EXAMPLE_GET_DEVICES)
+        for i in range(count):
+            device_json = copy.deepcopy(EXAMPLE_GET_DEVICES["items"][0])
+            device_json["id"]["devId"] = str(i)
+            device_json["devConnectwareId"] = "00000000-00000000-00409DFF-FF%06X" % (count - i)
+            devices["items"].append(device_json)
+        devices["resultSize"] = str(len(devices["items"]))
+        self.prepare_json_response("GET", "/ws/DeviceCore", devices)
+
+    def test_export_and_load(self):
+        self._prepare_devices(100)
+        self.assertEqual(self.dc.devicecore.export_snapshot(self.path), 102)
+        with self.dc.devicecore.load_snapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), 102)
+            device = snapshot.get("00000000-00000000-001D09FF-FF2B7D8C")
+            self.assertEqual(device.get_device_id(), "714038")
+            self.assertEqual(device.get_mac(), "00:1d:09:2b:7d:8c")
+            for i in range(100):
+                connectware_id = "00000000-00000000-00409DFF-FF%06X" % (100 - i)
+                self.assertEqual(snapshot.get(connectware_id).get_device_id(), str(i))
+            self.assertIsNone(snapshot.get("00000000-00000000-00000000-00000000"))
+            self.assertNotIn("00000000-00000000-00000000-00000000", snapshot)
+            self.assertEqual([d.get_device_id() for d in snapshot][:2], ["702077", "714038"])
+
+    def test_index_spilled_in_runs(self):
+        self._prepare_devices(100)
+        original = snapshot.INDEX_RUN_ENTRIES
+        snapshot.INDEX_RUN_ENTRIES = 7
+        try:
+            self.assertEqual(self.dc.devicecore.export_snapshot(self.path), 102)
+        finally:
+            snapshot.INDEX_RUN_ENTRIES = original
+        with self.dc.devicecore.load_snapshot(self.path) as loaded:
+            for i in range(100):
+                connectware_id = "00000000-00000000-00409DFF-FF%06X" % (100 - i)
+                self.assertEqual(loaded.get(connectware_id).get_device_id(), str(i))
+            self.assertEqual(loaded.get("00000000-00000000-001D09FF-FF2B7D8C").get_device_id(), "714038")
+
+    def test_failed_write_removes_temp_file(self):
+        devices = copy.deepcopy(EXAMPLE_GET_DEVICES)
+        devices["items"][1]["devConnectwareId"] = "x" * 100  # too long to index
+        self.prepare_json_response("GET", "/ws/DeviceCore", devices)
+        self.assertRaises(ValueError, self.dc.devicecore.export_snapshot, self.path)
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+    def test_load_invalid(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a snapshot at all, but long enough to have a trailer")
+        self.assertRaises(SnapshotFormatException, self.dc.devicecore.load_snapshot, self.path)
+        open(self.path, "wb").close()
+        self.assertRaises(SnapshotFormatException, self.dc.devicecore.load_snapshot, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2014 Etherios, Inc. All rights reserved.
+# Etherios, Inc. is a Division of Digi International.
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from devicecloud.spool import SpoolFullException, SpoolClosedException, SpoolSenderException, \
+    read_segment, SEGMENT_SUFFIX, DEAD_LETTER_SUFFIX
+from devicecloud.streams import DataPoint, DeduplicationFilter, FixedChunkPolicy
+from devicecloud.test.test_utilities import HttpTestBase
+
+
+class TestSpoolingWriter(HttpTestBase):
+
+    def setUp(self):
+        HttpTestBase.setUp(self)
+        self.spool_dir = tempfile.mkdtemp()
+        self.posted = []
+        self.failures = 0
+        self.failure_status = 503
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+        HttpTestBase.tearDown(self)
+
+    def _prepare_write_handler(self):
+        def handle_request(request, uri, headers):
+            if self.failures > 0:
+                self.failures -= 1
+                return (self.failure_status, headers, '')
+            root = ET.fromstring(request.body)
+            self.posted.extend(int(x.text) for x in root.iter('data'))
+            return (200, headers, '<?xml version="1.0" encoding="ISO-8859-1"?><result></result>')
+        self.prepare_response("POST", "/ws/DataPoint", handle_request)
+
+    def _make_datapoints(self, count):
+        return [DataPoint(stream_id="my/stream", data=i) for i in range(count)]
+
+    def _segment_files(self):
+        return [name for name in os.listdir(self.spool_dir) if name.endswith(SEGMENT_SUFFIX)]
+
+    def test_write_and_drain(self):
+        self._prepare_write_handler()
+        writer = self.dc.streams.get_spooling_writer(self.spool_dir, segment_max_datapoints=100)
+        writer.write_many(self._make_datapoints(300))
+        writer.write(DataPoint(stream_id="my/stream", data=300))
+        self.assertTrue(writer.close(timeout=10))
+        self.assertEqual(sorted(self.posted), list(range(301)))
+        self.assertEqual(self._segment_files(), [])
+        stats = writer.get_stats()
+        self.assertEqual(stats["spooled"], 301)
+        self.assertEqual(stats["sent"], 301)
+        self.assertEqual(stats["spool_bytes"], 0)
+
+    def test_replay_on_restart(self):
+        self._prepare_write_handler()
+        writer = self.dc.streams.get_spooling_writer(self.spool_dir, start=False)
+        writer.write_many(self._make_datapoints(10))
+        self.assertFalse(writer.close())  # never started, so nothing was sent
+        self.assertEqual(self.posted, [])
+        self.assertEqual(len(self._segment_files()), 1)
+
+        writer = self.dc.streams.get_spooling_writer(self.spool_dir)
+        self.assertTrue(writer.flush(timeout=10))
+        writer.close()
+        self.assertEqual(self.posted, list(range(10)))
+        self.assertEqual(self._segment_files(), [])
+
+    def test_retry_after_failure(self):
+        self._prepare_write_handler()
+        self.failures = 1
+        writer = self.dc.streams.get_spooling_writer(self.spool_dir, retry_interval=0.01)
+        writer.write_many(self._make_datapoints(5))
+        self.assertTrue(writer.close(timeout=10))
+        self.assertEqual(self.posted, list(range(5)))
+        self.assertEqual(writer.get_stats()["send_failures"], 1)
+
+    def test_rejected_datapoints_dead_lettered(self):
+        self._prepare_write_handler()
+        self.failures = 1
+        self.failure_status = 400
+        writer = self.dc.streams.get_spooling_writer(self.spool_dir, segment_max_datapoints=5)
+        writer.write_many(self._make_datapoints(10))
+        self.assertTrue(writer.close(timeout=10))
+        self.assertEqual(self.posted, list(range(5, 10)))
+        self.assertEqual(self._segment_files(), [])
+        dead_letters = [name for name in os.listdir(self.spool_dir) if name.endswith(DEAD_LETTER_SUFFIX)]
+        self.assertEqual(len(dead_letters), 1)
+        self.assertEqual(len(read_segment(os.path.join(self.spool_dir, dead_letters[0]))), 5)
+        self.assertEqual(writer.get_stats()["dead_lettered"], 5)
+
+    def test_unexpected_error_retried(self):
+        class FailingOncePolicy(FixedChunkPolicy):
+            failed = False
+
+            def get_chunk_size(self, datapoints_xml, start):
+                if not self.failed:
+                    self.failed = True
+                    raise RuntimeError("unexpected")
+                return FixedChunkPolicy.get_chunk_size(self, datapoints_xml, start)
+
+        self._prepare_write_handler()
+        writer = self.dc.streams.get_spooling_writer(self.spool_dir, retry_interval=0.01,
+                                                     chunk_policy=FailingOncePolicy())
+        writer.write_many(self._make_datapoints(5))
+        self.assertTrue(writer.close(timeout=10))
+        self.assertEqual(self.posted, list(range(5)))
+        self.assertEqual(writer.get_stats()["send_failures"], 1)
+
+    def test_sender_died(self):
+        writer = self.dc.streams.get_spooling_writer(self.spool_dir, start=False)
+
+        def next_segment():
+            raise RuntimeError("sender bug")
+        writer._next_segment = next_segment
+        writer.start()
+        writer._thread.join()
+        writer.write_many(self._make_datapoints(5))
+        self.assertRaises(SpoolSenderException, writer.flush, 10)
+        self.assertRaises(SpoolSenderException, writer.close, 10)
+
+    def test_flush_without_sender(self):
+        writer = self.dc.streams.get_spooling_writer(self.spool_dir, start=False)
+        writer.write_many(self._make_datapoints(5))
+        self.assertFalse(writer.flush())  # returns immediately rather than waiting forever
+        writer.close()
+
+    def test_torn_write_discarded(self):
+        writer = self.dc.streams.get_spooling_writer(self.spool_dir, start=False)
+        writer.write_many(self._make_datapoints(3))
+        writer.close()
+        path = os.path.join(self.spool_dir, self._segment_files()[0])
+        with open(path, "ab") as f:
+            f.write(b"\x00\x00\x01\x00garbage")
+        self.assertEqual(len(read_segment(path)), 3)
+
+    def test_spool_full(self):
+        writer = self.dc.streams.get_spooling_writer(self.spool_dir, max_spool_bytes=200, start=False)
+        writer.write(DataPoint(stream_id="my/stream", data=1))
+        self.assertRaises(SpoolFullException, writer.write_many, self._make_datapoints(10))
+        writer.close()
+
+    def test_spool_full_not_recorded_by_dedup(self):
+        dedup = DeduplicationFilter()
+        writer = self.dc.streams.get_spooling_writer(self.spool_dir, max_spool_bytes=150, start=False,
+                                                     dedup=dedup)
+        datapoint = DataPoint(stream_id="my/stream", data=1, timestamp=datetime.datetime(2014, 7, 7))
+        writer.write(DataPoint(stream_id="my/stream", data=1))
+        self.assertRaises(SpoolFullException, writer.write, datapoint)
+        self.assertFalse(dedup.is_duplicate(datapoint))  # rejected, so never recorded
+        writer.close()
+
+    def test_write_after_close(self):
+        writer = self.dc.streams.get_spooling_writer(self.spool_dir, start=False)
+        writer.close()
+        self.assertRaises(SpoolClosedException, writer.write, DataPoint(stream_id="my/stream", data=1))
+
+    def test_write_requires_stream_id(self):
+        writer = self.dc.streams.get_spooling_writer(self.spool_dir, start=False)
+        self.assertRaises(ValueError, writer.write, DataPoint(1))
+        self.assertRaises(TypeError, writer.write_many, [1])
+        writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
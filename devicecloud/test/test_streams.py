@@ -7,11 +7,14 @@
 
 import unittest
 import datetime
+import json
+import time
 import xml.etree.ElementTree as ET
 
 from dateutil.tz import tzutc
 from devicecloud.streams import DataStream, STREAM_TYPE_FLOAT, DataPoint, NoSuchStreamException, ROLLUP_INTERVAL_HALF, \
-    ROLLUP_METHOD_COUNT, STREAM_TYPE_INTEGER
+    ROLLUP_METHOD_COUNT, STREAM_TYPE_INTEGER, FixedChunkPolicy, MaxBytesChunkPolicy, AdaptiveChunkPolicy, \
+    DeduplicationFilter
 from devicecloud.test.test_utilities import HttpTestBase
 from devicecloud import DeviceCloudHttpException
 
@@ -511,6 +514,152 @@ class TestDataStream(HttpTestBase):
 
 
 
+class TestBulkWriteChunkPolicies(HttpTestBase):
+
+    def _prepare_write_handler(self, failures=0, status=500):
+        chunk_sizes = []
+        attempts = []
+        def handle_request(request, uri, headers):
+            attempts.append(request)
+            if len(attempts) <= failures:
+                return (status, headers, '')
+            chunk_sizes.append(len(ET.fromstring(request.body).findall('DataPoint')))
+            return (200, headers, '<?xml version="1.0" encoding="ISO-8859-1"?><result></result>')
+        self.prepare_response("POST", "/ws/DataPoint", handle_request)
+        return chunk_sizes
+
+    def _make_datapoints(self, count, data="x"):
+        return [DataPoint(stream_id="my/stream", data=data) for _ in range(count)]
+
+    def test_fixed_chunk_policy(self):
+        chunk_sizes = self._prepare_write_handler()
+        self.dc.streams.bulk_write_datapoints(self._make_datapoints(25), chunk_policy=FixedChunkPolicy(10))
+        self.assertEqual(chunk_sizes, [10, 10, 5])
+
+    def test_fixed_chunk_policy_limit(self):
+        self.assertRaises(ValueError, FixedChunkPolicy, 251)
+        self.assertRaises(ValueError, FixedChunkPolicy, 0)
+
+    def test_max_bytes_chunk_policy(self):
+        chunk_sizes = self._prepare_write_handler()
+        datapoints = self._make_datapoints(10, data="x" * 1000)
+        self.dc.streams.bulk_write_datapoints(datapoints, chunk_policy=MaxBytesChunkPolicy(3500))
+        self.assertEqual(chunk_sizes, [3, 3, 3, 1])
+
+    def test_max_bytes_chunk_policy_oversized_point(self):
+        chunk_sizes = self._prepare_write_handler()
+        datapoints = self._make_datapoints(2, data="x" * 1000)
+        self.dc.streams.bulk_write_datapoints(datapoints, chunk_policy=MaxBytesChunkPolicy(100))
+        self.assertEqual(chunk_sizes, [1, 1])
+
+    def test_adaptive_chunk_policy_grows(self):
+        chunk_sizes = self._prepare_write_handler()
+        policy = AdaptiveChunkPolicy(initial_datapoints=10, increment=10)
+        self.dc.streams.bulk_write_datapoints(self._make_datapoints(60), chunk_policy=policy)
+        self.assertEqual(chunk_sizes, [10, 20, 30])
+        self.assertEqual(policy.get_current_chunk_size(), 40)
+
+    def test_adaptive_chunk_policy_shrinks_on_slow_requests(self):
+        policy = AdaptiveChunkPolicy(target_latency=1.0, initial_datapoints=100)
+        policy.record_result(100, 10000, 4.0)
+        self.assertEqual(policy.get_current_chunk_size(), 25)
+
+    def test_adaptive_chunk_policy_retries_too_large(self):
+        chunk_sizes = self._prepare_write_handler(failures=1, status=413)
+        policy = AdaptiveChunkPolicy(initial_datapoints=40, increment=0)
+        self.dc.streams.bulk_write_datapoints(self._make_datapoints(40), chunk_policy=policy)
+        self.assertEqual(chunk_sizes, [20, 20])
+
+    def test_adaptive_chunk_policy_raises_server_errors(self):
+        self._prepare_write_handler(failures=1)
+        self.assertRaises(DeviceCloudHttpException, self.dc.streams.bulk_write_datapoints,
+                          self._make_datapoints(40), chunk_policy=AdaptiveChunkPolicy())
+
+    def test_adaptive_chunk_policy_retries_server_errors_if_enabled(self):
+        chunk_sizes = self._prepare_write_handler(failures=1)
+        policy = AdaptiveChunkPolicy(initial_datapoints=40, increment=0, retry_server_errors=True)
+        self.dc.streams.bulk_write_datapoints(self._make_datapoints(40), chunk_policy=policy)
+        self.assertEqual(chunk_sizes, [20, 20])
+
+    def test_max_bytes_counts_encoded_size(self):
+        chunk_sizes = self._prepare_write_handler()
+        datapoints = self._make_datapoints(4, data=u"\u00e9" * 500)  # 1000 bytes as UTF-8
+        self.dc.streams.bulk_write_datapoints(datapoints, chunk_policy=MaxBytesChunkPolicy(2500))
+        self.assertEqual(chunk_sizes, [2, 2])
+
+    def test_adaptive_chunk_policy_raises_client_errors(self):
+        self._prepare_write_handler(failures=1, status=400)
+        self.assertRaises(DeviceCloudHttpException, self.dc.streams.bulk_write_datapoints,
+                          self._make_datapoints(40), chunk_policy=AdaptiveChunkPolicy())
+
+
+class TestDeduplicationFilter(HttpTestBase):
+
+    def _make_datapoint(self, second, data=1, stream_id="my/stream"):
+        return DataPoint(stream_id=stream_id, data=data,
+                         timestamp=datetime.datetime(2014, 7, 7, 14, 10, second, tzinfo=tzutc()))
+
+    def test_bulk_write_drops_duplicates(self):
+        requests = []
+        def handle_request(request, uri, headers):
+            requests.append(request)
+            return (200, headers, '<?xml version="1.0" encoding="ISO-8859-1"?><result></result>')
+        self.prepare_response("POST", "/ws/DataPoint", handle_request)
+
+        dedup = DeduplicationFilter()
+        self.dc.streams.bulk_write_datapoints([self._make_datapoint(i) for i in range(5)], dedup=dedup)
+        self.dc.streams.bulk_write_datapoints([self._make_datapoint(i) for i in range(3, 8)], dedup=dedup)
+        self.assertEqual(len(ET.fromstring(requests[1].body).findall('DataPoint')), 3)
+        self.assertEqual(dedup.get_stats(), {"passed": 8, "suppressed": 2, "tracked": 8})
+
+    def test_failed_write_not_recorded(self):
+        requests = []
+        def handle_request(request, uri, headers):
+            requests.append(request)
+            if len(requests) == 2:
+                return (503, headers, '')
+            return (200, headers, '<?xml version="1.0" encoding="ISO-8859-1"?><result></result>')
+        self.prepare_response("POST", "/ws/DataPoint", handle_request)
+
+        dedup = DeduplicationFilter()
+        datapoints = [self._make_datapoint(i) for i in range(6)]
+        self.assertRaises(DeviceCloudHttpException, self.dc.streams.bulk_write_datapoints,
+                          datapoints, chunk_policy=FixedChunkPolicy(3), dedup=dedup)
+        self.assertEqual(dedup.get_stats()["tracked"], 3)  # only the acknowledged chunk
+
+        # retrying only drops the points which were actually written
+        self.dc.streams.bulk_write_datapoints(datapoints, chunk_policy=FixedChunkPolicy(3), dedup=dedup)
+        self.assertEqual(len(requests), 3)
+        self.assertEqual(len(ET.fromstring(requests[2].body).findall('DataPoint')), 3)
+        self.assertEqual(dedup.get_stats()["tracked"], 6)
+
+    def test_key_includes_stream_and_optionally_data(self):
+        dedup = DeduplicationFilter()
+        self.assertFalse(dedup.is_duplicate(self._make_datapoint(1)))
+        self.assertFalse(dedup.is_duplicate(self._make_datapoint(1, stream_id="other")))
+        self.assertTrue(dedup.is_duplicate(self._make_datapoint(1, data=2)))
+
+        dedup = DeduplicationFilter(include_data=True)
+        self.assertFalse(dedup.is_duplicate(self._make_datapoint(1)))
+        self.assertFalse(dedup.is_duplicate(self._make_datapoint(1, data=2)))
+
+    def test_no_timestamp_never_duplicate(self):
+        dedup = DeduplicationFilter()
+        self.assertEqual(len(dedup.filter([DataPoint(1, stream_id="a"), DataPoint(1, stream_id="a")])), 2)
+
+    def test_bounded(self):
+        dedup = DeduplicationFilter(max_entries=3)
+        dedup.filter([self._make_datapoint(i) for i in range(10)])
+        self.assertEqual(dedup.get_stats()["tracked"], 3)
+        self.assertFalse(dedup.is_duplicate(self._make_datapoint(0)))  # forgotten
+
+        dedup = DeduplicationFilter(window=0.01)
+        dedup.is_duplicate(self._make_datapoint(0))
+        time.sleep(0.02)
+        self.assertFalse(dedup.is_duplicate(self._make_datapoint(0)))  # expired
+        self.assertEqual(dedup.get_stats()["tracked"], 1)
+
+
 class TestDataStreamDeleteDataPoints(HttpTestBase):
 
     def test_delete_datapoint(self):
@@ -570,6 +719,77 @@ class TestDataStreamDeleteDataPoints(HttpTestBase):
         self.assertEqual(self._get_last_request().path, "/ws/DataPoint/test")
 
 
+class TestDataStreamBatchDeleteDataPoints(HttpTestBase):
+
+    def _prepare_delete_handler(self, *paths):
+        requests = []
+        def handle_request(request, uri, headers):
+            requests.append(request.path)
+            return (200, headers, '<?xml version="1.0" encoding="ISO-8859-1"?>\n<result/>')
+        for path in paths:
+            self.prepare_response("DELETE", path, handle_request)
+        return requests
+
+    def _get_all_points(self):
+        # All five points from the paged example in a single page
+        all_points = json.loads(GET_DATA_POINTS_FIVE_PAGED[0])
+        for page in GET_DATA_POINTS_FIVE_PAGED[1:]:
+            all_points["items"].extend(json.loads(page)["items"])
+        all_points["resultSize"] = str(len(all_points["items"]))
+        all_points["requestedSize"] = "1000"
+        return json.dumps(all_points)
+
+    def test_delete_datapoints_by_id(self):
+        requests = self._prepare_delete_handler(
+            "/ws/DataPoint/test/a", "/ws/DataPoint/test/b", "/ws/DataPoint/test/c")
+        test_stream = self.dc.streams.get_stream("test")
+        progress = []
+        results = test_stream.delete_datapoints(["a", "b", "c"], progress=lambda *args: progress.append(args))
+        self.assertEqual(results, {"a": None, "b": None, "c": None})
+        self.assertEqual(sorted(requests), ["/ws/DataPoint/test/a", "/ws/DataPoint/test/b", "/ws/DataPoint/test/c"])
+        self.assertEqual(progress[-1], (3, 3))
+
+    def test_delete_datapoints_bad_input(self):
+        test_stream = self.dc.streams.get_stream("test")
+        self.assertRaises(TypeError, test_stream.delete_datapoints, [5])
+        self.assertRaises(ValueError, test_stream.delete_datapoints, [DataPoint(123)])
+
+    def test_delete_datapoints_failure_reported(self):
+        self.prepare_response("DELETE", "/ws/DataPoint/test/a", "", status=500)
+        test_stream = self.dc.streams.get_stream("test")
+        results = test_stream.delete_datapoints(["a"])
+        self.assertIsInstance(results["a"], DeviceCloudHttpException)
+
+    def test_delete_datapoints_coalesce(self):
+        self.prepare_response("GET", "/ws/DataStream/test", GET_TEST_DATA_STREAM)
+        self.prepare_response("GET", "/ws/DataPoint/test", self._get_all_points())
+        test_stream = self.dc.streams.get_stream("test")
+        points = list(test_stream.read(newest_first=False))
+        self.assertEqual(len(points), 5)
+
+        requests = self._prepare_delete_handler(
+            "/ws/DataPoint/test", "/ws/DataPoint/test/76459cf1-0968-11e4-98e9-fa163ecf1de4")
+        to_delete = points[:3] + points[4:]  # the fourth point is kept
+        results = test_stream.delete_datapoints(to_delete, coalesce=True)
+        self.assertEqual(set(results.keys()), set(dp.get_id() for dp in to_delete))
+        self.assertEqual(sorted(requests), [
+            "/ws/DataPoint/test/76459cf1-0968-11e4-98e9-fa163ecf1de4",
+            "/ws/DataPoint/test?startTime=2014-07-12T02%3A01%3A38.373000Z&endTime=2014-07-12T02%3A01%3A38.844000Z",
+        ])
+
+    def test_streams_api_delete_datapoints(self):
+        requests = self._prepare_delete_handler("/ws/DataPoint/test/a", "/ws/DataPoint/other/stream/b")
+        results = self.dc.streams.delete_datapoints([
+            DataPoint(1, stream_id="test", dp_id="a"),
+            DataPoint(2, stream_id="other/stream", dp_id="b"),
+        ])
+        self.assertEqual(results, {"a": None, "b": None})
+        self.assertEqual(sorted(requests), ["/ws/DataPoint/other/stream/b", "/ws/DataPoint/test/a"])
+
+    def test_streams_api_delete_datapoints_requires_stream_id(self):
+        self.assertRaises(ValueError, self.dc.streams.delete_datapoints, [DataPoint(1, dp_id="a")])
+
+
 class TestDataStreamRead(HttpTestBase):
     def _get_query_params(self, index):
         return httpretty.last_request().querystring  # already parsed to be dict
@@ -623,6 +843,19 @@ class TestDataStreamRead(HttpTestBase):
         self.assertEqual(point5.get_id(), "76459cf1-0968-11e4-98e9-fa163ecf1de4")
         self.assertRaises(StopIteration, six.next, generator)
 
+    def test_simple_read_streaming(self):
+        self.prepare_response("GET", "/ws/DataStream/test", GET_TEST_DATA_STREAM)
+        self.dc.get_connection().enable_streaming_json()
+        test_stream = self.dc.streams.get_stream("test")
+        generator = test_stream.read(page_size=2)
+        self.prepare_response("GET", "/ws/DataPoint/test", GET_DATA_POINTS_FIVE_PAGED[0])
+        self.assertEqual(six.next(generator).get_id(), "75b0e84b-0968-11e4-9041-fa163e8f4b62")
+        self.assertEqual(six.next(generator).get_id(), "75d56063-0968-11e4-9041-fa163e8f4b62")
+        self.prepare_response("GET", "/ws/DataPoint/test", GET_DATA_POINTS_FIVE_PAGED[1])
+        self.assertEqual(six.next(generator).get_id(), "75f8901f-0968-11e4-ab44-fa163e7ebc6b")
+        self.assertEqual(httpretty.last_request().querystring["pageCursor"][0],
+                         json.loads(GET_DATA_POINTS_FIVE_PAGED[0])["pageCursor"])
+
     def test_start_time(self):
         self.prepare_response("GET", "/ws/DataStream/test", GET_TEST_DATA_STREAM)
         self.prepare_response("GET", "/ws/DataPoint/test", GET_DATA_POINTS_ONE)
@@ -0,0 +1,54 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2014 Etherios, Inc. All rights reserved.
+# Etherios, Inc. is a Division of Digi International.
+
+import time
+import unittest
+
+from devicecloud.util import RateLimiter, iter_concurrently
+
+
+class TestIterConcurrently(unittest.TestCase):
+
+    def test_results_and_progress(self):
+        progress = []
+
+        def fn(item):
+            if item == 3:
+                raise ValueError("boom")
+            return item * 2
+
+        results = list(iter_concurrently(fn, [1, 2, 3], max_workers=2,
+                                         progress=lambda *args: progress.append(args)))
+        outcomes = dict((item, (result, exception)) for item, result, exception in results)
+        self.assertEqual(outcomes[1], (2, None))
+        self.assertEqual(outcomes[2], (4, None))
+        self.assertIsInstance(outcomes[3][1], ValueError)
+        self.assertEqual(progress, [(1, 3), (2, 3), (3, 3)])
+
+    def test_progress_total_unknown(self):
+        progress = []
+        list(iter_concurrently(lambda item: item, (i for i in range(2)),
+                               progress=lambda *args: progress.append(args)))
+        self.assertEqual(progress, [(1, None), (2, None)])
+
+    def test_invalid_max_workers(self):
+        self.assertRaises(ValueError, list, iter_concurrently(lambda item: item, [1], max_workers=0))
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(50, burst=2)
+        start = time.time()
+        for _ in range(6):
+            limiter.acquire()
+        # two immediately from the burst, then four more at 50/second
+        self.assertGreaterEqual(time.time() - start, 0.07)
+
+
+if __name__ == "__main__":
+    unittest.main()
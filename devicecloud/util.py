@@ -5,7 +5,10 @@
 # Copyright (c) 2014 Etherios, Inc. All rights reserved.
 # Etherios, Inc. is a Division of Digi International.
 import datetime
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import arrow
 from arrow.parser import DateTimeParser, ParserError
 import six
@@ -84,3 +87,98 @@ def isoformat(dt):
 def dc_utc_timestamp_to_dt(dc_timestamp_in_milleseconds):
     """Return a UTC datetime object"""
     return arrow.Arrow.utcfromtimestamp(dc_timestamp_in_milleseconds / 1000).datetime
+
+
+def iter_concurrently(fn, items, max_workers=4, progress=None, total=None):
+    """Apply ``fn`` to each of ``items`` using a bounded pool of worker threads
+
+    Items are pulled from ``items`` lazily and no more than ``2 * max_workers`` of
+    them will be in flight at any point in time, so ``items`` may be a generator
+    over an arbitrarily large (e.g. paged) result set.
+
+    Results are yielded as each call completes (not necessarily in the order in
+    which items were provided) in the form ``(item, result, exception)``.  If the
+    call raised, ``result`` will be None and ``exception`` will be the exception
+    that was raised; otherwise, ``exception`` will be None.
+
+    :param fn: Callable taking a single item
+    :param items: Iterable of items to be passed to ``fn``
+    :param int max_workers: The maximum number of calls that may be executing at once
+    :param progress: If not None, a callable that will be called as
+        ``progress(num_completed, num_total)`` each time an item completes.  ``num_total``
+        is None if the number of items is not known in advance.
+    :param total: The number of items, if known and ``items`` does not support ``len()``
+
+    """
+    max_workers = validate_type(max_workers, *six.integer_types)
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    total = validate_type(total, type(None), *six.integer_types)
+    if total is None and hasattr(items, "__len__"):
+        total = len(items)
+
+    completed = 0
+    items = iter(items)
+    in_flight = {}  # future -> item
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < max_workers * 2:
+                try:
+                    item = six.next(items)
+                except StopIteration:
+                    exhausted = True
+                else:
+                    in_flight[executor.submit(fn, item)] = item
+            if not in_flight:
+                break
+
+            done, _pending = wait(list(in_flight.keys()), return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                exception = future.exception()
+                result = None if exception is not None else future.result()
+                completed += 1
+                if progress is not None:
+                    progress(completed, total)
+                yield (item, result, exception)
+
+
+class RateLimiter(object):
+    """Token bucket limiting how often an operation may be performed
+
+    Each call to :meth:`acquire` consumes a token, blocking until one is available.
+    Tokens are added at ``rate`` per second up to a maximum of ``burst``, so short
+    bursts of up to ``burst`` calls are allowed after a period of inactivity.  A
+    single limiter may be shared between threads.
+
+    :param rate: The sustained number of operations allowed per second
+    :param int burst: The maximum number of operations which may be performed at once
+
+    """
+
+    def __init__(self, rate, burst=1):
+        rate = validate_type(rate, float, *six.integer_types)
+        burst = validate_type(burst, *six.integer_types)
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+        self._rate = float(rate)
+        self._capacity = float(burst)
+        self._tokens = self._capacity
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until the operation may be performed"""
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self._rate
+            time.sleep(delay)